@@ -0,0 +1,272 @@
+"""Rotation axis estimation from a pair of projections 180 degrees apart.
+
+The projection at 180 degrees is flipped horizontally and correlated with the one at 0 degrees row
+by row with 1D FFTs. The correlations of all rows are summed up to get the axis position, the peak
+is refined to sub-pixel precision either by a parabola fitted to its neighborhood or by evaluating
+the correlation on a fine grid around it directly from the cross-power spectrum. Fitting a line
+through the axis positions of the individual rows gives the axis tilt in the projection plane.
+"""
+import collections
+import functools
+import logging
+import numpy as np
+from tofu.util import next_power_of_two
+
+
+LOG = logging.getLogger(__name__)
+AxisEstimate = collections.namedtuple('AxisEstimate', ['axis', 'tilt', 'rows', 'row_axes'])
+
+
+@functools.lru_cache(maxsize=16)
+def get_fft_plan(width):
+    """Get an :class:`FFTPlan` for rows of *width*, plans are cached for repeated shapes."""
+    return FFTPlan(width)
+
+
+def remove_edge_trend(rows):
+    """Subtract the line going through the first and the last pixel from *rows*, so that they start
+    and end at zero and their edges do not show up as steps in the zero-padded transforms.
+    """
+    ramp = np.linspace(0, 1, rows.shape[-1])
+
+    return rows - rows[..., :1] * (1 - ramp) - rows[..., -1:] * ramp
+
+
+class FFTPlan(object):
+    """Real 1D FFTs of rows of *width* zero-padded to a fast transform length which is long enough
+    to prevent circular wrap-around of the correlation. scipy.fft is used if it is installed (with
+    all CPU cores), numpy.fft otherwise.
+    """
+    def __init__(self, width):
+        try:
+            import scipy.fft
+            self.size = scipy.fft.next_fast_len(2 * width - 1, real=True)
+            self._rfft = functools.partial(scipy.fft.rfft, workers=-1)
+            self._irfft = functools.partial(scipy.fft.irfft, workers=-1)
+        except ImportError:
+            self.size = next_power_of_two(2 * width - 1)
+            self._rfft = np.fft.rfft
+            self._irfft = np.fft.irfft
+        self.width = width
+        num_frequencies = self.size // 2 + 1
+        self.frequencies = np.arange(num_frequencies)
+        # Weights of the half spectrum for evaluating the real inverse transform
+        self.weights = np.full(num_frequencies, 2.)
+        self.weights[0] = 1
+        if self.size % 2 == 0:
+            self.weights[-1] = 1
+        indices = np.arange(self.size)
+        self.shifts = np.where(indices > self.size // 2, indices - self.size, indices)
+
+    def get_overlap(self):
+        """Get the number of overlapping pixels of two rows for all shifts of the transform."""
+        return np.maximum(self.width - np.abs(self.shifts), 0)
+
+    def forward(self, rows):
+        return self._rfft(rows, n=self.size, axis=-1)
+
+    def inverse(self, spectrum):
+        return self._irfft(spectrum, n=self.size, axis=-1)
+
+    def evaluate(self, spectrum, shifts):
+        """Evaluate the inverse transform of half *spectrum* at arbitrary *shifts*."""
+        phases = np.exp(2j * np.pi * np.outer(shifts, self.frequencies) / self.size)
+
+        return (phases * (self.weights * spectrum)).real.sum(axis=1) / self.size
+
+
+def get_cross_spectrum(first, last, plan, method='correlation', regularization=1.):
+    """Get cross-power spectra of *first* rows and horizontally flipped *last* rows. If *method* is
+    'phase', the spectra are whitened for phase correlation. Frequencies with magnitudes below
+    *regularization* times the mean magnitude are damped, otherwise noise and the edges of smooth
+    rows, which are at the same place in both rows, would dominate and pull the peak towards zero
+    shift. The edge trend of the rows is removed for the same reason instead of tapering them by a
+    window common to both rows.
+    """
+    if method == 'phase':
+        first = remove_edge_trend(first)
+        last = remove_edge_trend(last[..., ::-1])
+    else:
+        first = first - first.mean(axis=-1, keepdims=True)
+        last = last[..., ::-1] - last.mean(axis=-1, keepdims=True)
+    spectrum = plan.forward(first) * np.conj(plan.forward(last))
+    if method == 'phase':
+        magnitude = np.abs(spectrum)
+        spectrum /= np.maximum(magnitude + regularization * magnitude.mean(axis=-1, keepdims=True),
+                               np.finfo(np.float32).tiny)
+
+    return spectrum
+
+
+def get_cumulative_moments(data):
+    """Get cumulative sums of mean-subtracted *data* rows and their squares prepended by zeros."""
+    data = data - data.mean(axis=-1, keepdims=True)
+    cumsum = np.zeros((len(data), data.shape[1] + 1))
+    np.cumsum(data, axis=-1, out=cumsum[:, 1:])
+    cumsum_sq = np.zeros_like(cumsum)
+    np.cumsum(np.square(data, dtype=float), axis=-1, out=cumsum_sq[:, 1:])
+
+    return cumsum, cumsum_sq
+
+
+def get_normalized_correlations(first_moments, last_moments, correlations, indices, plan,
+                                min_energy=0.5):
+    """Get normalized cross-correlation coefficients of first rows and flipped last rows, given
+    by their :func:`get_cumulative_moments` *first_moments* and *last_moments*, from their
+    *correlations* at transform *indices* (rows, number of indices). Means and variances are
+    computed only over the overlapping parts, so that neither the means of the rows nor the overlap
+    size bias the peak. Shifts with overlapping parts which contain less than *min_energy* of the
+    variance of the whole rows get -inf, otherwise flat parts of short overlaps would correlate
+    perfectly.
+    """
+    width = plan.width
+    rows = np.arange(len(correlations))[:, np.newaxis]
+    shifts = np.clip(plan.shifts[indices], -width + 1, width - 1)
+    num = width - np.abs(shifts)
+
+    def get_moments(moments, start, stop):
+        cumsum, cumsum_sq = moments
+        total = cumsum[rows, stop] - cumsum[rows, start]
+        variance = cumsum_sq[rows, stop] - cumsum_sq[rows, start] - total ** 2 / num
+
+        return total, variance, cumsum_sq[:, -1:]
+
+    first_sum, first_var, first_energy = get_moments(first_moments, np.maximum(shifts, 0),
+                                                     np.minimum(width + shifts, width))
+    last_sum, last_var, last_energy = get_moments(last_moments, np.maximum(-shifts, 0),
+                                                  np.minimum(width - shifts, width))
+    covariance = correlations[rows, indices] - first_sum * last_sum / num
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = covariance / np.sqrt(first_var * last_var)
+    invalid = ((first_var < min_energy * first_energy) | (last_var < min_energy * last_energy) |
+               ~np.isfinite(result) | ~np.isfinite(correlations[rows, indices]))
+    result[invalid] = -np.inf
+
+    return result
+
+
+def fit_parabola(left, center, right):
+    """Get the sub-pixel offsets of the maxima of parabolas going through *left*, *center* and
+    *right* values, 0 where there is no such maximum.
+    """
+    denominator = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offsets = np.where(np.isfinite(denominator) & (denominator < 0),
+                           0.5 * (left - right) / denominator, 0)
+
+    return np.clip(offsets, -.5, .5)
+
+
+def get_shifts(correlations, plan):
+    """Get sub-pixel shifts of the maxima of *correlations* (rows, transform length) by fitting a
+    parabola through the maximum and its neighbors.
+    """
+    correlations = np.atleast_2d(correlations)
+    rows = np.arange(correlations.shape[0])
+    peaks = np.argmax(correlations, axis=1)
+    offsets = fit_parabola(correlations[rows, (peaks - 1) % plan.size],
+                           correlations[rows, peaks],
+                           correlations[rows, (peaks + 1) % plan.size])
+
+    return plan.shifts[peaks] + offsets
+
+
+def get_normalized_shifts(moments, correlations, peaks, plan, radius=1):
+    """Get sub-pixel shifts of the maxima of normalized cross-correlations of first and flipped
+    last rows in the *radius* neighborhood of *peaks* of their *correlations*. *moments* is a tuple
+    of :func:`get_cumulative_moments` of the first and flipped last rows. If there is only one
+    peak, the normalized correlations of all rows are summed up and one shift is returned.
+    """
+    offsets = np.arange(-radius - 1, radius + 2)
+    indices = (np.reshape(peaks, (-1, 1)) + offsets) % plan.size
+    if indices.shape[0] == 1:
+        indices = np.repeat(indices, len(correlations), axis=0)
+    normalized = get_normalized_correlations(moments[0], moments[1], correlations, indices, plan)
+    if np.size(peaks) == 1:
+        normalized = normalized.sum(axis=0, keepdims=True)
+        indices = indices[:1]
+    rows = np.arange(len(normalized))
+    # Only the inner part of the window can be refined by its neighbors
+    best = np.argmax(normalized[:, 1:-1], axis=1) + 1
+    refined = fit_parabola(normalized[rows, best - 1], normalized[rows, best],
+                           normalized[rows, best + 1])
+
+    return plan.shifts[indices[rows, best]] + refined
+
+
+def refine_shift(spectrum, shift, plan, upsample_factor=100):
+    """Refine *shift* to 1 / *upsample_factor* pixel by evaluating the correlation given by
+    *spectrum* in the +/- one pixel neighborhood of *shift*.
+    """
+    shifts = shift + np.linspace(-1, 1, 2 * upsample_factor + 1)
+
+    return shifts[np.argmax(plan.evaluate(spectrum, shifts))]
+
+
+def select_rows(height, rows=None):
+    """Get row indices from *rows*, which can be None (all rows), the number of equally spaced rows
+    or a sequence of row indices.
+    """
+    if rows is None:
+        return np.arange(height)
+    if np.isscalar(rows):
+        return np.unique(np.linspace(0, height - 1, min(int(rows), height)).astype(int))
+
+    return np.asarray(rows, dtype=int)
+
+
+def estimate_axis(first, last, rows=None, method='correlation', upsample_factor=100,
+                  min_overlap=0.25):
+    """Estimate the rotation axis from projections *first* at 0 degrees and *last* at 180 degrees.
+    Correlate the *rows* given as in :func:`select_rows`. If *method* is 'correlation', use
+    normalized cross-correlation and fit a parabola through its peak, if it is 'phase', use phase
+    correlation, which gives sharper peaks, and refine its peak to 1 / *upsample_factor* pixel.
+    Only shifts for which the flipped projection overlaps with at least *min_overlap* of the width
+    are considered. Return :class:`AxisEstimate` with the *axis* position, its *tilt* in degrees
+    (positive if the axis position increases with the row index), the used *rows* and the axis
+    positions *row_axes* of the individual rows.
+    """
+    if method not in ('correlation', 'phase'):
+        raise ValueError("Unknown axis estimation method `{}'".format(method))
+    first = np.atleast_2d(np.asarray(first, dtype=np.float32))
+    last = np.atleast_2d(np.asarray(last, dtype=np.float32))
+    if first.shape != last.shape:
+        raise ValueError('Projections must have the same shape')
+    rows = select_rows(first.shape[0], rows=rows)
+    first = first[rows]
+    last = last[rows]
+    width = first.shape[1]
+    plan = get_fft_plan(width)
+    spectra = get_cross_spectrum(first, last, plan, method=method)
+    correlations = plan.inverse(spectra)
+    correlations[:, plan.get_overlap() < max(min_overlap * width, 2)] = -np.inf
+    if method == 'phase':
+        shift = get_shifts(correlations.sum(axis=0), plan)[0]
+        if upsample_factor:
+            shift = refine_shift(spectra.sum(axis=0), shift, plan,
+                                 upsample_factor=upsample_factor)
+        row_axes = (get_shifts(correlations, plan) + width) / 2
+    else:
+        # Normalization is expensive, evaluate it only around the peaks of the plain
+        # cross-correlations
+        moments = (get_cumulative_moments(first), get_cumulative_moments(last[:, ::-1]))
+        peak = np.argmax(correlations.sum(axis=0))
+        shift = get_normalized_shifts(moments, correlations, peak, plan, radius=2)[0]
+        row_peaks = np.argmax(correlations, axis=1)
+        row_axes = (get_normalized_shifts(moments, correlations, row_peaks, plan) + width) / 2
+
+    tilt = 0.
+    if len(rows) > 1:
+        # Rows without structure give random positions, weight by their contrast
+        weights = first.std(axis=1) + np.finfo(np.float32).eps
+        median = np.median(row_axes)
+        deviation = np.median(np.abs(row_axes - median))
+        valid = np.abs(row_axes - median) <= 3 * deviation + 1
+        if np.count_nonzero(valid) > 1:
+            slope = np.polyfit(rows[valid], row_axes[valid], 1, w=weights[valid])[0]
+            tilt = float(np.rad2deg(np.arctan(slope)))
+
+    estimate = AxisEstimate(float(shift + width) / 2, tilt, rows, row_axes)
+    LOG.debug('Axis: %g, tilt: %g deg from %d rows', estimate.axis, estimate.tilt, len(rows))
+
+    return estimate
@@ -0,0 +1,410 @@
+"""Reproducible performance benchmarks of tofu commands.
+
+Every benchmark runs one command with fixed parameters on generated data several times and
+reports the median time and the throughput in items (slices, projections, ...) per second. The
+results are stored as JSON together with information about the machine, so that results of two
+versions can be compared by :func:`compare`, which reports throughput regressions larger than a
+threshold. Benchmarks which need UFO are skipped if it is not available.
+"""
+import collections
+import datetime
+import importlib
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+from tofu import __version__, config
+
+
+LOG = logging.getLogger(__name__)
+RESULTS_VERSION = 1
+Benchmark = collections.namedtuple('Benchmark', ['name', 'unit', 'needs_ufo', 'prepare'])
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, unit, needs_ufo=True):
+    """Register a benchmark *name* measuring the throughput in *unit*. The decorated function gets
+    :class:`BenchmarkData` and returns a tuple (function which runs the benchmark once, number of
+    processed items).
+    """
+    def decorator(prepare):
+        BENCHMARKS[name] = Benchmark(name, unit, needs_ufo, prepare)
+        return prepare
+
+    return decorator
+
+
+def has_ufo():
+    try:
+        import gi
+        gi.require_version('Ufo', '0.0')
+        importlib.import_module('gi.repository.Ufo')
+        return True
+    except (ImportError, ValueError):
+        return False
+
+
+def get_cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+
+    return platform.processor()
+
+
+def get_gpus():
+    """Get GPU names reported by nvidia-smi, empty list if there is none."""
+    if not shutil.which('nvidia-smi'):
+        return []
+    try:
+        output = subprocess.check_output(['nvidia-smi', '--query-gpu=name',
+                                          '--format=csv,noheader'], timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return []
+
+    return [line.strip() for line in output.decode().splitlines() if line.strip()]
+
+
+def get_machine_info():
+    """Get a dictionary describing the machine and the software versions."""
+    info = {'hostname': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'tofu': __version__,
+            'cpu': get_cpu_model(),
+            'cpu_count': os.cpu_count(),
+            'gpus': get_gpus(),
+            'ufo': has_ufo()}
+    try:
+        info['memory'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    return info
+
+
+class BenchmarkData(object):
+    """Generated projections, darks, flats and sinograms of *width* x *height* pixels and
+    *num_projections* projections in *directory*. Every data set is written on first use.
+    """
+    def __init__(self, directory, width, height, num_projections):
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.num_projections = num_projections
+        self._projections = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def projections(self):
+        if self._projections is None:
+            rng = np.random.default_rng(0)
+            # Smooth objects with noise, not absorbing more than half of the beam
+            y, x = np.mgrid[:self.height, :self.width]
+            base = 0.25 * (1 + np.sin(2 * np.pi * x / self.width) *
+                           np.cos(2 * np.pi * y / max(self.height, 2)))
+            angles = np.linspace(0, np.pi, self.num_projections, endpoint=False)
+            shifts = (0.1 * self.width * np.sin(angles)).astype(int)
+            absorption = np.array([np.roll(base, shift, axis=1) for shift in shifts])
+            self._projections = (100 + 3000 * np.exp(-absorption) +
+                                 rng.normal(0, 10, absorption.shape)).astype(np.uint16)
+
+        return self._projections
+
+    def write(self, name, images):
+        import tifffile
+
+        directory = self.path(name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            for i, image in enumerate(images):
+                tifffile.imwrite(os.path.join(directory, '{}-{:04}.tif'.format(name, i)), image)
+
+        return directory
+
+    def get_projections(self):
+        return self.write('projections', self.projections)
+
+    def get_darks(self):
+        return self.write('darks', np.full((3, self.height, self.width), 100, dtype=np.uint16))
+
+    def get_flats(self):
+        return self.write('flats', np.full((3, self.height, self.width), 3100, dtype=np.uint16))
+
+    def get_sinograms(self):
+        sinograms = -np.log((self.projections.astype(np.float32) - 100) / 3000)
+
+        return self.write('sinograms', np.ascontiguousarray(sinograms.transpose(1, 0, 2)))
+
+
+def make_args(sections, **kwargs):
+    """Make default command line arguments of config *sections* updated by *kwargs*."""
+    args = config.Params(sections=sections).get_defaults()
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+
+    return args
+
+
+def make_tomo(method, backend):
+    def prepare(data):
+        if backend == 'numpy':
+            from tofu.cpu import tomo
+        else:
+            from tofu.reco import tomo
+
+        args = make_args(config.TOMO_PARAMS, sinograms=data.get_sinograms(), method=method,
+                         backend=backend, dry_run=True)
+
+        return (lambda: tomo(args)), data.height
+
+    return prepare
+
+
+benchmark('tomo-fbp', 'slices')(make_tomo('fbp', 'ufo'))
+benchmark('tomo-dfi', 'slices')(make_tomo('dfi', 'ufo'))
+benchmark('tomo-fbp-numpy', 'slices', needs_ufo=False)(make_tomo('fbp', 'numpy'))
+benchmark('tomo-dfi-numpy', 'slices', needs_ufo=False)(make_tomo('dfi', 'numpy'))
+
+
+def make_genreco(cone):
+    def prepare(data):
+        from tofu import genreco
+
+        kwargs = dict(projections=data.get_projections(), darks=data.get_darks(),
+                      flats=data.get_flats(), absorptivity=True, overall_angle=180,
+                      dry_run=True, output=data.path('genreco'))
+        if cone:
+            kwargs.update(source_position_y=[-4. * data.width], overall_angle=360)
+
+        # genreco converts the arguments in place, every run needs fresh ones
+        return (lambda: genreco.genreco(make_args(config.GEN_RECO_PARAMS, **kwargs))), data.height
+
+    return prepare
+
+
+benchmark('genreco-parallel', 'slices')(make_genreco(False))
+benchmark('genreco-cone', 'slices')(make_genreco(True))
+
+
+@benchmark('lamino', 'slices')
+def prepare_lamino(data):
+    from tofu import lamino
+
+    kwargs = dict(projections=data.get_projections(), darks=data.get_darks(),
+                  flats=data.get_flats(), absorptivity=True,
+                  axis=(data.width / 2., data.height / 2.), lamino_angle=30, overall_angle=180,
+                  dry_run=True, output=data.path('lamino'))
+
+    return (lambda: lamino.lamino(make_args(config.LAMINO_PARAMS, **kwargs))), data.height
+
+
+@benchmark('flat-correction', 'projections')
+def prepare_flat_correction(data):
+    from tofu import preprocess
+
+    args = make_args(('flat-correction',), projections=data.get_projections(),
+                     darks=data.get_darks(), flats=data.get_flats(), absorptivity=True,
+                     output=data.path('flat-corrected/ffc-%05i.tif'))
+
+    return (lambda: preprocess.run_flat_correct(args)), data.num_projections
+
+
+@benchmark('phase-retrieval', 'projections')
+def prepare_phase_retrieval(data):
+    from tofu import preprocess
+
+    args = make_args(config.PREPROC_PARAMS, projections=data.get_projections(),
+                     darks=data.get_darks(), flats=data.get_flats(), energy=20,
+                     propagation_distance=(0.1,), pixel_size=1e-6, delta=1e-7,
+                     output=data.path('phase/phase-%05i.tif'))
+
+    return (lambda: preprocess.run_preprocessing(args)), data.num_projections
+
+
+@benchmark('phase-retrieval-numpy', 'projections', needs_ufo=False)
+def prepare_phase_retrieval_numpy(data):
+    from tofu.phase import PhaseParameters, retrieve_phase
+
+    projections = (data.projections.astype(np.float32) - 100) / 3000
+    parameters = PhaseParameters('tie', 20, (0.1, 0.1), 1e-6, 2, 0.01, 1e30, 1e-7)
+
+    return (lambda: retrieve_phase(projections, parameters)), data.num_projections
+
+
+@benchmark('sinograms', 'sinograms', needs_ufo=False)
+def prepare_sinograms(data):
+    from tofu.sinos import generate_sinograms
+
+    args = make_args(('flat-correction', 'sinos', 'volume-output'),
+                     projections=data.get_projections(), darks=data.get_darks(),
+                     flats=data.get_flats(), absorptivity=True,
+                     output=data.path('generated-sinograms/sino-%05i.tif'))
+
+    def run():
+        generate_sinograms(args)
+
+    return run, data.height
+
+
+@benchmark('ez-stitch-360', 'projections', needs_ufo=False)
+def prepare_ez_stitch(data):
+    from tofu.ez.Helpers.stitch_funcs import main_360_mp_depth1
+
+    input_dir = data.path('stitch-input')
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir)
+        shutil.copytree(data.get_projections(), os.path.join(input_dir, 'tomo'))
+    counter = itertools.count()
+
+    def run():
+        # Stitching does not overwrite existing output
+        output_dir = data.path('stitched-{}'.format(next(counter)))
+        main_360_mp_depth1(input_dir, output_dir, data.width // 4, 0)
+
+    return run, data.num_projections // 2
+
+
+def run_benchmark(bench, data, num_runs=3):
+    """Run *bench* *num_runs* times on :class:`BenchmarkData` *data*, return the result
+    dictionary.
+    """
+    result = {'unit': bench.unit}
+    if bench.needs_ufo and not has_ufo():
+        result.update(status='skipped', error='UFO is not available')
+        return result
+    try:
+        func, num_items = bench.prepare(data)
+        times = []
+        for i in range(num_runs):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    except Exception as error:
+        LOG.error("Benchmark `%s' failed: %s", bench.name, error)
+        result.update(status='failed', error=str(error))
+        return result
+
+    median = statistics.median(times)
+    result.update(status='ok', items=num_items, times=times, best=min(times), median=median,
+                  throughput=num_items / median)
+
+    return result
+
+
+def run_suite(names=None, size=(256, 32, 256), num_runs=3, directory=None):
+    """Run benchmarks *names* (all if None) on generated data with *size* given as (width, height,
+    number of projections) *num_runs* times. The data are written to *directory*, a temporary one
+    which is removed afterwards by default. Return the results dictionary.
+    """
+    names = list(BENCHMARKS) if not names else names
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise RuntimeError("Unknown benchmarks {}, available are {}"
+                           .format(', '.join(unknown), ', '.join(BENCHMARKS)))
+    width, height, num_projections = size
+    results = {'version': RESULTS_VERSION,
+               'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'machine': get_machine_info(),
+               'parameters': {'width': width, 'height': height,
+                              'num_projections': num_projections, 'num_runs': num_runs},
+               'benchmarks': collections.OrderedDict()}
+    tmp_dir = None
+    if directory is None:
+        directory = tmp_dir = tempfile.mkdtemp(prefix='tofu-benchmark-')
+    try:
+        data = BenchmarkData(directory, width, height, num_projections)
+        for name in names:
+            LOG.info("Running benchmark `%s'", name)
+            result = run_benchmark(BENCHMARKS[name], data, num_runs=num_runs)
+            results['benchmarks'][name] = result
+            if result['status'] == 'ok':
+                LOG.info('%s: %.2f %s/s', name, result['throughput'], result['unit'])
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return results
+
+
+def write_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    LOG.info("Benchmark results written to `%s'", filename)
+
+
+def read_results(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise RuntimeError("`{}' is not a tofu benchmark results file".format(filename))
+
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare the throughputs of benchmark *current* results with the *baseline* ones. A
+    benchmark regressed if its throughput decreased by more than *threshold* (relative) or if it
+    failed and succeeded in the baseline. Return a list of (name, baseline throughput, current
+    throughput, relative change, regressed) tuples of benchmarks which succeeded in the baseline,
+    current throughput and change are None if the benchmark did not succeed.
+    """
+    for key in ('cpu', 'gpus', 'hostname'):
+        if baseline['machine'].get(key) != current['machine'].get(key):
+            LOG.warning('Results come from different machines (%s: %s vs. %s)', key,
+                        baseline['machine'].get(key), current['machine'].get(key))
+    if baseline['parameters'] != current['parameters']:
+        LOG.warning('Results come from different benchmark parameters')
+
+    comparison = []
+    for name, old in baseline['benchmarks'].items():
+        new = current['benchmarks'].get(name)
+        if old['status'] != 'ok' or new is None or new['status'] == 'skipped':
+            continue
+        if new['status'] != 'ok':
+            comparison.append((name, old['throughput'], None, None, True))
+            continue
+        change = new['throughput'] / old['throughput'] - 1
+        comparison.append((name, old['throughput'], new['throughput'], change,
+                           change < -threshold))
+
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = ['{:<20} {:>14} {:>14} {:>9}'.format('benchmark', 'baseline', 'current', 'change')]
+    for name, old, new, change, regressed in comparison:
+        lines.append('{:<20} {:>14.2f} {:>14} {:>9} {}'.format(
+            name, old, 'failed' if new is None else '{:.2f}'.format(new),
+            '' if change is None else '{:+.1%}'.format(change),
+            'REGRESSION' if regressed else ''))
+
+    return '\n'.join(lines)
+
+
+def compare_files(baseline_filename, current_filename, threshold=0.1):
+    """Compare results stored in two files and print the comparison, return True if nothing
+    regressed.
+    """
+    comparison = compare(read_results(baseline_filename), read_results(current_filename),
+                         threshold=threshold)
+    print(format_comparison(comparison))
+    regressed = [name for name, old, new, change, regressed in comparison if regressed]
+    if regressed:
+        LOG.error('Throughput regressions beyond %g%%: %s', threshold * 100, ', '.join(regressed))
+
+    return not regressed
@@ -24,7 +24,8 @@ SECTIONS['general'] = {
         'default': 'result-%05i.tif',
         'type': str,
         'help': "Path to location or format-specified file path "
-                "for storing reconstructed slices",
+                "for storing reconstructed slices (reconstructions can also be stored in "
+                "a chunked volume ending with .h5 or .zarr)",
         'metavar': 'PATH'},
     'output-bitdepth': {
         'default': 32,
@@ -145,7 +146,20 @@ SECTIONS['flat-correction'] = {
     'absorptivity': {
         'default': False,
         'action': 'store_true',
-        'help': 'Do absorption correction'}}
+        'help': 'Do absorption correction'},
+    'flat-cache-dir': {
+        'default': None,
+        'type': str,
+        'help': "Cache reduced darks and flats in this directory instead of reducing them in "
+                "every processing graph (caching is disabled by default)",
+        'metavar': 'PATH'},
+    'flat-cache-size': {
+        'default': '4g',
+        'type': convert_filesize,
+        'help': "Maximum size of the flat cache if --flat-cache-dir is given (default 4g), the "
+                "least recently used reduced images are removed, 'k', 'm', 'g', 't' suffixes can "
+                "be used",
+        'metavar': 'BYTES'}}
 
 SECTIONS['retrieve-phase'] = {
     'retrieval-method': {
@@ -200,7 +214,16 @@ SECTIONS['sinos'] = {
     'pass-size': {
         'type': restrict_value((0, None), dtype=int),
         'default': 0,
-        'help': 'Number of sinograms to process per pass'}}
+        'help': 'Number of sinograms to process per pass'},
+    'sinogram-memory': {
+        'type': restrict_value((0, None), dtype=int),
+        'default': None,
+        'help': "Maximum number of bytes of sinogram passes kept in memory, the other passes are "
+                "memory-mapped temporary files (half of the physical memory by default)"},
+    'num-readers': {
+        'type': restrict_value((1, None), dtype=int),
+        'default': None,
+        'help': "Number of threads reading projections (number of CPUs, at most 8, by default)"}}
 
 SECTIONS['reconstruction'] = {
     'sinograms': {
@@ -252,7 +275,22 @@ SECTIONS['tomographic-reconstruction'] = {
         'default': 'fbp',
         'type': str,
         'help': "Reconstruction method",
-        'choices': ['fbp', 'dfi', 'sart', 'sirt', 'sbtv', 'asdpocs']}}
+        'choices': ['fbp', 'dfi', 'sart', 'sirt', 'sbtv', 'asdpocs']},
+    'backend': {
+        'default': 'ufo',
+        'type': str,
+        'help': "Reconstruction backend, numpy reconstructs by fbp, dfi, sart or sirt on "
+                "the CPU",
+        'choices': ['ufo', 'numpy']},
+    'cpu-workers': {
+        'default': None,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of processes of the numpy backend (default: number of CPU cores)"},
+    'batch-size': {
+        'default': None,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of sinograms filtered and backprojected at once by the numpy backend "
+                "(default: as many as fit into 512 MB per process)"}}
 
 SECTIONS['laminographic-reconstruction'] = {
     'angle': {
@@ -337,7 +375,22 @@ SECTIONS['ir'] = {
     'num-iterations': {
         'default': 10,
         'type': restrict_value((0, None), dtype=int),
-        'help': "Maximum number of iterations"}}
+        'help': "Maximum number of iterations"},
+    'num-subsets': {
+        'default': None,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of ordered subsets of projections updated one after another "
+                "(one projection per subset by default, only with the numpy backend)"},
+    'warm-start': {
+        'default': False,
+        'action': 'store_true',
+        'help': "Start the iterations from the filtered backprojection "
+                "(only with the numpy backend)"},
+    'stopping-tolerance': {
+        'default': 0,
+        'type': restrict_value((0, None)),
+        'help': "Stop iterating when the relative change of the residual norm falls below this "
+                "value, 0 disables early stopping (only with the numpy backend)"}}
 
 SECTIONS['sart'] = {
     'relaxation-factor': {
@@ -415,7 +468,38 @@ SECTIONS['perf'] = {
     'num-projection-range': {
         'default': '512',
         'type': range_list,
-        'help': "Number or range of number of projections"}}
+        'help': "Number or range of number of projections"},
+    'batch-sizes': {
+        'default': None,
+        'type': restrict_value((1, None), dtype=int),
+        'nargs': '+',
+        'help': "Batch sizes of the numpy backend to compare, 1 reconstructs one sinogram at "
+                "a time"},
+    'suite': {
+        'default': None,
+        'type': str,
+        'nargs': '*',
+        'help': "Run the benchmark suite, only the given benchmarks if any are specified",
+        'metavar': 'BENCHMARK'},
+    'benchmark-size': {
+        'default': "256,32,256",
+        'type': tupleize(num_items=3, conv=int),
+        'help': "Width, height and number of projections of the generated benchmark data"},
+    'benchmark-output': {
+        'default': None,
+        'type': str,
+        'help': "Write the benchmark suite results as JSON to this file",
+        'metavar': 'FILE'},
+    'compare': {
+        'default': None,
+        'type': str,
+        'nargs': 2,
+        'help': "Compare two benchmark suite result files and fail on throughput regressions",
+        'metavar': ('BASELINE', 'CURRENT')},
+    'regression-threshold': {
+        'default': 0.1,
+        'type': restrict_value((0, None)),
+        'help': "Relative throughput decrease considered a regression"}}
 
 SECTIONS['preprocess'] = {
     'transpose-input': {
@@ -475,6 +559,13 @@ SECTIONS['general-reconstruction'] = {
         'default': False,
         'help': "Enable tracing and store result in .PID.json",
         'action': 'store_true'},
+    'profile': {
+        'default': None,
+        'type': str,
+        'help': "Write timings of the reconstruction steps (wall time per device thread and "
+                "region, projection reading, waiting for output buffers, writing, geometry "
+                "optimization, GPU busy fraction) to this file in Chrome trace JSON format, "
+                "traces enabled by --enable-tracing are merged into it"},
     'disable-cone-beam-weight': {
         'default': False,
         'action': 'store_true',
@@ -482,10 +573,26 @@ SECTIONS['general-reconstruction'] = {
     'slice-memory-coeff': {
         'default': 0.8,
         'type': restrict_value((0.01, 0.95)),
-        'help': "Portion of the GPU memory used for slices (from 0.01 to 0.9) [fraction]. "
-                "The total amount of consumed memory will be larger depending on the "
-                "complexity of the graph. In case of OpenCL memory allocation errors, "
-                "try reducing this value."},
+        'help': "Portion of the GPU memory used for slices, projections and intermediate "
+                "buffers of the preprocessing (from 0.01 to 0.95) [fraction]. The memory needed "
+                "by the projections is estimated from the preprocessing pipeline and the rest "
+                "is used for slices, --dry-run reports the prediction. In case of OpenCL memory "
+                "allocation errors, try reducing this value."},
+    'autotune': {
+        'default': False,
+        'action': 'store_true',
+        'help': "Measure the performance of short dummy data reconstructions with different "
+                "slices per device, GPU threads and data splitting policies, store the best one "
+                "in the tuning database and use it"},
+    'tuning-database': {
+        'default': None,
+        'type': str,
+        'help': "Tuning database file (default is genreco-tuning.json in the user cache "
+                "directory)"},
+    'disable-tuning': {
+        'default': False,
+        'action': 'store_true',
+        'help': "Do not use the tuning database if --slices-per-device is not specified"},
     'num-gpu-threads': {
         'default': 1,
         'type': restrict_value((1, None), dtype=int),
@@ -513,6 +620,42 @@ SECTIONS['general-reconstruction'] = {
         'default': None,
         'type': restrict_value((0, None), dtype=int),
         'help': "Number of slices computed by one computing device"},
+    'read-ahead': {
+        'default': 16,
+        'type': restrict_value((0, None), dtype=int),
+        'help': "Number of projections read ahead by the projection reader shared by all device "
+                "threads, 0 means that every device thread reads the projections itself"},
+    'projection-buffer-size': {
+        'default': 64,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Maximum number of projections kept in memory by the shared projection reader"},
+    'resume': {
+        'default': False,
+        'action': 'store_true',
+        'help': "Skip the regions which an interrupted run of the same reconstruction has "
+                "recorded as finished in the manifest next to the output. Finished regions are "
+                "always recorded, per-region output files are numbered by the first slice of "
+                "the region and single-file output is written in parts which are merged at the "
+                "end"},
+    'region-cache-size': {
+        'default': 256,
+        'type': restrict_value((0, None), dtype=int),
+        'help': "Number of optimized projection regions kept in memory (0 disables caching)"},
+    'cache-projection-regions': {
+        'default': False,
+        'action': 'store_true',
+        'help': "Store optimized projection regions in the output directory, so that subsequent "
+                "runs with the same geometry do not need to compute them again"},
+    'writer-buffers': {
+        'default': 8,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of slice buffers of the single-file output writer"},
+    'writer-scratch-dir': {
+        'default': None,
+        'type': str,
+        'help': "Directory for temporary files of regions which are finished before their "
+                "predecessors by single-file output (system default if not specified)",
+        'metavar': 'PATH'},
     'gpus': {
         'default': None,
         'nargs': '+',
@@ -670,18 +813,90 @@ SECTIONS['find-large-spots'] = {
         'help': "Padded values assignment for the filtered input image"},
     }
 
-TOMO_PARAMS = ('flat-correction', 'reconstruction', 'tomographic-reconstruction', 'fbp', 'dfi', 'ir', 'sart', 'sbtv')
+SECTIONS['volume-output'] = {
+    'output-chunk-slices': {
+        'default': 1,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of slices per chunk of HDF5 (.h5) or Zarr (.zarr) volume output"},
+    'output-compression': {
+        'default': 'none',
+        'type': str,
+        'help': "Compression of HDF5 (.h5) or Zarr (.zarr) volume output (lzf only for HDF5)",
+        'choices': ['none', 'gzip', 'lzf']}}
+
+SECTIONS['distributed-reconstruction'] = {
+    'coordinator': {
+        'default': None,
+        'type': str,
+        'help': "Do not reconstruct but hand out parts of the volume to workers connecting to "
+                "this HOST:PORT or Unix socket path",
+        'metavar': 'ADDRESS'},
+    'worker': {
+        'default': None,
+        'type': str,
+        'help': "Reconstruct parts of the volume handed out by the coordinator at this HOST:PORT "
+                "or Unix socket path, the other arguments must be the same as the coordinator's",
+        'metavar': 'ADDRESS'},
+    'work-item-slices': {
+        'default': 64,
+        'type': restrict_value((1, None), dtype=int),
+        'help': "Number of slices of one work item handed out by the coordinator"},
+    'worker-timeout': {
+        'default': 60,
+        'type': restrict_value((1, None)),
+        'help': "Time after which a worker which does not respond is considered dead and its "
+                "work items are handed out again [s]"}}
+
+SECTIONS['sweep'] = {
+    'sweep-parameter': {
+        'default': 'regularization-rate',
+        'type': str,
+        'choices': ['regularization-rate', 'propagation-distance'],
+        'help': "Phase retrieval parameter to vary"},
+    'sweep-region': {
+        'default': None,
+        'type': tupleize(num_items=3),
+        'help': "Values of the swept parameter as from,to,step"},
+    'sweep-rows': {
+        'default': None,
+        'type': tupleize(conv=int),
+        'help': "Rows of the read projections reconstructed for every value (default: middle row)"}}
+
+SECTIONS['server'] = {
+    'server': {
+        'default': None,
+        'type': str,
+        'help': "Run the command by the tofu server listening at this HOST:PORT or Unix socket "
+                "path instead of in this process, relative paths are relative to this directory",
+        'metavar': 'ADDRESS'}}
+
+SECTIONS['serve'] = {
+    'address': {
+        'default': 'tofu.sock',
+        'type': str,
+        'help': "HOST:PORT or Unix socket path the server listens on"},
+    'preload-tasks': {
+        'default': 'read,flat-field-correct,fft,filter,ifft,backproject,write',
+        'type': tupleize(conv=str),
+        'help': "UFO tasks whose plugins are loaded when the server starts"}}
+
+TOMO_PARAMS = ('flat-correction', 'reconstruction', 'tomographic-reconstruction', 'fbp', 'dfi', 'ir', 'sart', 'sbtv',
+               'volume-output')
 
 PREPROC_PARAMS = ('preprocess', 'cone-beam-weight', 'flat-correction', 'retrieve-phase')
 LAMINO_PARAMS = PREPROC_PARAMS + ('laminographic-reconstruction',)
-GEN_RECO_PARAMS = PREPROC_PARAMS + ('general-reconstruction',)
+GEN_RECO_PARAMS = PREPROC_PARAMS + ('general-reconstruction', 'volume-output',
+                                    'distributed-reconstruction')
+SWEEP_PARAMS = TOMO_PARAMS + ('retrieve-phase', 'sweep')
 
 NICE_NAMES = ('General', 'Input', 'Flat field correction', 'Phase retrieval',
               'Sinogram generation', 'General reconstruction', 'Tomographic reconstruction',
               'Laminographic reconstruction', 'Filtered backprojection',
               'Direct Fourier Inversion', 'Iterative reconstruction',
               'SART', 'SBTV', 'GUI settings', 'Estimation', 'Performance',
-              'Preprocess', 'Cone beam weight', 'General reconstruction', 'Find large spots')
+              'Preprocess', 'Cone beam weight', 'General reconstruction', 'Find large spots',
+              'Volume output', 'Distributed reconstruction', 'Parameter sweep', 'Server client',
+              'Server')
 
 def get_config_name():
     """Get the command line --config option."""
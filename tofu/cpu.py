@@ -0,0 +1,675 @@
+"""NumPy implementations of reconstruction steps for machines without a usable GPU.
+
+:func:`tomo` is the numpy backend of ``tofu tomo``, it reconstructs by filtered backprojection or
+direct Fourier inversion with the same input, padding, cropping and output as the UFO graphs of
+:func:`tofu.reco.tomo`. The slices are split into chunks which are read, filtered and
+backprojected by a pool of worker processes, all slices of a chunk at once. The iterative methods
+use ordered-subset SART with a linear interpolation projector whose transpose is the
+backprojection.
+"""
+import collections
+import functools
+import itertools
+import logging
+import os
+import time
+import numpy as np
+from tofu.projections import ProjectionSource
+from tofu.util import get_filenames, get_filtering_padding, next_power_of_two, reduce_images
+from tofu.volume import get_volume_writer, is_volume_output
+
+
+LOG = logging.getLogger(__name__)
+# Maximum number of bytes of temporary data of one chunk of slices
+CHUNK_BYTES = 2 ** 29
+# NumPy padding modes of the UFO addressing modes
+PADDING_MODES = {'none': 'constant', 'clamp': 'constant', 'clamp_to_edge': 'edge',
+                 'repeat': 'wrap', 'mirrored_repeat': 'symmetric'}
+
+
+def get_angles(num_projections, angle_step=None, offset=0):
+    """Get projection angles of *num_projections* projections separated by *angle_step* (pi /
+    *num_projections* if not specified) and starting at *offset*.
+    """
+    if not angle_step:
+        angle_step = np.pi / num_projections
+
+    return offset + angle_step * np.arange(num_projections)
+
+
+def get_filter(name, size, cutoff=0.5):
+    """Get the frequency response of projection filter *name* for real FFTs of *size*, i.e. size //
+    2 + 1 values. *cutoff* is relative to the sampling frequency, so 0.5 is the Nyquist frequency.
+    """
+    frequencies = np.fft.rfftfreq(size)
+    ramp = np.abs(frequencies)
+    if name == 'none':
+        return np.ones_like(frequencies)
+    if name == 'ramp':
+        return ramp
+    if name == 'ramp-fromreal':
+        # Band-limited ramp sampled in real space, which gets the DC component right
+        offsets = np.fft.fftfreq(size, d=1 / size)
+        kernel = np.zeros(size)
+        kernel[0] = 0.25
+        odd = offsets % 2 == 1
+        kernel[odd] = -1 / (np.pi * offsets[odd]) ** 2
+        return np.fft.rfft(kernel).real
+    if name == 'butterworth':
+        return ramp / (1 + (frequencies / cutoff) ** 8)
+    if name == 'hamming':
+        return np.where(frequencies <= cutoff,
+                        ramp * (0.54 + 0.46 * np.cos(np.pi * frequencies / cutoff)), 0)
+
+    raise RuntimeError("Projection filter `{}' is not supported by the numpy backend".format(name))
+
+
+def filter_sinograms(sinograms, name='ramp', cutoff=0.5, padding_mode='clamp_to_edge', crop=True):
+    """Filter the rows of *sinograms* (..., projections, width) by projection filter *name* with
+    *cutoff*. The rows are padded like in the fbp graph of tofu tomo to the next power of two of
+    twice the width with the data in the middle and the padded values given by UFO *padding_mode*.
+    If *crop* is False, return the padded rows.
+    """
+    sinograms = np.asarray(sinograms, dtype=np.float32)
+    width = sinograms.shape[-1]
+    padding = get_filtering_padding(width)
+    pad_width = [(0, 0)] * (sinograms.ndim - 1) + [(padding // 2, padding - padding // 2)]
+    padded = np.pad(sinograms, pad_width, mode=PADDING_MODES[padding_mode])
+    size = padded.shape[-1]
+    filtered = np.fft.irfft(np.fft.rfft(padded, axis=-1) * get_filter(name, size, cutoff=cutoff),
+                            n=size, axis=-1).astype(np.float32)
+
+    return filtered[..., padding // 2:padding // 2 + width] if crop else filtered
+
+
+def get_detector_positions(angle, coords, axis, detector_width):
+    """Get the positions of slice pixels with *coords* relative to *axis* projected at *angle* on
+    the detector of *detector_width* padded by one zero pixel on both sides. Return a tuple
+    (index of the left neighbor, weight of the right neighbor) of the linear interpolation.
+    """
+    # Texel coordinate to padded index, pixel i has its center at i + 0.5
+    position = np.add.outer(coords * np.float32(np.sin(angle)),
+                            coords * np.float32(np.cos(angle))) + np.float32(axis + 0.5)
+    np.clip(position, 0, detector_width + 1, out=position)
+    index = np.minimum(position.astype(np.intp), detector_width)
+
+    return index, position - index
+
+
+def _backproject(sinograms, axis, angles, width=None, x_offset=0):
+    """Unscaled :func:`backproject_slices`."""
+    sinograms = np.asarray(sinograms, dtype=np.float32)
+    num_slices, num_projections, detector_width = sinograms.shape
+    width = width or detector_width
+    coords = np.arange(x_offset, x_offset + width, dtype=np.float32) - axis + 0.5
+    # Slices are the last dimension, so that one interpolation gathers contiguous values of all of
+    # them and the positions are computed only once for the whole batch. The detector is padded by
+    # zero, so that positions outside of it contribute nothing.
+    padded = np.zeros((num_projections, detector_width + 2, num_slices), dtype=np.float32)
+    padded[:, 1:-1] = sinograms.transpose(1, 2, 0)
+    result = np.zeros((width, width, num_slices), dtype=np.float32)
+
+    for i, angle in enumerate(angles):
+        index, weight = get_detector_positions(angle, coords, axis, detector_width)
+        weight = weight[..., np.newaxis]
+        row = padded[i]
+        values = row[index]
+        values += weight * (row[index + 1] - values)
+        result += values
+
+    return np.ascontiguousarray(result.transpose(2, 0, 1))
+
+
+def backproject_slices(sinograms, axis, angles, width=None, x_offset=0):
+    """Backproject filtered *sinograms* (slices, projections, detector width) acquired at *angles*
+    around *axis* like the UFO backproject task, i.e. pixel (x, y) of a slice is projected to the
+    detector position axis + (x - axis + 0.5) * cos + (y - axis + 0.5) * sin in texel coordinates.
+    Return slices (slices, *width*, *width*) where *width* defaults to the detector width. The
+    slice pixels start at *x_offset* in both directions, which gives a cropped part of a larger
+    slice.
+    """
+    num_projections = np.shape(sinograms)[1]
+
+    return _backproject(sinograms, axis, angles, width=width,
+                        x_offset=x_offset) * np.float32(np.pi / num_projections)
+
+
+def reconstruct_centers(sinogram, centers, angle_step=None, filter_name='ramp', cutoff=0.5):
+    """Reconstruct *sinogram* (projections, width) by filtered backprojection with projection
+    filter *filter_name* and *cutoff* for every rotation axis position in *centers*, which follow
+    the conventions of :func:`backproject_slices`. Every slice is centered on its axis. Return an
+    array (centers, width, width).
+    """
+    num_projections, width = sinogram.shape
+    angles = get_angles(num_projections, angle_step=angle_step)
+    filtered = filter_sinograms(sinogram[np.newaxis], name=filter_name, cutoff=cutoff)
+    result = np.empty((len(centers), width, width), dtype=np.float32)
+    for i, center in enumerate(centers):
+        result[i] = backproject_slices(filtered, center, angles,
+                                       x_offset=center - width // 2)[0]
+
+    return result
+
+
+def forward_project_slices(slices, axis, angles, detector_width=None):
+    """Project *slices* (slices, width, width) at *angles* around *axis* onto a detector of
+    *detector_width* (slice width by default). This is the transpose of the unscaled
+    :func:`backproject_slices`, every pixel is distributed between the two detector pixels next to
+    its projected position. Return sinograms (slices, projections, detector width).
+    """
+    slices = np.asarray(slices, dtype=np.float32)
+    num_slices, width = slices.shape[:2]
+    detector_width = detector_width or width
+    coords = np.arange(width, dtype=np.float32) - axis + 0.5
+    values = slices.reshape(num_slices, -1).T
+    slice_indices = np.arange(num_slices)
+    size = (detector_width + 2) * num_slices
+    result = np.empty((num_slices, len(angles), detector_width), dtype=np.float32)
+
+    for i, angle in enumerate(angles):
+        index, weight = get_detector_positions(angle, coords, axis, detector_width)
+        # One bincount for all slices, which are the fastest varying index of the bins
+        bins = (index.reshape(-1, 1) * num_slices + slice_indices).ravel()
+        upper = weight.reshape(-1, 1) * values
+        projection = (np.bincount(bins, weights=(values - upper).ravel(), minlength=size) +
+                      np.bincount(bins + num_slices, weights=upper.ravel(), minlength=size))
+        result[:, i] = projection.reshape(detector_width + 2, num_slices)[1:-1].T
+
+    return result
+
+
+def reconstruct_iterative(sinograms, axis, angle_step=None, angle_offset=0, num_subsets=None,
+                          num_iterations=10, relaxation_factor=0.25, initial=None,
+                          tolerance=0):
+    """Reconstruct *sinograms* (slices, projections, width) around *axis* by ordered-subset SART.
+    The projections are split into *num_subsets* interleaved subsets (one projection per subset by
+    default, one subset is SIRT) and the slices are updated with *relaxation_factor* after every
+    subset. Iterate at most *num_iterations* times starting from *initial* slices (zeros by
+    default), stop earlier when the relative change of the residual norm between two iterations
+    is smaller than *tolerance*. Return a tuple (slices, residual norms relative to the sinogram
+    norm of all iterations).
+    """
+    sinograms = np.asarray(sinograms, dtype=np.float32)
+    num_slices, num_projections, width = sinograms.shape
+    angles = get_angles(num_projections, angle_step=angle_step, offset=angle_offset)
+    num_subsets = min(num_subsets or num_projections, num_projections)
+    subsets = [np.arange(start, num_projections, num_subsets) for start in range(num_subsets)]
+    if initial is None:
+        slices = np.zeros((num_slices, width, width), dtype=np.float32)
+    else:
+        slices = np.array(initial, dtype=np.float32)
+
+    def invert(values):
+        with np.errstate(divide='ignore'):
+            return np.where(values > 0, 1 / values, 0).astype(np.float32)
+
+    # Ray lengths through the slice and the sums of backprojected weights of every subset
+    ones = np.ones((1, width, width), dtype=np.float32)
+    inverse_lengths = invert(forward_project_slices(ones, axis, angles, width)[0])
+    inverse_sums = [invert(_backproject(np.ones((1, len(subset), width), dtype=np.float32),
+                                        axis, angles[subset])[0]) for subset in subsets]
+    norm = max(float(np.linalg.norm(sinograms)), np.finfo(np.float32).tiny)
+    residuals = []
+
+    for iteration in range(num_iterations):
+        squared_residual = 0
+        for subset, inverse_sum in zip(subsets, inverse_sums):
+            difference = sinograms[:, subset] - forward_project_slices(slices, axis,
+                                                                       angles[subset], width)
+            squared_residual += float(np.sum(difference ** 2))
+            difference *= inverse_lengths[subset]
+            slices += relaxation_factor * inverse_sum * _backproject(difference, axis,
+                                                                     angles[subset])
+        residuals.append(np.sqrt(squared_residual) / norm)
+        LOG.debug('Iteration %d: relative residual %g', iteration, residuals[-1])
+        if (tolerance and len(residuals) > 1 and
+                abs(residuals[-2] - residuals[-1]) < tolerance * residuals[-2]):
+            LOG.debug('Residual converged after %d iterations', iteration + 1)
+            break
+
+    return slices, residuals
+
+
+@functools.lru_cache(maxsize=4)
+def get_dfi_grid(size, num_projections, angle_step, angle_offset=0):
+    """Get the interpolation of the *size* x *size* Cartesian frequency grid in numpy.fft order from
+    the spectra of *num_projections* projections starting at *angle_offset* separated by
+    *angle_step*. Return a tuple (lower projection, upper projection, angular weight, radius of the
+    lower and radius of the upper projection), radii are negative where the conjugate spectrum at
+    the absolute radius applies. The projection after the last one is the first one with the radius
+    flipped.
+    """
+    frequencies = np.fft.fftfreq(size, d=1 / size)
+    y, x = np.meshgrid(frequencies, frequencies, indexing='ij')
+    theta = np.arctan2(y, x) - angle_offset
+    radius = np.hypot(x, y)
+    # Map the angles to [0, pi), a projection at theta + pi is the flipped one at theta
+    turns = np.floor(theta / np.pi)
+    theta -= turns * np.pi
+    radius[turns % 2 == 1] *= -1
+    position = np.minimum(theta / angle_step, num_projections)
+    lower = np.minimum(np.floor(position).astype(np.intp), num_projections - 1)
+    weight = (position - lower).astype(np.float32)
+    upper = lower + 1
+    upper_radius = radius.copy()
+    wrapped = upper == num_projections
+    upper[wrapped] = 0
+    upper_radius[wrapped] *= -1
+
+    return lower, upper, weight, radius.astype(np.float32), upper_radius.astype(np.float32)
+
+
+def reconstruct_dfi(sinograms, axis, angle_step=None, angle_offset=0, oversampling=1):
+    """Reconstruct *sinograms* (slices, projections, width) of a 180 degree scan by direct Fourier
+    inversion like the dfi graph of tofu tomo. The sinograms are zero-padded to the next power of
+    two of the width times *oversampling* with *axis* shifted to the origin, their spectra are
+    interpolated onto a Cartesian grid and transformed back. Return the center of the slices
+    (slices, width, width) on the same pixel grid as the filtered backprojection.
+    """
+    sinograms = np.asarray(sinograms, dtype=np.float32)
+    num_projections, width = sinograms.shape[1:]
+    angle_step = angle_step or np.pi / num_projections
+    size = next_power_of_two(width) * (oversampling or 1)
+    half = size // 2
+    frequencies = np.arange(half + 1)
+    # The rotation center in pixel indices goes to the origin, which makes the spectra smooth
+    spectra = np.fft.rfft(sinograms, n=size, axis=-1)
+    spectra *= np.exp(2j * np.pi * frequencies * (axis - 0.5) / size)
+    spectra = spectra.astype(np.complex64)
+    lower, upper, weight, lower_radius, upper_radius = get_dfi_grid(size, num_projections,
+                                                                    angle_step, angle_offset)
+
+    def sample(projections, radius):
+        magnitude = np.abs(radius)
+        index = np.minimum(magnitude.astype(np.intp), half - 1)
+        fraction = magnitude - index
+        values = ((1 - fraction) * spectra[:, projections, index] +
+                  fraction * spectra[:, projections, index + 1])
+        values = np.where(radius < 0, np.conj(values), values)
+
+        return values * (magnitude <= half)
+
+    grid = (1 - weight) * sample(lower, lower_radius) + weight * sample(upper, upper_radius)
+    # Evaluate the slice at pixel centers, which are half a pixel off the rotation center
+    frequencies = np.fft.fftfreq(size, d=1 / size)
+    grid *= np.exp(1j * np.pi * np.add.outer(frequencies, frequencies) / size).astype(np.complex64)
+    slices = np.fft.fftshift(np.fft.ifft2(grid).real, axes=(-2, -1))
+    start = (size - width) // 2
+
+    return slices[:, start:start + width, start:start + width].astype(np.float32)
+
+
+def reconstruct_slices(sinograms, axis, method='fbp', angle_step=None, angle_offset=0,
+                       projection_filter='ramp-fromreal', cutoff=0.5,
+                       padding_mode='clamp_to_edge', crop_after='backprojection', oversampling=1,
+                       num_subsets=None, num_iterations=10, relaxation_factor=0.25,
+                       warm_start=False, tolerance=0):
+    """Reconstruct *sinograms* (slices, projections, width) around *axis* by *method* 'fbp' or
+    'dfi' like the respective graph of tofu tomo or iteratively by 'sart' or 'sirt' (see
+    :func:`reconstruct_iterative`, the iterations start from the filtered backprojection if
+    *warm_start* is True). Return slices (slices, width, width).
+    """
+    num_projections, width = sinograms.shape[1:]
+    if method in ('sart', 'sirt'):
+        initial = None
+        if warm_start:
+            initial = reconstruct_slices(sinograms, axis, angle_step=angle_step,
+                                         angle_offset=angle_offset,
+                                         projection_filter=projection_filter, cutoff=cutoff,
+                                         padding_mode=padding_mode, crop_after=crop_after)
+        return reconstruct_iterative(sinograms, axis, angle_step=angle_step,
+                                     angle_offset=angle_offset,
+                                     num_subsets=1 if method == 'sirt' else num_subsets,
+                                     num_iterations=num_iterations,
+                                     relaxation_factor=relaxation_factor, initial=initial,
+                                     tolerance=tolerance)[0]
+    if method == 'dfi':
+        return reconstruct_dfi(sinograms, axis, angle_step=angle_step, angle_offset=angle_offset,
+                               oversampling=oversampling)
+
+    angles = get_angles(num_projections, angle_step=angle_step, offset=angle_offset)
+    if crop_after == 'filter':
+        filtered = filter_sinograms(sinograms, name=projection_filter, cutoff=cutoff,
+                                    padding_mode=padding_mode)
+        return backproject_slices(filtered, axis, angles)
+
+    filtered = filter_sinograms(sinograms, name=projection_filter, cutoff=cutoff,
+                                padding_mode=padding_mode, crop=False)
+    padding = get_filtering_padding(width)
+    # Backproject only the part of the padded slice which the crop after backprojection keeps
+    return backproject_slices(filtered, axis + padding / 2, angles, width=width,
+                              x_offset=padding // 2)
+
+
+def bin_image(image, size):
+    """Average *size* x *size* blocks of the last two dimensions of *image*, incomplete blocks at
+    the edges are dropped.
+    """
+    if size == 1:
+        return image
+    height = image.shape[-2] // size
+    width = image.shape[-1] // size
+    image = image[..., :height * size, :width * size]
+
+    return image.reshape(image.shape[:-2] + (height, size, width, size)).mean(axis=(-3, -1))
+
+
+class SliceReader(object):
+    """Read the input of :func:`tomo` given by *params* as stacks of sinograms, either from
+    sinograms, projections (flat corrected if there are darks and flats and binned by
+    params.resize) or zeros of params.width x params.height if there is no input. Instances are sent
+    to the worker processes, which read their slices themselves.
+    """
+    def __init__(self, params):
+        self.sinograms = params.sinograms
+        self.resize = (params.resize or 1) if params.projections else 1
+        self.dark = self.flat = self.flat2 = None
+        self.absorptivity = params.absorptivity
+        self.fix_nan_and_inf = params.fix_nan_and_inf
+        path = params.projections or params.sinograms
+        if path:
+            self.images = ProjectionSource.from_path(path, start=params.start,
+                                                     number=params.number, step=params.step)
+            if not len(self.images):
+                raise RuntimeError("No images found in `{}'".format(path))
+            height, self.full_width = self.images.shape
+            self.rows = range(params.y, min(params.y + (params.height or height - params.y),
+                                            height), params.y_step)
+        else:
+            if params.width is None or params.height is None:
+                raise RuntimeError("You have to specify --width and --height when generating data.")
+            self.images = None
+            self.full_width = params.width
+            self.rows = range(params.height)
+
+        self.width = self.full_width // self.resize
+        if params.projections:
+            self.num_slices = len(self.rows) // self.resize
+            self.num_projections = len(self.images)
+            if params.darks and params.flats:
+                self._reduce_flats(params)
+        else:
+            self.num_slices = len(self.images) if self.images is not None else params.number or 1
+            self.num_projections = len(self.rows)
+
+    def _reduce_flats(self, params):
+        mode = params.reduction_mode.lower()
+        if mode not in ('median', 'average'):
+            raise ValueError('Invalid reduction mode')
+        LOG.debug("Doing flat field correction using reduction mode `{}'".format(mode))
+
+        def reduce(path, scale):
+            reduced = reduce_images(get_filenames(path), mode, y=self.rows[0],
+                                    height=len(self.rows), y_step=params.y_step)
+            return scale * bin_image(reduced, self.resize)
+
+        self.dark = reduce(params.darks, params.dark_scale)
+        self.flat = reduce(params.flats, params.flat_scale)
+        if params.flats2:
+            self.flat2 = reduce(params.flats2, params.flat_scale)
+
+    def _read_rows(self, index, rows):
+        # A slice of a memory-mapped projection touches only the bytes of the rows
+        rows = slice(rows.start, rows.stop, rows.step)
+
+        return np.asarray(self.images.get(index, rows), dtype=np.float32)
+
+    def _correct(self, projection, index, start, stop):
+        """Flat correct binned rows *start* to *stop* of *projection* number *index*."""
+        dark = self.dark[start:stop]
+        flat = self.flat[start:stop]
+        if self.flat2 is not None:
+            weight = index / max(self.num_projections - 1, 1)
+            flat = (1 - weight) * flat + weight * self.flat2[start:stop]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = (projection - dark) / (flat - dark)
+            if self.absorptivity:
+                result = -np.log(result)
+        if self.fix_nan_and_inf:
+            result[~np.isfinite(result)] = 0
+
+        return result
+
+    def read(self, start, stop):
+        """Read sinograms *start* to *stop* as an array (slices, projections, width)."""
+        if self.images is None:
+            return np.zeros((stop - start, self.num_projections, self.width), dtype=np.float32)
+        if self.sinograms:
+            return np.array([self._read_rows(i, self.rows) for i in range(start, stop)],
+                            dtype=np.float32)
+
+        result = np.empty((stop - start, self.num_projections, self.width), dtype=np.float32)
+        for i in range(self.num_projections):
+            result[:, i] = self.read_projection(i, start, stop)
+
+        return result
+
+    def read_projection(self, index, start=0, stop=None):
+        """Read binned and flat corrected rows of projection *index* which belong to sinograms
+        *start* to *stop* (all of them by default).
+        """
+        stop = self.num_slices if stop is None else stop
+        rows = self.rows[start * self.resize:stop * self.resize]
+        projection = bin_image(self._read_rows(index, rows), self.resize)
+        if self.dark is not None:
+            projection = self._correct(projection, index, start, stop)
+
+        return projection
+
+
+class TiffSliceWriter(object):
+    """Write slices to TIFF *filename* like the UFO write task. If *filename* contains a
+    printf-style counter, a new file is started whenever it would exceed *bytes_per_file* bytes
+    (with every slice if it is 0), otherwise all slices go to one file. *bitdepth* 8 or 16 converts
+    the slices to unsigned integers by mapping *minimum* and *maximum* (extrema of every slice if
+    not both given) to the range of the data type. If *append* is True, slices are appended to
+    existing files.
+    """
+    def __init__(self, filename, bitdepth=32, minimum=None, maximum=None, bytes_per_file=0,
+                 append=False):
+        self.filename = filename
+        self.bitdepth = bitdepth
+        self.minimum = minimum
+        self.maximum = maximum
+        self.bytes_per_file = bytes_per_file
+        self.append = append
+        self.bigtiff = bytes_per_file > 2 ** 32 - 2 ** 25
+        self._counter = '%' in filename
+        self._file = None
+        self._file_bytes = 0
+        self._file_index = 0
+
+    def convert(self, image):
+        if self.bitdepth not in (8, 16):
+            return image.astype(np.float32)
+        dtype = np.uint8 if self.bitdepth == 8 else np.uint16
+        if self.minimum is not None and self.maximum is not None:
+            minimum, maximum = self.minimum, self.maximum
+        else:
+            minimum, maximum = image.min(), image.max()
+        scale = np.iinfo(dtype).max / (maximum - minimum) if maximum != minimum else 0
+
+        return np.clip((image - minimum) * scale, 0, np.iinfo(dtype).max).astype(dtype)
+
+    def save(self, image):
+        import tifffile
+
+        image = self.convert(image)
+        if self._file is None or self._counter and (
+                not self.bytes_per_file or
+                self._file_bytes and self._file_bytes + image.nbytes > self.bytes_per_file):
+            self.close()
+            filename = self.filename % self._file_index if self._counter else self.filename
+            dirname = os.path.dirname(filename)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._file = tifffile.TiffWriter(filename, bigtiff=self.bigtiff, append=self.append)
+            self._file_bytes = 0
+            self._file_index += 1
+        self._file.write(image, contiguous=False, metadata=None)
+        self._file_bytes += image.nbytes
+
+    def write(self, start, data):
+        for image in data:
+            self.save(image)
+
+    def abort(self):
+        pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def get_slice_writer(params, shape, attrs=None):
+    """Get a writer of slices with *shape* (slices, height, width) given by params.output, None for
+    a dry run.
+    """
+    if getattr(params, 'dry_run', False):
+        LOG.debug("Discarding data output")
+        return None
+    LOG.debug("Writing output to {}".format(params.output))
+    if is_volume_output(params.output):
+        if params.output_bitdepth != 32:
+            raise RuntimeError('Volume output is stored as 32-bit floats, --output-bitdepth {} '
+                               'is not supported'.format(params.output_bitdepth))
+        return get_volume_writer(params.output, shape, np.float32,
+                                 chunk_slices=params.output_chunk_slices,
+                                 compression=params.output_compression, attrs=attrs)
+
+    return TiffSliceWriter(params.output, bitdepth=params.output_bitdepth,
+                           minimum=params.output_minimum, maximum=params.output_maximum,
+                           bytes_per_file=params.output_bytes_per_file,
+                           append=params.output_append)
+
+
+def reconstruct_chunk(reader, options, start, stop):
+    """Read slices *start* to *stop* from *reader* and reconstruct them with *options* passed to
+    :func:`reconstruct_slices`.
+    """
+    return reconstruct_slices(reader.read(start, stop), **options)
+
+
+def get_chunk_size(num_slices, slice_bytes, num_workers, max_bytes=CHUNK_BYTES):
+    """Get the number of slices reconstructed at once by one worker, such that every one of
+    *num_workers* gets at least two chunks if there are enough of *num_slices* and the temporary
+    data of one chunk, *slice_bytes* per slice, fit into *max_bytes*.
+    """
+    balanced = -(-num_slices // (2 * num_workers))
+
+    return max(1, min(balanced, max_bytes // slice_bytes))
+
+
+def map_chunks(reader, options, chunks, num_workers):
+    """Reconstruct *chunks* of (start, stop) slice indices by *num_workers* processes and yield
+    (start, slices) in the order of *chunks*. At most two chunks per worker are in flight, so that
+    reconstructed slices do not pile up in memory while they are being written.
+    """
+    if num_workers == 1 or len(chunks) == 1:
+        for start, stop in chunks:
+            yield start, reconstruct_chunk(reader, options, start, stop)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = iter(chunks)
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        def submit(start, stop):
+            pending.append((start, executor.submit(reconstruct_chunk, reader, options,
+                                                   start, stop)))
+
+        try:
+            for start, stop in itertools.islice(chunks, 2 * num_workers):
+                submit(start, stop)
+            while pending:
+                start, future = pending.popleft()
+                slices = future.result()
+                for chunk in itertools.islice(chunks, 1):
+                    submit(*chunk)
+                yield start, slices
+        finally:
+            for start, future in pending:
+                future.cancel()
+
+
+def get_reconstruction_options(params, width, num_projections, axis):
+    """Get the keyword arguments of :func:`reconstruct_slices` given by *params* for sinograms with
+    *width* and *num_projections* reconstructed around *axis*. Return a tuple (options, estimated
+    number of bytes needed for reconstructing one slice).
+    """
+    if params.method not in ('fbp', 'dfi', 'sart', 'sirt'):
+        raise RuntimeError("Method `{}' is not supported by the numpy backend"
+                           .format(params.method))
+    options = {'method': params.method, 'angle_step': params.angle,
+               'angle_offset': params.offset or 0, 'axis': axis}
+    if params.method == 'fbp' or params.method in ('sart', 'sirt') and params.warm_start:
+        # Fail before starting the workers
+        get_filter(params.projection_filter, 2, cutoff=params.projection_filter_cutoff)
+        options.update(projection_filter=params.projection_filter,
+                       cutoff=params.projection_filter_cutoff,
+                       padding_mode=params.projection_padding_mode,
+                       crop_after=params.projection_crop_after)
+    if params.method == 'fbp':
+        padded_width = width + get_filtering_padding(width)
+        slice_bytes = 4 * (6 * width ** 2 + 4 * padded_width * num_projections)
+    elif params.method in ('sart', 'sirt'):
+        options.update(num_subsets=params.num_subsets, num_iterations=params.num_iterations,
+                       relaxation_factor=params.relaxation_factor, warm_start=params.warm_start,
+                       tolerance=params.stopping_tolerance)
+        padded_width = width + get_filtering_padding(width)
+        slice_bytes = 4 * (16 * width ** 2 + 4 * padded_width * num_projections)
+    else:
+        options['oversampling'] = params.oversampling or 1
+        size = next_power_of_two(width) * options['oversampling']
+        slice_bytes = 8 * (8 * size ** 2 + num_projections * size)
+
+    return options, slice_bytes
+
+
+def tomo(params):
+    """Reconstruct slices with the same input, output and options as :func:`tofu.reco.tomo` by
+    NumPy on the CPU, params.method must be fbp, dfi, sart or sirt. Return the execution time in
+    seconds.
+    """
+    if params.projections and params.sinograms:
+        raise RuntimeError("Cannot specify both --projections and --sinograms.")
+
+    start_time = time.perf_counter()
+    reader = SliceReader(params)
+    width = reader.width
+    axis = (params.axis or reader.full_width / 2.0) / reader.resize
+    LOG.debug("Input dimensions: {}x{} pixels".format(width, reader.num_projections))
+    options, slice_bytes = get_reconstruction_options(params, width, reader.num_projections, axis)
+
+    num_workers = params.cpu_workers or os.cpu_count() or 1
+    num_slices = reader.num_slices
+    chunk_size = params.batch_size or get_chunk_size(num_slices, slice_bytes, num_workers)
+    chunks = [(start, min(start + chunk_size, num_slices))
+              for start in range(0, num_slices, chunk_size)]
+    num_workers = min(num_workers, len(chunks))
+    LOG.debug('Reconstructing %d slices in chunks of %d by %d processes', num_slices, chunk_size,
+              num_workers)
+    attrs = {'method': params.method, 'axis': axis}
+    if params.angle:
+        attrs['angle'] = params.angle
+    writer = get_slice_writer(params, (num_slices, width, width), attrs=attrs)
+
+    try:
+        for start, slices in map_chunks(reader, options, chunks, num_workers):
+            if writer:
+                writer.write(start, slices)
+    except KeyboardInterrupt:
+        LOG.info('Processing interrupted')
+        if writer:
+            writer.abort()
+        return
+    finally:
+        if writer:
+            writer.close()
+
+    duration = time.perf_counter() - start_time
+    LOG.info("Execution time: {} s".format(duration))
+
+    return duration
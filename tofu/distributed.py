@@ -0,0 +1,312 @@
+"""Distribution of reconstruction work items between processes on one or more nodes.
+
+A :class:`Coordinator` listens on a TCP (HOST:PORT) or Unix socket (path) address and hands out
+work items to :class:`Worker` instances. The protocol consists of newline-delimited JSON messages.
+A worker asks for an item by a *get* message and gets either an *item*, *wait* if all remaining
+items are being processed by others or *done* if there is nothing left. When it finishes an item,
+it sends *finished*. While processing, workers send *heartbeat* messages, a worker which does not
+send anything for longer than the timeout or whose connection breaks is considered dead and its
+items are handed out again.
+"""
+import collections
+import json
+import logging
+import os
+import socket
+import socketserver
+import time
+from threading import Condition, Event, Lock, Thread
+
+
+LOG = logging.getLogger(__name__)
+
+
+def parse_address(address):
+    """Parse *address* either as HOST:PORT for TCP or as a Unix socket path. Return a tuple
+    (socket family, address).
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (socket.AF_INET, (host or '0.0.0.0', int(port)))
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError("Invalid TCP address `{}'".format(address))
+
+    return (socket.AF_UNIX, address)
+
+
+def send_message(sock, message, lock=None):
+    data = (json.dumps(message) + '\n').encode()
+    if lock:
+        with lock:
+            sock.sendall(data)
+    else:
+        sock.sendall(data)
+
+
+def receive_message(stream):
+    """Receive one message from file-like *stream*, None if the connection has been closed."""
+    line = stream.readline()
+    if not line:
+        return None
+
+    return json.loads(line.decode())
+
+
+def create_server(address, handle):
+    """Create a threading server listening on *address* (see :func:`parse_address`) which calls
+    *handle* with the socketserver.StreamRequestHandler of every connection. An existing Unix
+    socket file is replaced.
+    """
+    family, address = parse_address(address)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            handle(self)
+
+    if family == socket.AF_INET:
+        server_cls = socketserver.ThreadingTCPServer
+    else:
+        server_cls = socketserver.ThreadingUnixStreamServer
+        if os.path.exists(address):
+            os.remove(address)
+
+    class Server(server_cls):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    return Server(address, Handler)
+
+
+def close_server(server):
+    """Shut down *server* created by :func:`create_server` and remove its Unix socket file."""
+    server.shutdown()
+    server.server_close()
+    if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
+
+
+def connect(address):
+    """Connect to a server listening on *address* and return the socket."""
+    family, address = parse_address(address)
+    if family == socket.AF_INET and address[0] == '0.0.0.0':
+        address = ('localhost', address[1])
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+
+    return sock
+
+
+class WorkQueue(object):
+    """Track the state of work *items* (JSON-serializable dictionaries). Items are pending, assigned
+    to a worker or done, items of dead workers become pending again.
+    """
+    def __init__(self, items):
+        self.items = list(items)
+        self._pending = collections.deque(range(len(self.items)))
+        self._assigned = {}
+        self._done = set()
+        self._condition = Condition()
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def num_done(self):
+        return len(self._done)
+
+    @property
+    def finished(self):
+        return len(self._done) == len(self.items)
+
+    def get(self, worker):
+        """Get (item index, item) for *worker*. Return None if all remaining items are assigned
+        to other workers and raise StopIteration if all items are done.
+        """
+        with self._condition:
+            if self.finished:
+                raise StopIteration
+            if not self._pending:
+                return None
+            index = self._pending.popleft()
+            self._assigned[index] = worker
+
+            return (index, self.items[index])
+
+    def finish(self, index, worker):
+        with self._condition:
+            if index in self._done:
+                # Reassigned item was finished twice
+                return
+            self._done.add(index)
+            if self._assigned.get(index) == worker:
+                del self._assigned[index]
+            if index in self._pending:
+                self._pending.remove(index)
+            self._condition.notify_all()
+
+    def requeue(self, worker):
+        """Hand out all unfinished items of *worker* again, return their indices."""
+        with self._condition:
+            indices = sorted(index for (index, current) in self._assigned.items()
+                             if current == worker)
+            for index in indices:
+                del self._assigned[index]
+            # Unfinished items first, in their original order
+            self._pending.extendleft(reversed(indices))
+            self._condition.notify_all()
+
+            return indices
+
+    def wait(self, timeout=None):
+        """Wait until all items are done or *timeout* expires, return True if all are done."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.finished, timeout=timeout)
+
+
+class Coordinator(object):
+    """Hand out *items* to workers connecting to *address*. Workers must identify themselves by the
+    same *key*, which makes sure that they work on the same reconstruction. A worker is considered
+    dead if it does not send anything for *timeout* seconds.
+    """
+    def __init__(self, address, items, key, timeout=60):
+        self.address = address
+        self.queue = WorkQueue(items)
+        self.key = key
+        self.timeout = timeout
+        self.server = create_server(address, self._handle)
+        self._thread = None
+
+    @property
+    def server_address(self):
+        return self.server.server_address
+
+    def start(self):
+        self._thread = Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info("Coordinator listening on `%s' with %d work items", self.address,
+                 len(self.queue))
+
+    def wait(self, timeout=None):
+        return self.queue.wait(timeout=timeout)
+
+    def stop(self):
+        close_server(self.server)
+
+    def run(self):
+        """Hand out all items and return when they are done."""
+        self.start()
+        try:
+            while not self.wait(timeout=1):
+                pass
+        finally:
+            self.stop()
+
+    def _handle(self, handler):
+        handler.connection.settimeout(self.timeout)
+        worker = '{}-{}'.format(handler.client_address or 'local', id(handler))
+        LOG.debug('Worker %s connected', worker)
+        try:
+            while True:
+                message = receive_message(handler.rfile)
+                if message is None:
+                    break
+                if not self._process(handler.connection, worker, message):
+                    break
+        except (OSError, ValueError) as error:
+            LOG.warning('Lost connection to worker %s: %s', worker, error)
+        finally:
+            indices = self.queue.requeue(worker)
+            if indices:
+                LOG.warning('Worker %s disconnected, handing out items %s again', worker, indices)
+
+    def _process(self, connection, worker, message):
+        kind = message.get('type')
+        if kind == 'heartbeat':
+            return True
+        if message.get('key') != self.key:
+            send_message(connection, {'type': 'error',
+                                      'message': 'Worker arguments differ from the coordinator'})
+            return False
+        if kind == 'get':
+            try:
+                item = self.queue.get(worker)
+            except StopIteration:
+                send_message(connection, {'type': 'done'})
+                return False
+            if item is None:
+                send_message(connection, {'type': 'wait', 'seconds': 1})
+            else:
+                LOG.debug('Item %d assigned to worker %s', item[0], worker)
+                send_message(connection, {'type': 'item', 'index': item[0], 'item': item[1]})
+        elif kind == 'finished':
+            self.queue.finish(message['index'], worker)
+            LOG.info('Finished %d of %d work items', self.queue.num_done, len(self.queue))
+
+        return True
+
+
+class Worker(object):
+    """Process items handed out by the :class:`Coordinator` at *address*. *key* identifies the
+    reconstruction and heartbeats are sent every *heartbeat* seconds.
+    """
+    def __init__(self, address, key, heartbeat=10):
+        self.address = address
+        self.key = key
+        self.heartbeat = heartbeat
+        self.num_processed = 0
+
+    def run(self, process):
+        """Call *process* with every item received from the coordinator until there are none."""
+        sock = connect(self.address)
+        lock = Lock()
+        stop = Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    send_message(sock, {'type': 'heartbeat'}, lock=lock)
+                except OSError:
+                    break
+
+        heartbeat = Thread(target=beat)
+        heartbeat.daemon = True
+        heartbeat.start()
+        stream = sock.makefile('rb')
+
+        # The coordinator shuts down when the last item is finished, possibly by another worker
+        # while we are waiting, so a lost connection after that means there is nothing left
+        may_be_done = False
+        try:
+            while True:
+                try:
+                    send_message(sock, {'type': 'get', 'key': self.key}, lock=lock)
+                    message = receive_message(stream)
+                except OSError as error:
+                    if not may_be_done:
+                        raise
+                    LOG.debug('Lost connection to the coordinator (%s), assuming done', error)
+                    break
+                if message is None or message['type'] == 'done':
+                    break
+                if message['type'] == 'error':
+                    raise RuntimeError(message['message'])
+                may_be_done = True
+                if message['type'] == 'wait':
+                    time.sleep(message['seconds'])
+                    continue
+                LOG.info('Processing work item %d: %s', message['index'], message['item'])
+                process(message['item'])
+                self.num_processed += 1
+                send_message(sock, {'type': 'finished', 'index': message['index'],
+                                    'key': self.key}, lock=lock)
+        finally:
+            stop.set()
+            stream.close()
+            sock.close()
+
+        LOG.info('Worker processed %d work items', self.num_processed)
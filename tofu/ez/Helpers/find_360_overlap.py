@@ -23,7 +23,7 @@ def extract_row(dir_name, row):
     tsr = TiffSequenceReader(dir_name)
     tmp = tsr.read(0)
     (N, M) = tmp.shape
-    if (row < 0) or (row > N):
+    if (row < 0) or (row >= N):
         row = N//2
     num_images = tsr.num_images
     if num_images % 2 == 1:
@@ -32,7 +32,8 @@ def extract_row(dir_name, row):
         num_images-=1
     A = np.empty((num_images, M), dtype=np.uint16)
     for i in range(num_images):
-        A[i, :] = tsr.read(i)[row, :]
+        # Reads only the row from memory-mapped pages
+        A[i, :] = tsr.read(i, rows=row)
     tsr.close()
     return A
 
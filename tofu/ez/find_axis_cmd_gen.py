@@ -8,6 +8,7 @@ import glob
 import os
 import numpy as np
 from tofu.ez.evaluate_sharpness import process as process_metrics
+from tofu.axis import estimate_axis
 from tofu.ez.util import enquote
 from tofu.util import get_filenames, read_image, determine_shape
 import tifffile
@@ -78,8 +79,6 @@ class findCOR_cmds(object):
     def find_axis_corr(self, ctset, vcrop, y, height, multipage, args):
         indir = self.make_inpaths(ctset[0], ctset[1], args)
         """Use correlation to estimate center of rotation for tomography."""
-        from scipy.signal import fftconvolve
-
         def flat_correct(flat, radio):
             nonzero = np.where(radio != 0)
             result = np.zeros_like(radio)
@@ -121,14 +120,7 @@ class findCOR_cmds(object):
             first = first[y_region, :]
             last = last[y_region, :]
 
-        width = first.shape[1]
-        first = first - first.mean()
-        last = last - last.mean()
-
-        conv = fftconvolve(first, last[::-1, :], mode="same")
-        center = np.unravel_index(conv.argmax(), conv.shape)[1]
-
-        return (width / 2.0 + center) / 2.0
+        return estimate_axis(first, last).axis
 
     # Find midpoint width of image and return its value
     def find_axis_image_midpoint(self, ctset, multipage, height_width):
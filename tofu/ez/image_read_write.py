@@ -3,6 +3,7 @@ import os, glob
 import numpy as np
 import tifffile
 from tifffile import imread, imwrite
+from tofu.projections import MappedTiffFile
 
 
 class InvalidDataSetError(Exception):
@@ -151,7 +152,8 @@ class FileSequenceReader(object):
 
         return num
 
-    def read(self, index):
+    def read(self, index, rows=None):
+        """Read image *index*, only its *rows* (a slice or indices) if specified."""
         if index < 0:
             # Enables negative indexing
             index += self.num_images
@@ -166,7 +168,7 @@ class FileSequenceReader(object):
         index += self._lengths[self._filenames[file_index]]
         self._open(self._filenames[file_index])
 
-        return self._read_real(index)
+        return self._read_real(index, rows=rows)
 
     def _open(self, filename):
         if self._filename != filename:
@@ -198,26 +200,28 @@ class FileSequenceReader(object):
     def _get_num_images_in_file_real(self):
         raise NotImplementedError
 
-    def _read_real(self, index):
+    def _read_real(self, index, rows=None):
         raise NotImplementedError
 
 
 class TiffSequenceReader(FileSequenceReader):
+    """Uncompressed pages are returned as read-only views of memory-mapped files, so reading a few
+    rows of them touches only the bytes of these rows.
+    """
     def __init__(self, file_prefix, ext='.tif'):
         super(TiffSequenceReader, self).__init__(file_prefix, ext=ext)
 
     def _open_real(self, filename):
-        import tifffile
-        return tifffile.TiffFile(filename)
+        return MappedTiffFile(filename)
 
     def _close_real(self):
         self._file.close()
 
     def _get_num_images_in_file_real(self):
-        return len(self._file.pages)
+        return len(self._file)
 
-    def _read_real(self, index):
-        return self._file.pages[index].asarray()
+    def _read_real(self, index, rows=None):
+        return self._file.get(index, rows=rows)
 
 def get_image_dtype(file_prefix):
     tsr = TiffSequenceReader(file_prefix)
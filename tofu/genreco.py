@@ -2,19 +2,30 @@
 sets.
 """
 import copy
+import hashlib
+import importlib.util
 import itertools
+import json
 import logging
 import os
+import queue
+import tempfile
 import time
 import numpy as np
+from collections import OrderedDict
 from multiprocessing.pool import ThreadPool
-from threading import Event, Thread
+from threading import Event, Lock, Thread, current_thread
 from gi.repository import Ufo
-from .preprocess import create_preprocessing_pipeline
+from .preprocess import create_preprocessing_pipeline, get_flat_cache_dir
 from .util import (get_filtering_padding, get_reconstructed_cube_shape,
-                  get_reconstruction_regions, get_filenames, determine_shape,
-                  get_scarray_value, Vector)
+                  get_reconstruction_regions, get_filenames, get_image_shape, determine_shape,
+                  next_power_of_two, get_scarray_value, get_scarray_values, Vector)
 from .tasks import get_task, get_writer
+from .config import SECTIONS
+from .distributed import Coordinator, Worker
+from .profiling import Profiler
+from .projections import ProjectionSource
+from .volume import get_volume_writer, is_volume_output, split_volume_filename
 
 
 LOG = logging.getLogger(__name__)
@@ -24,11 +35,41 @@ DTYPE_CL_SIZE = {'float': 4,
                  'uchar': 1,
                  'ushort': 2,
                  'uint': 4}
+DTYPE_NUMPY = {'float': 'float32',
+               'double': 'float64',
+               'half': 'float16',
+               'uchar': 'uint8',
+               'ushort': 'uint16',
+               'uint': 'uint32'}
+# Per-projection geometry parameters which can also be varied along the reconstructed z-axis
+GEOMETRY_PARAMETERS = ['source-position-x', 'source-position-y', 'source-position-z',
+                       'detector-position-x', 'detector-position-y', 'detector-position-z',
+                       'detector-angle-x', 'detector-angle-y', 'detector-angle-z',
+                       'axis-angle-x', 'axis-angle-y', 'axis-angle-z',
+                       'volume-angle-x', 'volume-angle-y', 'volume-angle-z',
+                       'center-position-x', 'center-position-z']
+# Arguments which together with GEOMETRY_PARAMETERS determine the optimized projection region
+REGION_PARAMETERS = GEOMETRY_PARAMETERS + ['width', 'height', 'number', 'overall-angle',
+                                           'x-region', 'y-region', 'z', 'z-parameter',
+                                           'projection-margin']
+REGION_CACHE_NAME = '.tofu-projection-regions.json'
+TUNING_DATABASE_NAME = 'genreco-tuning.json'
+# Arguments which do not change the reconstructed slices and may differ when resuming
+RESUME_IGNORED_ARGS = ['autotune', 'cache_projection_regions', 'config', 'coordinator',
+                       'data_splitting_policy', 'disable_tuning', 'enable_tracing', 'gpus', 'log',
+                       'num_gpu_threads', 'profile', 'projection_buffer_size', 'read_ahead',
+                       'region_cache_size', 'resume', 'slice_memory_coeff', 'slices_per_device',
+                       'tuning_database', 'verbose', 'worker', 'worker_timeout',
+                       'writer_buffers', 'writer_scratch_dir']
+# Number of projections assumed to be held by general-backproject if --burst is not specified
+DEFAULT_BURST = 16
+# Number of output buffers UFO keeps per task in the preprocessing pipeline
+BUFFERS_PER_TASK = 2
 
 
 def genreco(args):
     st = time.time()
-    if is_output_single_file(args):
+    if is_output_single_file(args) or is_output_volume(args):
         try:
             import ufo.numpy
         except ImportError:
@@ -47,32 +88,54 @@ def genreco(args):
     num_voxels = vol_shape[0] * vol_shape[1] * vol_shape[2]
     vol_nbytes = num_voxels * bpp
 
+    if args.coordinator:
+        run_coordinator(args, x_region, y_region, z_region, vol_nbytes)
+        return
+    profiler = Profiler(args.profile) if args.profile else None
+
     resources = [Ufo.Resources()]
     gpus = np.array(resources[0].get_gpu_nodes())
     gpu_indices = np.array(args.gpus or list(range(len(gpus))))
     if min(gpu_indices) < 0 or max(gpu_indices) > len(gpus) - 1:
         raise ValueError('--gpus contains invalid indices')
     gpus = gpus[gpu_indices]
-    duration = 0
     for i, gpu in enumerate(gpus):
         print('Max mem for {}: {:.2f} GB'.format(i, gpu.get_info(0) / 2. ** 30))
 
+    projection_stages = estimate_region_projection_memory(args, gpus, x_region, y_region,
+                                                          z_region, bpp)
+    projection_memory = sum(nbytes for (name, nbytes) in projection_stages)
+    if args.autotune or not (args.slices_per_device or args.disable_tuning):
+        tuning_db = TuningDatabase(filename=args.tuning_database)
+        tuning_key = get_tuning_key(args, gpus)
+        if args.autotune:
+            autotune(args, gpus, gpu_indices, x_region, y_region, z_region, projection_memory,
+                     tuning_db, tuning_key)
+        if not args.slices_per_device:
+            apply_tuning(args, gpus, x_region, y_region, bpp, projection_memory,
+                         tuning_db.get(tuning_key))
+    slices_per_device = get_slices_per_device(gpus, x_region, y_region, bpp,
+                                              slices_per_device=args.slices_per_device,
+                                              slice_memory_coeff=args.slice_memory_coeff,
+                                              projection_memory=projection_memory,
+                                              num_gpu_threads=args.num_gpu_threads)
     runs = make_runs(gpus, gpu_indices, x_region, y_region, z_region, bpp,
-                     slices_per_device=args.slices_per_device,
-                     slice_memory_coeff=args.slice_memory_coeff,
+                     slices_per_device=slices_per_device,
                      data_splitting_policy=args.data_splitting_policy,
                      num_gpu_threads=args.num_gpu_threads)
+    log_plan(gpus, gpu_indices, runs, projection_stages, vol_shape[0] * vol_shape[1] * bpp,
+             num_gpu_threads=args.num_gpu_threads,
+             log_level=logging.INFO if args.dry_run else logging.DEBUG)
 
-    for i in range(len(runs[0]) - 1):
-        resources.append(Ufo.Resources())
-
-    LOG.info('Number of passes: %d', len(runs))
-    LOG.debug('GPUs and regions:')
-    for regions in runs:
-        LOG.debug('%s', str(regions))
+    if args.worker:
+        run_worker(args, gpu_indices, slices_per_device, x_region, y_region, z_region, vol_nbytes,
+                   profiler=profiler)
+        if profiler:
+            profiler.write()
+        return
 
-    for i, regions in enumerate(runs):
-        duration += _run(resources, args, x_region, y_region, regions, i, vol_nbytes)
+    duration = _reconstruct(args, gpu_indices, slices_per_device, x_region, y_region, z_region,
+                            vol_nbytes, profiler=profiler)
 
     num_gupdates = num_voxels * args.number * 1e-9
     total_duration = time.time() - st
@@ -80,10 +143,408 @@ def genreco(args):
     LOG.debug('Total duration: %.2f s', total_duration)
     LOG.debug('UFO performance: %.2f GUPS', num_gupdates / duration)
     LOG.debug('Total performance: %.2f GUPS', num_gupdates / total_duration)
+    if profiler:
+        profiler.count('gigaupdates', num_gupdates)
+        summary = profiler.write()
+        for gpu, fraction in sorted(summary.get('gpu_busy_fraction', {}).items()):
+            LOG.info('GPU %s busy: %.1f %%', gpu, 100 * fraction)
+
+
+def _reconstruct(args, gpu_indices, slices_per_device, x_region, y_region, z_region, vol_nbytes,
+                 global_region=None, profiler=None):
+    """Reconstruct *z_region* on GPUs with *gpu_indices* which can store *slices_per_device* and
+    return the duration of the reconstruction. If *global_region* is specified, *z_region* is a part
+    of it and the output is written as a part of the whole volume. If *profiler* is a
+    :class:`tofu.profiling.Profiler`, timings of all processing steps are recorded in it.
+    """
+    slots = make_slots(gpu_indices, slices_per_device, num_gpu_threads=args.num_gpu_threads)
+    manifest = None
+    done = None
+    if not args.dry_run and global_region is None:
+        # Finished regions are always recorded, so that any interrupted reconstruction can be
+        # resumed, --resume only decides whether they are skipped
+        manifest = ResumeManifest(get_output_path(args) + '.manifest.json',
+                                  get_resume_key(args, x_region, y_region, z_region))
+        num_slices = get_reconstructed_cube_shape(x_region, y_region, z_region)[2]
+        if args.resume:
+            manifest.validate(lambda entry: is_region_output_complete(args, entry, x_region,
+                                                                      y_region))
+            done = manifest.get_done_slices(num_slices)
+            LOG.info('Resuming reconstruction, %d regions with %d slices already finished',
+                     len(manifest), np.count_nonzero(done))
+        else:
+            manifest.clear()
+        remove_stale_region_output(args, [entry['offset'] for entry in manifest.entries],
+                                   num_slices)
+    region_queue = RegionQueue(z_region, [slot[1] for slot in slots],
+                               data_splitting_policy=args.data_splitting_policy, done=done)
+    resources = [Ufo.Resources() for slot in slots]
+
+    region_cache = None
+    if args.region_cache_size:
+        filename = None
+        if args.cache_projection_regions:
+            filename = os.path.join(os.path.dirname(args.output), REGION_CACHE_NAME)
+        region_cache = RegionCache(maxsize=args.region_cache_size, filename=filename)
+
+    LOG.info('Number of device threads: %d', len(slots))
+    LOG.debug('GPUs and maximum number of slices per thread: %s', slots)
+
+    projection_reader = None
+    if len(slots) > 1 and args.read_ahead and not args.dry_run:
+        projection_reader = get_shared_projection_reader(args, profiler=profiler)
+
+    duration = _run(resources, args, x_region, y_region, z_region, region_queue, slots,
+                    vol_nbytes, region_cache=region_cache, projection_reader=projection_reader,
+                    manifest=manifest, global_region=global_region, profiler=profiler)
+
+    if region_cache:
+        LOG.debug('Projection region cache hits: %d, misses: %d', region_cache.hits,
+                  region_cache.misses)
+        if region_cache.filename:
+            region_cache.save()
+
+    return duration
+
+
+def get_work_items(args, x_region, y_region, z_region):
+    """Split *z_region* into work items for distributed reconstruction, every item is a dictionary
+    with the z *region* and the *offset* of its first slice.
+    """
+    item_slices = args.work_item_slices
+    if is_output_volume(args):
+        # Workers must not share chunks
+        chunk_slices = args.output_chunk_slices
+        item_slices = (item_slices + chunk_slices - 1) // chunk_slices * chunk_slices
+    bpp = DTYPE_CL_SIZE[args.store_type]
+    runs = make_runs([None], [0], x_region, y_region, z_region, bpp,
+                     slices_per_device=item_slices)
+    items = []
+    for regions in runs:
+        for gpu_index, region in regions:
+            offset = int(np.round((region[0] - z_region[0]) / z_region[2]))
+            items.append({'region': np.array(region, dtype=float).tolist(), 'offset': offset})
+
+    return items
+
+
+def run_coordinator(args, x_region, y_region, z_region, vol_nbytes):
+    """Hand out parts of *z_region* to workers and wait until they are reconstructed."""
+    items = get_work_items(args, x_region, y_region, z_region)
+    width, height, num_slices = get_reconstructed_cube_shape(x_region, y_region, z_region)
+    if is_output_volume(args):
+        if not split_volume_filename(args.output)[0].lower().rstrip('/').endswith('.zarr'):
+            raise RuntimeError('Distributed reconstruction can write only Zarr volumes')
+        # Create the volume, workers write their parts into it
+        get_volume_writer(args.output, (num_slices, height, width), DTYPE_NUMPY[args.store_type],
+                          chunk_slices=args.output_chunk_slices,
+                          compression=args.output_compression,
+                          attrs=get_volume_attrs(args, x_region, y_region, z_region)).close()
+    coordinator = Coordinator(args.coordinator, items,
+                              get_resume_key(args, x_region, y_region, z_region),
+                              timeout=args.worker_timeout)
+    st = time.time()
+    coordinator.run()
+    if is_output_single_file(args):
+        merge_sidecars(args, [item['offset'] for item in items], num_slices,
+                       bigtiff=vol_nbytes > 2 ** 32 - 2 ** 25)
+    LOG.info('Distributed reconstruction of %d work items took %.2f s', len(items),
+             time.time() - st)
+
+
+def run_worker(args, gpu_indices, slices_per_device, x_region, y_region, z_region, vol_nbytes,
+               profiler=None):
+    """Reconstruct parts of *z_region* handed out by the coordinator."""
+    def process(item):
+        _reconstruct(args, gpu_indices, slices_per_device, x_region, y_region, item['region'],
+                     vol_nbytes, global_region=z_region, profiler=profiler)
+
+    worker = Worker(args.worker, get_resume_key(args, x_region, y_region, z_region),
+                    heartbeat=args.worker_timeout / 4.)
+    worker.run(process)
+
+
+def get_output_path(args):
+    """Get the output path without a volume data set specification."""
+    if is_volume_output(args.output):
+        return split_volume_filename(args.output)[0].rstrip('/')
+
+    return args.output
+
+
+def get_resume_key(args, x_region, y_region, z_region):
+    """Get a hash of all arguments which determine the reconstructed slices, so that a
+    reconstruction is resumed only with the same settings.
+    """
+    values = {name: value for name, value in vars(args).items()
+              if name not in RESUME_IGNORED_ARGS and not name.startswith('_')}
+    values['regions'] = [x_region, y_region, z_region]
+    encoded = json.dumps(values, sort_keys=True, default=lambda value: np.array(value).tolist())
+
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+def get_region_output_digits(num_slices):
+    """Number of digits of the region index in the per-region output file names when resuming, the
+    index is the slice offset of the region.
+    """
+    return max(3, len(str(num_slices)))
+
+
+def get_region_filenames(args, offset, num_slices):
+    """Get the per-region output files of region starting at slice *offset* written when
+    resuming, *num_slices* is the total number of slices.
+    """
+    if is_output_single_file(args):
+        return [get_sidecar_filename(args, offset, num_slices)]
+    prefix = '{}-{:0{}}-'.format(args.output, offset, get_region_output_digits(num_slices))
+
+    return get_filenames(prefix + '*')
+
+
+def remove_stale_region_output(args, offsets, num_slices):
+    """Remove the per-region output files written when resuming of all regions but the ones
+    starting at slice *offsets*, i.e. of regions which were not finished or whose output is
+    incomplete, *num_slices* is the total number of slices. Return the removed file names.
+    """
+    if is_output_volume(args):
+        # Volume regions are overwritten in place
+        return []
+    keep = set()
+    for offset in offsets:
+        keep.update(get_region_filenames(args, offset, num_slices))
+    if is_output_single_file(args):
+        filenames = get_filenames(args.output + '.parts')
+    else:
+        digits = get_region_output_digits(num_slices)
+        filenames = get_filenames('{}-{}-*'.format(args.output, '[0-9]' * digits))
+    removed = [filename for filename in filenames if filename not in keep]
+    for filename in removed:
+        LOG.debug("Removing stale output `%s'", filename)
+        os.remove(filename)
+
+    return removed
+
+
+def get_sidecar_filename(args, offset, num_slices):
+    """Get the file name of the part of single-file output starting at slice *offset*."""
+    return os.path.join(args.output + '.parts',
+                        '{:0{}}.tif'.format(offset, get_region_output_digits(num_slices)))
+
+
+def is_region_output_complete(args, entry, x_region, y_region):
+    """Check that the output of finished region given by manifest *entry* exists and contains all
+    its slices of the expected size.
+    """
+    if is_output_volume(args):
+        # Volume regions are flushed before they are recorded
+        return True
+    width, height, num_slices = get_reconstructed_cube_shape(x_region, y_region,
+                                                             (0, entry['num_slices'], 1))
+    filenames = get_region_filenames(args, entry['offset'], entry['num_total'])
+    if not filenames or not all(os.path.exists(filename) for filename in filenames):
+        return False
+    num_read = 0
+    for filename in filenames:
+        try:
+            shape = get_image_shape(filename)
+        except ValueError:
+            # Format which we cannot read, trust the manifest
+            return True
+        if tuple(shape[-2:]) != (height, width):
+            return False
+        num_read += shape[0] if len(shape) == 3 else 1
+
+    return num_read == num_slices
+
+
+def merge_sidecars(args, offsets, num_slices, bigtiff=False):
+    """Merge parts of single-file output starting at slice *offsets* into the output file and
+    remove them.
+    """
+    import shutil
+    import tifffile
+
+    with tifffile.TiffWriter(args.output, bigtiff=bigtiff) as tif:
+        for offset in sorted(offsets):
+            data = tifffile.imread(get_sidecar_filename(args, offset, num_slices))
+            for image in data.reshape((-1,) + data.shape[-2:]):
+                tif.write(image, contiguous=True)
+    shutil.rmtree(args.output + '.parts')
+    LOG.debug("Merged %d parts into `%s'", len(offsets), args.output)
+
+
+def get_shared_projection_reader(args, profiler=None):
+    """Create a :class:`SharedProjectionReader` for the projections given by *args* or return None
+    if they cannot be read by it. The reads are recorded in *profiler* if it is specified.
+    """
+    if importlib.util.find_spec('ufo') is None or importlib.util.find_spec('ufo.numpy') is None:
+        LOG.debug('ufo-python-tools not installed, every device thread reads the projections')
+        return None
+    frames = get_projection_frames(args)
+    if not frames:
+        LOG.debug('Projections cannot be read by the shared reader')
+        return None
+
+    return SharedProjectionReader(frames, read_ahead=args.read_ahead,
+                                  max_frames=max(args.projection_buffer_size, args.read_ahead + 1),
+                                  profiler=profiler)
+
+
+def get_projection_frames(args):
+    """Get (file name, page index) tuples of the projections which are read by the read task set up
+    with *args*, the page index is None for single-image files. Return None if there are files
+    which are not supported by :class:`SharedProjectionReader`.
+    """
+    frames = []
+    for filename in get_filenames(args.projections):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in ('.tif', '.tiff'):
+            shape = get_image_shape(filename)
+            if len(shape) == 3:
+                frames.extend((filename, page) for page in range(shape[0]))
+            else:
+                frames.append((filename, None))
+        elif extension == '.edf':
+            frames.append((filename, None))
+        else:
+            return None
+
+    return frames[args.start::args.step][:args.number]
+
+
+def get_tuning_key(args, gpus):
+    """Get the :class:`TuningDatabase` key of the reconstruction given by *args* on *gpus*, i.e.
+    the GPU models together with projection width, height and number.
+    """
+    width, height = determine_shape(args, args.projections)
+    models = '+'.join(get_gpu_model(gpu) for gpu in gpus)
+
+    return '{}:{}x{}x{}'.format(models, width, args.height or height - args.y, args.number)
+
+
+def get_gpu_model(gpu):
+    """Get a name of the *gpu* model. The OpenCL device name is not exposed by all UFO versions, in
+    which case the global memory size identifies the model.
+    """
+    if hasattr(Ufo.GpuNodeInfo, 'NAME'):
+        return str(gpu.get_info(Ufo.GpuNodeInfo.NAME))
+
+    return 'GPU-{:.1f}GB'.format(gpu.get_info(Ufo.GpuNodeInfo.GLOBAL_MEM_SIZE) / 2. ** 30)
+
+
+def get_tuning_candidates(max_slices, num_gpus, fractions=(1, 0.5, 0.25)):
+    """Get candidate (slices per device, number of GPU threads, data splitting policy) tuples.
+    *max_slices* is a dictionary mapping the number of GPU threads to the maximum numbers of slices
+    per device, *fractions* of them are tried. The 'many' data splitting policy only makes a
+    difference for more than one of *num_gpus*.
+    """
+    policies = ('one', 'many') if num_gpus > 1 else ('one',)
+    candidates = []
+    for num_threads, max_slices_per_device in sorted(max_slices.items()):
+        for fraction in fractions:
+            slices = [int(num * fraction) for num in max_slices_per_device]
+            if not any(num >= num_threads for num in slices):
+                continue
+            for policy in policies:
+                candidate = (slices, num_threads, policy)
+                if candidate not in candidates:
+                    candidates.append(candidate)
+
+    return candidates
+
+
+def autotune(args, gpus, gpu_indices, x_region, y_region, z_region, projection_memory, tuning_db,
+             key, gpu_threads=(1, 2), num_calibration_passes=2):
+    """Run short calibration reconstructions of dummy data for candidate configurations given by
+    :func:`get_tuning_candidates` with *gpu_threads*, store the fastest one in *tuning_db* under
+    *key* and return it. Every calibration reconstructs at most *num_calibration_passes* times as
+    many slices as the candidate can process at once.
+    """
+    width, height = determine_shape(args, args.projections)
+    bpp = DTYPE_CL_SIZE[args.store_type]
+    slice_width, slice_height, num_slices = get_reconstructed_cube_shape(x_region, y_region,
+                                                                         z_region)
+    max_slices = {}
+    for num_threads in gpu_threads:
+        max_slices[num_threads] = get_slices_per_device(gpus, x_region, y_region, bpp,
+                                                        slice_memory_coeff=args.slice_memory_coeff,
+                                                        projection_memory=projection_memory,
+                                                        num_gpu_threads=num_threads)
+    best = None
+
+    for slices_per_device, num_threads, policy in get_tuning_candidates(max_slices, len(gpus)):
+        calibration = copy.deepcopy(args)
+        calibration.dry_run = True
+        calibration.cache_projection_regions = False
+        calibration.width = width
+        calibration.height = args.height or height - args.y
+        calibration.num_gpu_threads = num_threads
+        calibration.data_splitting_policy = policy
+        num_calibration_slices = min(num_slices, num_calibration_passes * sum(slices_per_device))
+        calibration_region = [z_region[0], z_region[0] + num_calibration_slices * z_region[2],
+                              z_region[2]]
+        duration = _reconstruct(calibration, gpu_indices, slices_per_device, x_region, y_region,
+                                calibration_region, 0)
+        gups = slice_width * slice_height * num_calibration_slices * args.number * 1e-9 / duration
+        LOG.info('Autotune: slices per device %s, GPU threads: %d, data splitting policy: %s: '
+                 '%.2f GUPS', slices_per_device, num_threads, policy, gups)
+        if best is None or gups > best['gups']:
+            best = {'slices_fraction': [num / float(max_num) if max_num else 0
+                                        for num, max_num in zip(slices_per_device,
+                                                                max_slices[num_threads])],
+                    'num_gpu_threads': num_threads,
+                    'data_splitting_policy': policy,
+                    'gups': gups}
+
+    if best is None:
+        raise RuntimeError('None of the available devices has enough memory to store any slices')
+    LOG.info('Autotune: best configuration for %s: %s', key, best)
+    tuning_db.put(key, best)
+    tuning_db.save()
+
+    return best
+
+
+def apply_tuning(args, gpus, x_region, y_region, bpp, projection_memory, entry):
+    """Set --slices-per-device, --num-gpu-threads and --data-splitting-policy in *args* from the
+    tuning database *entry*. The tuned number of slices is stored as a fraction of the maximum
+    number of slices because the slice size may differ from the calibration. Options which are
+    not at their defaults were given by the user and are kept, the tuned slices are not used if
+    the user's number of GPU threads differs from the tuned one.
+    """
+    if not entry:
+        return
+
+    defaults = SECTIONS['general-reconstruction']
+    if args.num_gpu_threads == defaults['num-gpu-threads']['default']:
+        args.num_gpu_threads = entry['num_gpu_threads']
+    elif args.num_gpu_threads != entry['num_gpu_threads']:
+        LOG.info('Not using tuned slices per device for %d GPU threads with --num-gpu-threads %d',
+                 entry['num_gpu_threads'], args.num_gpu_threads)
+        return
+    if args.data_splitting_policy == defaults['data-splitting-policy']['default']:
+        args.data_splitting_policy = entry['data_splitting_policy']
+    max_slices = get_slices_per_device(gpus, x_region, y_region, bpp,
+                                       slice_memory_coeff=args.slice_memory_coeff,
+                                       projection_memory=projection_memory,
+                                       num_gpu_threads=args.num_gpu_threads)
+    slices = [int(num * fraction) for num, fraction in zip(max_slices, entry['slices_fraction'])]
+    if any(slices):
+        args.slices_per_device = slices
+        LOG.info('Using tuned slices per device %s, GPU threads: %d, data splitting policy: %s',
+                 args.slices_per_device, args.num_gpu_threads, args.data_splitting_policy)
 
 
 def make_runs(gpus, gpu_indices, x_region, y_region, z_region, bpp, slices_per_device=None,
-              slice_memory_coeff=0.8, data_splitting_policy='one', num_gpu_threads=1):
+              slice_memory_coeff=0.8, data_splitting_policy='one', num_gpu_threads=1,
+              projection_memory=0):
+    """Split *z_region* into passes in which every GPU processes one region. Return a list of
+    passes, each of them a list of (gpu index, region) tuples. :func:`genreco` hands out the regions
+    dynamically by :class:`RegionQueue`, this static plan tells how many passes would be needed.
+    *slices_per_device* is either one number for all GPUs or a list with one entry per GPU, if not
+    specified, it is computed from the GPU memory, see :func:`get_num_slices_per_gpu`.
+    """
     gpu_indices = np.array(gpu_indices)
     def _add_region(runs, gpu_index, current, to_process, z_start, z_step):
         current_per_thread = current // num_gpu_threads
@@ -102,11 +563,11 @@ def make_runs(gpus, gpu_indices, x_region, y_region, z_region, bpp, slices_per_d
     slice_width, slice_height, num_slices = get_reconstructed_cube_shape(x_region, y_region,
                                                                          z_region)
 
-    if slices_per_device:
-        slices_per_device = [slices_per_device for i in range(len(gpus))]
-    else:
-        slices_per_device = get_num_slices_per_gpu(gpus, slice_width, slice_height, bpp,
-                                                   slice_memory_coeff=slice_memory_coeff)
+    slices_per_device = get_slices_per_device(gpus, x_region, y_region, bpp,
+                                              slices_per_device=slices_per_device,
+                                              slice_memory_coeff=slice_memory_coeff,
+                                              projection_memory=projection_memory,
+                                              num_gpu_threads=num_gpu_threads)
 
     max_slices_per_pass = sum(slices_per_device)
     if not max_slices_per_pass:
@@ -155,77 +616,346 @@ def make_runs(gpus, gpu_indices, x_region, y_region, z_region, bpp, slices_per_d
     return runs
 
 
-def get_num_slices_per_gpu(gpus, width, height, bpp, slice_memory_coeff=0.8):
+def get_slices_per_device(gpus, x_region, y_region, bpp, slices_per_device=None,
+                          slice_memory_coeff=0.8, projection_memory=0, num_gpu_threads=1):
+    """Get the maximum number of slices for every device in *gpus*, either the same
+    *slices_per_device* for all of them (or one entry per device if it is a list) or computed from
+    their memory.
+    """
+    if slices_per_device:
+        if np.isscalar(slices_per_device):
+            return [slices_per_device for i in range(len(gpus))]
+        return list(slices_per_device)
+
+    slice_width, slice_height = get_reconstructed_cube_shape(x_region, y_region, (0, 1, 1))[:2]
+
+    return get_num_slices_per_gpu(gpus, slice_width, slice_height, bpp,
+                                  slice_memory_coeff=slice_memory_coeff,
+                                  projection_memory=projection_memory,
+                                  num_gpu_threads=num_gpu_threads)
+
+
+def make_slots(gpu_indices, slices_per_device, num_gpu_threads=1):
+    """Make one slot per device thread as a tuple (gpu index, maximum number of slices). Devices
+    which cannot store any slices are skipped, the last thread of a device gets the remaining slices
+    if they cannot be split evenly.
+    """
+    slots = []
+    for gpu_index, num_slices in zip(gpu_indices, slices_per_device):
+        per_thread = num_slices // num_gpu_threads
+        for i in range(num_gpu_threads):
+            current = per_thread
+            if i + 1 == num_gpu_threads:
+                current += num_slices % num_gpu_threads
+            if current:
+                slots.append((int(gpu_index), current))
+
+    if not slots:
+        raise RuntimeError('None of the available devices has enough memory to store any slices')
+
+    return slots
+
+
+def get_num_slices_per_gpu(gpus, width, height, bpp, slice_memory_coeff=0.8, projection_memory=0,
+                           num_gpu_threads=1):
+    """Compute how many slices of *width* x *height* with *bpp* bytes per pixel fit on every GPU
+    from *gpus*. *slice_memory_coeff* is the usable portion of the GPU memory, from which
+    *projection_memory* (see :func:`estimate_projection_memory`) is subtracted for every one of the
+    *num_gpu_threads* threads.
+    """
     num_slices = []
     slice_size = width * height * bpp
 
     for i, gpu in enumerate(gpus):
         max_mem = gpu.get_info(Ufo.GpuNodeInfo.GLOBAL_MEM_SIZE)
-        num_slices.append(int(np.floor(max_mem * slice_memory_coeff / slice_size)))
+        available = max_mem * slice_memory_coeff - num_gpu_threads * projection_memory
+        num_slices.append(max(0, int(np.floor(available / slice_size))))
 
     return num_slices
 
 
-def _run(resources, args, x_region, y_region, regions, run_number, vol_nbytes):
-    """Execute one pass on all possible GPUs with slice ranges given by *regions*. Use separate
-    thread per GPU and optimize the read projection regions.
+def get_projection_shape(args):
+    """Get the (width, height) of the projections read by one device thread given by *args*."""
+    width, height = determine_shape(args, args.projections)
+    height = args.height or height - args.y
+    if args.transpose_input:
+        width, height = height, width
+
+    return width, height
+
+
+def get_region_projection_height(args, z_region, num_slices):
+    """Get the largest height of the projection regions which :meth:`CTGeometry.optimize_args`
+    selects for regions of *num_slices* slices of *z_region*, None if the projection region is not
+    optimized. The first, the middle and the last region are checked.
     """
-    executors = []
-    writer = None
-    last = None
+    if (args.disable_projection_crop or not num_slices or
+            not args.dry_run and (args.y or args.height or args.transpose_input)):
+        return None
+    geometry = CTGeometry(args)
+    z_start, z_stop, z_step = z_region
+    starts = np.arange(z_start, z_stop, num_slices * z_step)
+    height = 0
+    for start in sorted(set([starts[0], starts[len(starts) // 2], starts[-1]])):
+        region = [start, min(start + num_slices * z_step, z_stop), z_step]
+        xmin, ymin, xmax, ymax = geometry.compute_height(region=region)
+        height = max(height, ymax - ymin)
+
+    return int(height)
+
+
+def estimate_region_projection_memory(args, gpus, x_region, y_region, z_region, bpp):
+    """Estimate the projection memory like :func:`estimate_projection_memory` but for the
+    projection regions cropped to the reconstructed regions of *z_region*. Their height depends on
+    the number of slices per region, which depends on the projection memory, the smallest height
+    for which the regions with the slices which fit then are not taller is found by bisection.
+    Return the stages.
+    """
+    width, height = get_projection_shape(args)
+
+    def get_region_height(projection_height):
+        stages = estimate_projection_memory(args, width=width, height=projection_height)
+        slices = get_slices_per_device(gpus, x_region, y_region, bpp,
+                                       slices_per_device=args.slices_per_device,
+                                       slice_memory_coeff=args.slice_memory_coeff,
+                                       projection_memory=sum(nbytes for (name, nbytes) in stages),
+                                       num_gpu_threads=args.num_gpu_threads)
+        # The last device thread gets the remainder
+        num_slices = -(-max(list(slices) + [0]) // args.num_gpu_threads)
+
+        return get_region_projection_height(args, z_region, num_slices)
+
+    if get_region_height(height) is not None:
+        # Less projection memory means more and thus taller regions, the region height decreases
+        # with the projection height
+        low, high = 1, height
+        while low < high:
+            middle = (low + high) // 2
+            if get_region_height(middle) <= middle:
+                high = middle
+            else:
+                low = middle + 1
+        height = high
+    LOG.debug('Projection height for memory estimation: %d', height)
 
-    if is_output_single_file(args):
+    return estimate_projection_memory(args, width=width, height=height)
+
+
+def estimate_projection_memory(args, width=None, height=None):
+    """Estimate the device memory needed by one device thread for the projections. The stages follow
+    the pipeline built by :func:`tofu.preprocess.create_preprocessing_pipeline` and end with the
+    projections held by general-backproject. *width* and *height* are the projection dimensions,
+    determined from *args* if not specified. Return a list of (stage name, number of bytes) tuples.
+    """
+    if not (width and height):
+        width, height = get_projection_shape(args)
+    float_size = DTYPE_CL_SIZE['float']
+    frame_size = width * height * float_size
+    stages = []
+
+    def add(name, nbytes, num_buffers=BUFFERS_PER_TASK):
+        stages.append((name, int(num_buffers * nbytes)))
+
+    add('input', frame_size)
+    if args.darks and args.flats:
+        num_flat_inputs = 3 if args.flats2 else 2
+        if args.resize:
+            add('bin', frame_size / args.resize ** 2 * (num_flat_inputs + 1))
+            frame_size /= args.resize ** 2
+        cached = get_flat_cache_dir(args) and not args.resize
+        if args.reduction_mode.lower() == 'median' and not cached:
+            # Reduced images are not cached, they are stacked on the device
+            num_images = len(get_filenames(args.darks)) + len(get_filenames(args.flats))
+            if args.flats2:
+                num_images += len(get_filenames(args.flats2))
+            add('stack', num_images * frame_size, num_buffers=1)
+        add('flat-reduction', num_flat_inputs * frame_size, num_buffers=1)
+        add('flat-field-correct', frame_size)
+    elif args.absorptivity:
+        add('absorptivity', frame_size)
+    if args.transpose_input:
+        add('transpose', frame_size)
+    if not np.all(np.isinf(args.source_position_y)):
+        add('cone-beam-projection-weight', frame_size)
+    if args.energy is not None and args.propagation_distance is not None:
+        padded_width = args.retrieval_padded_width or next_power_of_two(width + 64)
+        padded_height = args.retrieval_padded_height or next_power_of_two(height + 64)
+        padded_size = padded_width * padded_height * float_size
+        add('phase-retrieval-pad', padded_size)
+        # Complex numbers in the Fourier space
+        add('phase-retrieval-fft', 2 * padded_size)
+        add('retrieve-phase', 2 * padded_size)
+        add('phase-retrieval-ifft', padded_size)
+        add('phase-retrieval-crop', frame_size)
+        add('phase-retrieval-calculate', frame_size)
+    projection_width = width
+    if args.projection_filter != 'none':
+        padded_width = width + get_filtering_padding(width)
+        padded_size = padded_width * height * float_size
+        add('filter-pad', padded_size)
+        add('filter-fft', 2 * padded_size)
+        add('filter', 2 * padded_size)
+        add('filter-ifft', padded_size)
+        if args.projection_crop_after == 'filter':
+            add('filter-crop', frame_size)
+        else:
+            projection_width = padded_width
+    add('backproject', (args.burst or DEFAULT_BURST) * projection_width * height * float_size,
+        num_buffers=1)
+
+    return stages
+
+
+def log_plan(gpus, gpu_indices, runs, projection_stages, slice_size, num_gpu_threads=1,
+             log_level=logging.DEBUG):
+    """Log the planned passes *runs* (see :func:`make_runs`) and the predicted peak memory on every
+    device from *gpus* with *gpu_indices* based on the *projection_stages* (see
+    :func:`estimate_projection_memory`) and the *slice_size* in bytes.
+    """
+    projection_memory = sum(nbytes for (name, nbytes) in projection_stages)
+    LOG.log(log_level, 'Predicted projection memory per device thread: %.2f GB',
+            projection_memory / 2. ** 30)
+    for name, nbytes in projection_stages:
+        LOG.log(log_level, '  %-28s %.3f GB', name, nbytes / 2. ** 30)
+    LOG.log(log_level, 'Planned passes: %d', len(runs))
+    for i, regions in enumerate(runs):
+        description = ', '.join('GPU {}: {}'.format(gpu_index, region)
+                                for (gpu_index, region) in regions)
+        LOG.log(log_level, '  pass %d: %s', i, description)
+    for gpu, gpu_index in zip(gpus, gpu_indices):
+        max_slices = 0
+        for regions in runs:
+            # Threads of one device run concurrently
+            num_slices = sum(len(np.arange(*region)) for (index, region) in regions
+                             if index == gpu_index)
+            max_slices = max(max_slices, num_slices)
+        peak = max_slices * slice_size + num_gpu_threads * projection_memory
+        LOG.log(log_level, 'GPU %d: predicted peak memory %.2f GB of %.2f GB (%d slices)',
+                gpu_index, peak / 2. ** 30,
+                gpu.get_info(Ufo.GpuNodeInfo.GLOBAL_MEM_SIZE) / 2. ** 30, max_slices)
+
+
+def _run(resources, args, x_region, y_region, z_region, region_queue, slots, vol_nbytes,
+         region_cache=None, projection_reader=None, manifest=None, global_region=None,
+         profiler=None):
+    """Execute the reconstruction on all device threads given by *slots*. Every thread gets new
+    slice ranges from *region_queue* as soon as it finishes the previous one, so that devices don't
+    wait for each other. Optimize the read projection regions, look them up in *region_cache* first
+    if it is specified. If *projection_reader* is specified, the projections are read only once by
+    it and every thread gets its row window from there. Volume output is written by every thread
+    directly to its part of the volume, single-file output in the order of the regions. If
+    *manifest* is a :class:`ResumeManifest`, finished regions are recorded in it, per-region output
+    is named by the slice offset of the region and single-file output is written in parts which are
+    merged when all regions are finished. If *global_region* is specified, *z_region* is a part of
+    it, the output is named in the same way and the parts are merged by the caller. If *profiler*
+    is specified, every executor records its timings in it.
+    """
+    executors = [None] * len(slots)
+    writer = None
+    partial = global_region is not None
+    global_region = global_region if partial else z_region
+    num_slices = get_reconstructed_cube_shape(x_region, y_region, global_region)[2]
+    offset_names = manifest is not None or partial
+    bigtiff = vol_nbytes > 2 ** 32 - 2 ** 25
+    interrupted = False
+
+    if is_output_single_file(args) and offset_names:
+        writer = SidecarWriter(lambda offset: get_sidecar_filename(args, offset, num_slices))
+    elif is_output_single_file(args):
         import tifffile
-        bigtiff = vol_nbytes > 2 ** 32 - 2 ** 25
         LOG.debug('Writing BigTiff: %s', bigtiff)
         dirname = os.path.dirname(args.output)
         if dirname and not os.path.exists(dirname):
             os.makedirs(dirname)
-        writer = tifffile.TiffWriter(args.output, append=run_number != 0, bigtiff=bigtiff)
+        writer = AsyncWriter(tifffile.TiffWriter(args.output, bigtiff=bigtiff),
+                             num_buffers=args.writer_buffers,
+                             scratch_dir=args.writer_scratch_dir)
+    elif is_output_volume(args):
+        width, height = get_reconstructed_cube_shape(x_region, y_region, global_region)[:2]
+        writer = get_volume_writer(args.output, (num_slices, height, width),
+                                   DTYPE_NUMPY[args.store_type],
+                                   chunk_slices=args.output_chunk_slices,
+                                   compression=args.output_compression,
+                                   attrs=get_volume_attrs(args, x_region, y_region, global_region),
+                                   resume=offset_names)
 
-    for index in range(len(regions)):
-        gpu_index, region = regions[index]
-        region_index = run_number * len(resources) + index
-        executors.append(
-            Executor(
+    def start_one(index):
+        gpu_index = slots[index][0]
+        # Distinguish the device threads in the profile
+        current_thread().name = 'Thread {} (GPU {})'.format(index, gpu_index)
+        duration = 0
+        while not region_queue.aborted:
+            item = region_queue.get(index)
+            if item is None:
+                break
+            sequence, region = item
+            LOG.debug('Thread %d got region %d: %s', index, sequence, region)
+            slice_offset = int(np.round((region[0] - global_region[0]) / global_region[2]))
+            executors[index] = Executor(
                 resources[index],
                 args,
                 region,
                 x_region,
                 y_region,
                 gpu_index,
-                region_index,
-                writer=writer
+                slice_offset if offset_names else sequence,
+                writer=writer,
+                region_cache=region_cache,
+                slice_offset=slice_offset,
+                projection_reader=projection_reader,
+                index_digits=get_region_output_digits(num_slices) if offset_names else 3,
+                profiler=profiler
             )
-        )
-        if last:
-            # Chain up waiting events of subsequent executors
-            executors[-1].wait_event = last.finished
-        last = executors[-1]
+            if profiler:
+                with profiler.span('executor', gpu=int(gpu_index),
+                                   region=np.array(region, dtype=float).tolist(),
+                                   index=int(executors[index].region_index)) as span_args:
+                    duration += executors[index].process()
+                    span_args.update(executors[index].timings)
+            else:
+                duration += executors[index].process()
+            if manifest and not executors[index].abort_requested:
+                manifest.add(gpu_index, region, slice_offset,
+                             int(np.round((region[1] - region[0]) / region[2])), num_slices)
 
-    def start_one(index):
-        return executors[index].process()
+        return duration
 
     st = time.time()
 
     try:
-        with ThreadPool(processes=len(regions)) as pool:
+        with ThreadPool(processes=len(slots)) as pool:
             try:
-                pool.map(start_one, list(range(len(regions))))
+                pool.map(start_one, list(range(len(slots))))
             except KeyboardInterrupt:
                 LOG.info('Processing interrupted')
+                interrupted = True
+                region_queue.abort()
+                if writer:
+                    writer.abort()
                 for executor in executors:
-                    executor.abort()
+                    if executor:
+                        executor.abort()
     finally:
+        if projection_reader:
+            projection_reader.close()
+            LOG.debug('Projection reader: %d reads, %d hits', projection_reader.reads,
+                      projection_reader.hits)
         if writer:
             writer.close()
             LOG.debug('Writer closed')
+            if profiler and isinstance(writer, AsyncWriter):
+                profiler.count('write-time', writer.write_time)
+
+    if isinstance(writer, SidecarWriter) and not (interrupted or partial):
+        merge_sidecars(args, [entry['offset'] for entry in manifest.entries], num_slices,
+                       bigtiff=bigtiff)
+        manifest.remove()
 
     return time.time() - st
 
 
 def setup_graph(args, graph, x_region, y_region, region, source=None, gpu=None, do_output=True,
-                index=0, make_reader=True):
+                index=0, make_reader=True, reader=None, index_digits=3):
     backproject = get_task('general-backproject', processing_node=gpu)
 
     if do_output:
@@ -233,7 +963,7 @@ def setup_graph(args, graph, x_region, y_region, region, source=None, gpu=None,
             sink = get_task('null', processing_node=gpu, download=True)
         else:
             sink = get_writer(args)
-            sink.props.filename = '{}-{:>03}-%04i.tif'.format(args.output, index)
+            sink.props.filename = '{}-{:0{}}-%04i.tif'.format(args.output, index, index_digits)
 
     width = args.width
     height = args.height
@@ -285,7 +1015,7 @@ def setup_graph(args, graph, x_region, y_region, region, source=None, gpu=None,
     source = create_preprocessing_pipeline(args, graph, source=source,
                                            processing_node=gpu,
                                            cone_beam_weight=not args.disable_cone_beam_weight,
-                                           make_reader=make_reader)
+                                           make_reader=make_reader, reader=reader)
     if source:
         graph.connect_nodes(source, backproject)
     else:
@@ -306,6 +1036,28 @@ def is_output_single_file(args):
     return not args.dry_run and (filename.endswith('.tif') or filename.endswith('.tiff'))
 
 
+def is_output_volume(args):
+    return not args.dry_run and is_volume_output(args.output)
+
+
+def get_volume_attrs(args, x_region, y_region, z_region):
+    """Get the reconstruction region and geometry metadata stored with the output volume, angles are
+    in radians.
+    """
+    attrs = {'x_region': np.array(x_region, dtype=float).tolist(),
+             'y_region': np.array(y_region, dtype=float).tolist(),
+             'region': np.array(z_region, dtype=float).tolist(),
+             'z_parameter': args.z_parameter,
+             'z': args.z,
+             'number': args.number,
+             'overall_angle': float(args.overall_angle)}
+    for name in GEOMETRY_PARAMETERS:
+        name = name.replace('-', '_')
+        attrs[name] = np.array(getattr(args, name), dtype=float).tolist()
+
+    return attrs
+
+
 def set_projection_filter_scale(args):
     is_parallel = np.all(np.isinf(args.source_position_y))
     magnification = (args.source_position_y[0] - args.detector_position_y[0]) / \
@@ -389,11 +1141,22 @@ def _are_values_equal(values):
 class Executor(object):
     """Reconstructs one region.
 
-    :param writer: if not None, we'll be writing to a file shared with other executors and need to
-    use *wait_event* to make sure we write our region when the previous executors are finished.
+    :param writer: if not None, either an :class:`AsyncWriter` shared with other executors which
+    writes our region when it is our turn given by *region_index*, i.e. when the preceding regions
+    are written, or a :class:`tofu.volume.VolumeWriter` or :class:`SidecarWriter` to which we
+    write our slices directly starting at *slice_offset*.
+    :param region_cache: if not None, a :class:`RegionCache` used for looking up the optimized
+    projection region.
+    :param projection_reader: if not None, a :class:`SharedProjectionReader` from which we get the
+    projections instead of reading them ourselves.
+    :param index_digits: number of digits of *region_index* in the output file names.
+    :param profiler: if not None, a :class:`tofu.profiling.Profiler` in which the geometry
+    optimization and the graph execution are recorded. Time spent by waiting for the output
+    buffers, writing and waiting for the projections are summed up in *timings* in any case.
     """
     def __init__(self, resources, args, region, x_region, y_region, gpu_index, region_index,
-                 writer=None):
+                 writer=None, region_cache=None, slice_offset=0, projection_reader=None,
+                 index_digits=3, profiler=None):
         self.resources = resources
         self.args = args
         self.region = region
@@ -402,11 +1165,19 @@ class Executor(object):
         self.y_region = y_region
         self.region_index = region_index
         self.writer = writer
+        self.region_cache = region_cache
+        self.slice_offset = slice_offset
+        self.projection_reader = projection_reader
+        self.index_digits = index_digits
+        self.profiler = profiler
+        self.timings = {'geometry': 0, 'ufo': 0, 'output_wait': 0, 'write': 0,
+                        'projection_wait': 0}
         self.output = Ufo.OutputTask() if self.writer else None
+        self.input = Ufo.InputTask() if self.projection_reader else None
         self.scheduler = None
-        self.wait_event = None
         self.finished = Event()
         self.abort_requested = False
+        self.feed_error = None
 
     def process(self):
         self.scheduler = Ufo.FixedScheduler()
@@ -429,46 +1200,117 @@ class Executor(object):
                 LOG.debug('--y or --height or --transpose-input specified, '
                           'not optimizing projection region')
             else:
-                geometry.optimize_args(region=self.region)
+                st = time.perf_counter()
+                geometry.optimize_args(region=self.region, cache=self.region_cache)
+                self.timings['geometry'] = time.perf_counter() - st
+                if self.profiler:
+                    self.profiler.add('geometry-optimization', st - self.profiler.start,
+                                      self.timings['geometry'],
+                                      region=np.array(self.region, dtype=float).tolist())
         opt_args = geometry.args
         if self.args.dry_run:
             source = get_task('dummy-data', number=self.args.number, width=self.args.width,
                               height=self.args.height)
         else:
             source = None
+        # Take the row window before setup_graph swaps width and height for transposed input
+        rows = (opt_args.y, opt_args.height, opt_args.y_step)
         last = setup_graph(opt_args, graph, self.x_region, self.y_region, self.region,
                            source=source, gpu=gpu, index=self.region_index, make_reader=True,
-                           do_output=self.writer is None)[-1]
+                           do_output=self.writer is None, reader=self.input,
+                           index_digits=self.index_digits)[-1]
         if self.writer:
             graph.connect_nodes(last, self.output)
 
         LOG.debug('Device: %d, region: %s', self.gpu_index, self.region)
+        started = time.time()
+        st = time.perf_counter()
         thread = Thread(target=self.scheduler.run, args=(graph,))
         thread.setDaemon(True)
         thread.start()
 
+        if self.input:
+            feeder = Thread(target=self.feed, args=rows)
+            feeder.setDaemon(True)
+            feeder.start()
+
         if self.writer:
             self.consume()
 
         thread.join()
+        if self.feed_error is not None:
+            raise RuntimeError('Reading projections of region {} failed: {}'
+                               .format(self.region, self.feed_error))
+        self.timings['ufo'] = self.scheduler.props.time
+        if self.profiler:
+            self.profiler.add('graph', st - self.profiler.start, time.perf_counter() - st,
+                              gpu=int(self.gpu_index),
+                              region=np.array(self.region, dtype=float).tolist())
+            if self.args.enable_tracing:
+                self.profiler.merge_ufo_traces('GPU {} region {}'.format(self.gpu_index,
+                                                                         self.region_index),
+                                               started)
 
         return self.scheduler.props.time
 
+    def feed(self, y, height, y_step):
+        """Push rows *y* to *y* + *height* with *y_step* of all projections from the shared
+        projection reader to our graph.
+        """
+        import ufo.numpy
+
+        buf = None
+        rows = slice(y, y + height * y_step, y_step)
+        try:
+            for index in range(len(self.projection_reader)):
+                if self.abort_requested:
+                    LOG.debug('Abort requested in feeding region %s', self.region)
+                    break
+                st = time.perf_counter()
+                window = self.projection_reader.get(index, rows=rows)
+                self.timings['projection_wait'] += time.perf_counter() - st
+                window = np.ascontiguousarray(window)
+                if buf is None:
+                    buf = ufo.numpy.fromarray(window)
+                else:
+                    buf = self.input.get_input_buffer()
+                    ufo.numpy.fromarray_inplace(buf, window)
+                self.input.release_input_buffer(buf)
+        except Exception as error:
+            # Reported by process(), the graph must not wait for more input
+            self.feed_error = error
+        finally:
+            self.input.stop()
+
     def consume(self):
         import ufo.numpy
 
-        if self.wait_event:
-            LOG.debug('Executor of region %s waiting for writing', self.region)
-            self.wait_event.wait()
+        volume_region = None
+        if not isinstance(self.writer, AsyncWriter):
+            # Chunked volume or a part of single-file output, write our slices directly to their
+            # place
+            volume_region = self.writer.region(self.slice_offset)
 
         for i in np.arange(*self.region):
             if self.abort_requested:
                 LOG.debug('Abort requested in writing of region %s', self.region)
                 return
+            st = time.perf_counter()
             buf = self.output.get_output_buffer()
-            self.writer.save(ufo.numpy.asarray(buf))
+            self.timings['output_wait'] += time.perf_counter() - st
+            st = time.perf_counter()
+            # Copy to the writer's buffers and give the buffer back to UFO immediately
+            if volume_region is None:
+                self.writer.put(self.region_index, ufo.numpy.asarray(buf))
+            else:
+                volume_region.save(ufo.numpy.asarray(buf))
             self.output.release_output_buffer(buf)
+            self.timings['write'] += time.perf_counter() - st
 
+        if volume_region is None:
+            self.writer.finish(self.region_index)
+        else:
+            volume_region.close()
         self.finished.set()
         LOG.debug('Executor of region %s finished writing', self.region)
 
@@ -478,6 +1320,519 @@ class Executor(object):
             self.scheduler.abort()
 
 
+class RegionQueue(object):
+    """Hand out consecutive parts of *z_region* to device threads on demand. *slot_sizes* are the
+    maximum numbers of slices per device thread. Every region gets a sequence number which gives its
+    position in the output. *data_splitting_policy* specifies how to split the rest of the slices
+    which cannot saturate all device threads, 'one': every thread takes as many slices as it can,
+    'many': the rest is split evenly between the threads. *done* is an optional boolean array with
+    one entry per slice, slices marked as done are not handed out and regions do not span them.
+    """
+    def __init__(self, z_region, slot_sizes, data_splitting_policy='one', done=None):
+        self.z_start, self.z_stop, self.z_step = z_region
+        self.num_slices = get_reconstructed_cube_shape((0, 1, 1), (0, 1, 1), z_region)[2]
+        self.slot_sizes = slot_sizes
+        self.data_splitting_policy = data_splitting_policy
+        self.aborted = False
+        self._todo = np.ones(self.num_slices, dtype=bool)
+        if done is not None:
+            self._todo[np.asarray(done, dtype=bool)] = False
+        self._next_slice = 0
+        self._next_sequence = 0
+        self._tail_size = None
+        self._lock = Lock()
+
+    def __len__(self):
+        """Number of slices which have not been handed out yet."""
+        return int(np.count_nonzero(self._todo[self._next_slice:]))
+
+    def get(self, slot):
+        """Get (sequence number, region) for device thread *slot*, None if all slices have been
+        handed out or processing has been aborted.
+        """
+        with self._lock:
+            remaining = len(self)
+            if self.aborted or remaining <= 0:
+                return None
+            current = self.slot_sizes[slot]
+            if self.data_splitting_policy == 'many' and remaining < sum(self.slot_sizes):
+                if self._tail_size is None:
+                    # Split the rest evenly when the threads cannot be saturated for the first time
+                    self._tail_size = (remaining - 1) // len(self.slot_sizes) + 1
+                current = min(current, self._tail_size)
+            # Skip finished slices and don't span the next finished ones
+            while not self._todo[self._next_slice]:
+                self._next_slice += 1
+            run_length = np.argmin(self._todo[self._next_slice:])
+            if run_length == 0:
+                run_length = self.num_slices - self._next_slice
+            current = min(current, remaining, run_length)
+            start = self.z_start + self._next_slice * self.z_step
+            region = [start, start + current * self.z_step, self.z_step]
+            sequence = self._next_sequence
+            self._next_slice += current
+            self._next_sequence += 1
+
+            return (sequence, region)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+
+    def get_slice_index(self, value):
+        """Get the index of the slice at z parameter *value*."""
+        return int(np.round((value - self.z_start) / self.z_step))
+
+
+class AsyncWriter(object):
+    """Write regions of slices into *writer* (a tifffile.TiffWriter or anything with *close* and
+    *write* accepting the *contiguous* keyword) in a separate thread in the order given by the
+    region sequence numbers. Slices are copied into a ring of *num_buffers* preallocated buffers,
+    so that the producers can release their buffers right away. Regions which arrive before their
+    predecessors are staged in scratch files in *scratch_dir* (system default if None) and written
+    when it is their turn.
+    """
+    _STOP = object()
+
+    def __init__(self, writer, num_buffers=8, scratch_dir=None):
+        self.writer = writer
+        self.num_buffers = num_buffers
+        self.scratch_dir = scratch_dir
+        self.aborted = False
+        self.error = None
+        self.write_time = 0
+        self._free = queue.Queue()
+        self._pending = queue.Queue()
+        self._lock = Lock()
+        self._allocated = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, sequence, data):
+        """Copy slice *data* of region with *sequence* number to a free buffer and queue it for
+        writing. Block if all buffers are in use.
+        """
+        with self._lock:
+            if not self._allocated:
+                for i in range(self.num_buffers):
+                    self._free.put(np.empty_like(data))
+                self._allocated = True
+        while not self.aborted:
+            try:
+                buf = self._free.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            return
+        np.copyto(buf, data)
+        self._pending.put((sequence, buf))
+
+    def finish(self, sequence):
+        """All slices of the region with *sequence* number have been put."""
+        self._pending.put((sequence, None))
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        """Wait until all queued slices are written and close the underlying writer."""
+        self._pending.put(self._STOP)
+        self._thread.join()
+        self.writer.close()
+        if self.error:
+            raise RuntimeError('Writing failed: {}'.format(self.error))
+
+    def _save(self, data):
+        if not (self.aborted or self.error):
+            try:
+                st = time.perf_counter()
+                self.writer.write(data, contiguous=True)
+                self.write_time += time.perf_counter() - st
+            except Exception as e:
+                LOG.error('Writing failed: %s', e)
+                self.error = e
+
+    def _run(self):
+        next_sequence = 0
+        staged = {}
+
+        def advance():
+            # Region finished, write the staged successors which are available
+            current = next_sequence + 1
+            while current in staged:
+                region = staged[current]
+                for data in region.read():
+                    self._save(data)
+                region.close()
+                if not region.finished:
+                    # The rest of this region will come directly
+                    del staged[current]
+                    break
+                del staged[current]
+                current += 1
+
+            return current
+
+        while True:
+            item = self._pending.get()
+            if item is self._STOP:
+                break
+            sequence, buf = item
+            if sequence == next_sequence:
+                if buf is None:
+                    next_sequence = advance()
+                else:
+                    self._save(buf)
+            else:
+                if sequence not in staged:
+                    staged[sequence] = _StagedRegion(self.scratch_dir)
+                if buf is None:
+                    staged[sequence].finished = True
+                else:
+                    staged[sequence].append(buf)
+            if buf is not None:
+                self._free.put(buf)
+
+        if staged:
+            if not self.aborted:
+                LOG.error('Regions %s were not written because their predecessors are missing',
+                          sorted(staged.keys()))
+            for region in staged.values():
+                region.close()
+
+
+class _StagedRegion(object):
+    """Slices of one region which is waiting for its predecessors stored in a scratch file."""
+    def __init__(self, scratch_dir=None):
+        self.file = tempfile.TemporaryFile(dir=scratch_dir)
+        self.finished = False
+        self.shape = None
+        self.dtype = None
+        self.count = 0
+
+    def append(self, data):
+        self.shape = data.shape
+        self.dtype = data.dtype
+        self.file.write(data.tobytes())
+        self.count += 1
+
+    def read(self):
+        self.file.seek(0)
+        for i in range(self.count):
+            nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+            yield np.frombuffer(self.file.read(nbytes), dtype=self.dtype).reshape(self.shape)
+
+    def close(self):
+        self.file.close()
+
+
+class RegionCache(object):
+    """Bounded LRU cache of optimized projection regions (xmin, ymin, xmax, ymax) keyed by
+    :meth:`CTGeometry.get_region_key`. At most *maxsize* entries are kept. If *filename* is given,
+    entries are loaded from it if it exists and :meth:`save` stores them there, so that subsequent
+    runs with the same geometry don't need to compute the regions again.
+    """
+    def __init__(self, maxsize=256, filename=None):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if self.filename and os.path.exists(self.filename):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+            return self._entries[key]
+
+    def put(self, key, extrema):
+        with self._lock:
+            self._entries[key] = tuple(int(value) for value in extrema)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            LOG.warning("Could not read projection region cache `%s'", self.filename)
+            return
+        for key, extrema in entries:
+            self.put(key, extrema)
+        LOG.debug("Loaded %d projection regions from `%s'", len(entries), self.filename)
+
+    def save(self):
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self._lock:
+            entries = list(self._entries.items())
+        tmp_name = self.filename + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_name, self.filename)
+        LOG.debug("Stored %d projection regions in `%s'", len(entries), self.filename)
+
+
+class SharedProjectionReader(object):
+    """Read projections given by *frames*, a list of (file name, page index) tuples, only once for
+    all device threads. Memory-mapped projections (see :class:`tofu.projections.ProjectionSource`)
+    are not cached, every thread reads only its rows directly from the file. Whenever any other
+    projection is requested, *read_ahead* next ones are read in a thread pool. At most
+    *max_frames* decoded projections are kept, the least recently used ones are dropped. Every
+    region starts at the first projection, so threads which are processing their regions
+    concurrently share the reads only as long as they are not more than *max_frames* projections
+    apart (--projection-buffer-size), projections which have been dropped are read again and
+    counted in *rereads* with a warning for the first one. If *profiler* is specified, every read
+    is recorded in it.
+    """
+    def __init__(self, frames, read_ahead=16, max_frames=32, num_threads=4, profiler=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.frames = frames
+        self.source = ProjectionSource(frames)
+        self.profiler = profiler
+        self.read_ahead = read_ahead
+        self.max_frames = max_frames
+        self.reads = 0
+        self.hits = 0
+        self.rereads = 0
+        self._read_indices = set()
+        self._futures = OrderedDict()
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get(self, index, rows=None):
+        """Get projection *index* as a float32 array, only its *rows* (a slice) if specified."""
+        if self.source.is_mapped(index):
+            return self._read(index, rows=rows)
+        with self._lock:
+            if index in self._futures:
+                self.hits += 1
+            future = self._submit(index)
+            for i in range(index + 1, min(index + 1 + self.read_ahead, len(self.frames))):
+                self._submit(i)
+
+        frame = future.result()
+
+        return frame if rows is None else frame[rows]
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        with self._lock:
+            self._futures.clear()
+        self.source.close()
+
+    def _submit(self, index):
+        if index not in self._futures:
+            self.reads += 1
+            if index in self._read_indices:
+                if not self.rereads:
+                    LOG.warning('Device threads are more than %d projections apart, dropped '
+                                'projections are read again', self.max_frames)
+                self.rereads += 1
+            self._read_indices.add(index)
+            self._futures[index] = self._pool.submit(self._read, index)
+        self._futures.move_to_end(index)
+        while len(self._futures) > self.max_frames:
+            self._futures.popitem(last=False)
+
+        return self._futures[index]
+
+    def _read(self, index, rows=None):
+        if self.profiler is None:
+            return self._decode(index, rows=rows)
+        with self.profiler.span('read', category='io', index=index) as args:
+            data = self._decode(index, rows=rows)
+            args['bytes'] = data.nbytes
+        self.profiler.count('read-bytes', data.nbytes)
+
+        return data
+
+    def _decode(self, index, rows=None):
+        return np.array(self.source.get(index, rows=rows), dtype=np.float32)
+
+
+class SidecarWriter(object):
+    """Write every region of single-file output into its own TIFF file given by *get_filename*
+    called with the slice offset of the region. A part is renamed to its final name only when it is
+    complete.
+    """
+    def __init__(self, get_filename):
+        self.get_filename = get_filename
+        self.aborted = False
+
+    def region(self, start):
+        filename = self.get_filename(start)
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        return _SidecarRegion(self, filename)
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        pass
+
+
+class _SidecarRegion(object):
+    def __init__(self, writer, filename):
+        import tifffile
+
+        self.writer = writer
+        self.filename = filename
+        self._tmp_name = filename + '.tmp.tif'
+        self._tif = tifffile.TiffWriter(self._tmp_name)
+
+    def save(self, data):
+        self._tif.write(data, contiguous=True)
+
+    def close(self):
+        self._tif.close()
+        if self.writer.aborted:
+            os.remove(self._tmp_name)
+        else:
+            os.replace(self._tmp_name, self.filename)
+
+
+class ResumeManifest(object):
+    """Finished regions of a reconstruction stored as JSON in *filename*. The manifest belongs to
+    the reconstruction given by *key* (see :func:`get_resume_key`), if it was written for a
+    different one, it is discarded.
+    """
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self.entries = []
+        self._lock = Lock()
+        if os.path.exists(self.filename):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, gpu_index, region, offset, num_slices, num_total):
+        """Record finished *region* with *num_slices* slices starting at slice *offset* computed by
+        GPU *gpu_index*, *num_total* is the total number of slices.
+        """
+        with self._lock:
+            self.entries.append({'gpu': int(gpu_index),
+                                 'region': np.array(region, dtype=float).tolist(),
+                                 'offset': int(offset),
+                                 'num_slices': int(num_slices),
+                                 'num_total': int(num_total)})
+            self._save()
+
+    def validate(self, is_complete):
+        """Keep only entries for which *is_complete* returns True."""
+        with self._lock:
+            valid = [entry for entry in self.entries if is_complete(entry)]
+            if len(valid) != len(self.entries):
+                LOG.warning('Output of %d finished regions is incomplete, they will be '
+                            'reconstructed again', len(self.entries) - len(valid))
+            self.entries = valid
+
+    def get_done_slices(self, num_slices):
+        """Get a boolean array marking the finished slices out of *num_slices*."""
+        done = np.zeros(num_slices, dtype=bool)
+        for entry in self.entries:
+            done[entry['offset']:entry['offset'] + entry['num_slices']] = True
+
+        return done
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                contents = json.load(f)
+        except (OSError, ValueError):
+            LOG.warning("Could not read resume manifest `%s'", self.filename)
+            return
+        if contents.get('key') != self.key:
+            LOG.warning("Manifest `%s' belongs to a reconstruction with different settings, "
+                        "starting from scratch", self.filename)
+            return
+        self.entries = contents['regions']
+
+    def clear(self):
+        """Forget all finished regions and remove the manifest file."""
+        with self._lock:
+            self.entries = []
+            self.remove()
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def _save(self):
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_name = self.filename + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump({'key': self.key, 'regions': self.entries}, f, indent=4)
+        os.replace(tmp_name, self.filename)
+
+
+class TuningDatabase(object):
+    """Best reconstruction configurations found by :func:`autotune` stored as JSON in *filename*,
+    which defaults to genreco-tuning.json in the user's cache directory.
+    """
+    def __init__(self, filename=None):
+        if not filename:
+            cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'),
+                                                                      '.cache'))
+            filename = os.path.join(cache_dir, 'tofu', TUNING_DATABASE_NAME)
+        self.filename = filename
+        self._entries = {}
+        if os.path.exists(self.filename):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            LOG.warning("Could not read tuning database `%s'", self.filename)
+
+    def save(self):
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp_name = self.filename + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(self._entries, f, indent=4, sort_keys=True)
+        os.replace(tmp_name, self.filename)
+        LOG.debug("Stored %d tuned configurations in `%s'", len(self._entries), self.filename)
+
+
 class CTGeometry(object):
     def __init__(self, args):
         self.args = copy.deepcopy(args)
@@ -520,6 +1875,12 @@ class CTGeometry(object):
     def is_center_constant(self):
         return self.is_center_position_x_constant and self.is_center_position_z_constant
 
+    @property
+    def is_geometry_constant(self):
+        """Are all geometry parameters the same for all projections?"""
+        return all(_are_values_equal(getattr(self.args, name.replace('-', '_')))
+                   for name in GEOMETRY_PARAMETERS)
+
     @property
     def is_simple_parallel_tomo(self):
         return (not (self.is_axis_rotated or self.is_detector_rotated or
@@ -527,8 +1888,20 @@ class CTGeometry(object):
                      self.is_center_constant)
 
 
-    def optimize_args(self, region=None):
-        xmin, ymin, xmax, ymax = self.compute_height(region=region)
+    def optimize_args(self, region=None, cache=None):
+        """Restrict the projection region to the one needed for reconstructing *region*. If
+        *cache* is a :class:`RegionCache`, look the region up there first and store it there if it
+        had to be computed.
+        """
+        if cache is None:
+            xmin, ymin, xmax, ymax = self.compute_height(region=region)
+        else:
+            key = self.get_region_key(region=region)
+            extrema = cache.get(key)
+            if extrema is None:
+                extrema = self.compute_height(region=region)
+                cache.put(key, extrema)
+            xmin, ymin, xmax, ymax = extrema
         center_position_z = np.array(self.args.center_position_z) - ymin
         self.args.center_position_z = center_position_z.tolist()
         self.args.y = int(ymin)
@@ -540,39 +1913,138 @@ class CTGeometry(object):
         LOG.debug('Optimized center_position_z: %g - %g', self.args.center_position_z[0],
                   self.args.center_position_z[-1])
 
+    def get_region_key(self, region=None):
+        """Get a hash of all arguments which determine the projection region for *region*."""
+        values = {}
+        for name in REGION_PARAMETERS:
+            value = getattr(self.args, name.replace('-', '_'))
+            values[name] = np.array(value).tolist()
+        values['region'] = np.array(region or self.args.region, dtype=float).tolist()
+
+        return hashlib.sha1(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
     def compute_height(self, region=None):
-        extrema = []
         if not region:
             region = self.args.region
 
-        if self.is_simple_parallel_tomo:
-            # Simple parallel beam tomography, thus compute only the horizontal crop at rotations
-            # which are multiples of 45 degrees
-            LOG.debug('Computing optimal projection region from 4 angles')
-            projs_per_45 = self.args.number / self.args.overall_angle * np.pi / 4
-            stop = 4 if self.args.overall_angle <= np.pi else 8
-            indices = projs_per_45 * np.arange(1, stop, 2)
-            indices = np.round(indices).astype(int).tolist()
+        if self.is_parallel and self.is_geometry_constant:
+            # The projected extrema are sinusoids of the rotation angle, get their bounds in closed
+            # form independent of the number of projections
+            LOG.debug('Computing optimal projection region analytically')
+            xe_0, ye_0 = self._compute_parallel_bounds(region[0])
+            xe_1, ye_1 = self._compute_parallel_bounds(region[1])
         else:
             LOG.debug('Computing optimal projection region from all angles')
-            indices = list(range(self.args.number))
+            indices = np.arange(self.args.number)
+            # Region extrema for all projection angles at once, rounding and clipping are
+            # monotonic, so the detector region of all points is the same as the union of the
+            # per-angle regions
+            xe_0, ye_0 = self._compute_parameters(region[0], indices)
+            xe_1, ye_1 = self._compute_parameters(region[1], indices)
+
+        x_min, x_max, y_min, y_max = compute_detector_region(np.concatenate((xe_0, xe_1)),
+                                                             np.concatenate((ye_0, ye_1)),
+                                                             (self.args.height, self.args.width),
+                                                             overhead=self.args.projection_margin)
+        if y_max == y_min:
+            # Don't let height be 0
+            y_max += 1
 
-        for i in indices:
-            extrema_0 = self._compute_one_parameter(region[0], i)
-            extrema_1 = self._compute_one_parameter(region[1], i)
-            extrema.append(extrema_0)
-            extrema.append(extrema_1)
+        return (x_min, y_min, x_max, y_max)
 
-        minima = np.min(extrema, axis=0)
-        maxima = np.max(extrema, axis=0)
-        if maxima[-1] == minima[2]:
-            # Don't let height be 0
-            maxima[-1] += 1
-        result = tuple(minima[::2]) + tuple(maxima[1::2])
+    def _get_points(self, z):
+        points = get_extrema(self.args.x_region, self.args.y_region, z)
+        if self.args.z_parameter != 'z':
+            points_upper = get_extrema(self.args.x_region, self.args.y_region, z + 1)
+            points = np.hstack((points, points_upper))
 
-        return result
+        return points
+
+    def _get_geometry(self, param_value, indices):
+        """Get z, source positions, axis, detector and volume rotation for projection *indices*,
+        *param_value* is the value of the z parameter.
+        """
+        values = {}
+        for name in GEOMETRY_PARAMETERS:
+            values[name] = get_scarray_values(getattr(self.args, name.replace('-', '_')), indices)
+
+        z = self.args.z
+        if self.args.z_parameter == 'z':
+            z = param_value
+        elif self.args.z_parameter in values:
+            values[self.args.z_parameter] = np.full(len(indices), param_value, dtype=float)
+        else:
+            raise RuntimeError("Unknown z parameter '{}'".format(self.args.z_parameter))
+
+        def stack(prefix, y_values=None):
+            y_values = values[prefix + '-y'] if y_values is None else y_values
+            return np.stack((values[prefix + '-x'], y_values, values[prefix + '-z']), axis=1)
+
+        source_positions = stack('source-position')
+        axis = Vector(x_angle=values['axis-angle-x'],
+                      y_angle=values['axis-angle-y'],
+                      z_angle=values['axis-angle-z'],
+                      position=stack('center-position', y_values=np.zeros(len(indices))))
+        detector = Vector(x_angle=values['detector-angle-x'],
+                          y_angle=values['detector-angle-y'],
+                          z_angle=values['detector-angle-z'],
+                          position=stack('detector-position'))
+        volume_angle = Vector(x_angle=values['volume-angle-x'],
+                              y_angle=values['volume-angle-y'],
+                              z_angle=values['volume-angle-z'])
+
+        return z, source_positions, axis, detector, volume_angle
+
+    def _compute_parameters(self, param_value, indices):
+        """Compute detector coordinates of the region extrema for all projection *indices* at once,
+        *param_value* is the value of the z parameter. Return flattened x and y coordinates.
+        """
+        indices = np.asarray(indices)
+        z, source_positions, axis, detector, volume_angle = self._get_geometry(param_value,
+                                                                               indices)
+        points = self._get_points(z)
+        tomo_angles = indices.astype(float) / self.args.number * self.args.overall_angle
+        xe, ye = compute_detector_pixels_batch(points, source_positions, axis, volume_angle,
+                                               detector, tomo_angles)
+
+        return xe.ravel(), ye.ravel()
+
+    def _compute_parallel_bounds(self, param_value):
+        """Compute the bounds of the detector coordinates of the region extrema over all rotation
+        angles for parallel beam geometry which is the same for all projections, *param_value* is
+        the value of the z parameter. Return minima and maxima of x and y coordinates.
+        """
+        z, source_positions, axis, detector, volume_angle = self._get_geometry(param_value, [0])
+        # Parallel beam projection is an affine mapping of the points rotated around the axis,
+        # get it from the images of the origin and the unit vectors
+        basis = np.hstack((np.zeros((3, 1)), np.eye(3)))
+        xb, yb = compute_detector_pixels_batch(basis, source_positions, axis,
+                                               Vector(x_angle=np.zeros(1), y_angle=np.zeros(1),
+                                                      z_angle=np.zeros(1)),
+                                               detector, np.zeros(1))
+        offsets = np.array([xb[0, 0], yb[0, 0]])
+        matrix = np.array([xb[0, 1:], yb[0, 1:]]) - offsets[:, np.newaxis]
+        volume_rotation = get_rotation_matrices(volume_angle.x_angle, volume_angle.y_angle,
+                                                volume_angle.z_angle, 1)[0]
+        points = np.dot(volume_rotation, self._get_points(z))
+        # Angle of the last projection
+        angle_range = (self.args.number - 1) / self.args.number * self.args.overall_angle
+
+        bounds = []
+        for row, offset in zip(matrix, offsets):
+            # Rotation by t maps the coordinate to alpha * cos(t) + beta * sin(t) + const
+            alpha = row[0] * points[0] + row[1] * points[1]
+            beta = row[1] * points[0] - row[0] * points[1]
+            const = row[2] * points[2] + offset
+            minima, maxima = get_harmonic_extrema(alpha, beta, angle_range)
+            bounds.append(np.concatenate((minima + const, maxima + const)))
+
+        return tuple(bounds)
 
     def _compute_one_parameter(self, param_value, index):
+        """Scalar counterpart of :meth:`_compute_parameters` for one projection *index*, return
+        the detector region as (x_min, x_max, y_min, y_max).
+        """
         source_position = np.array([get_scarray_value(self.args.source_position_x, index),
                                     get_scarray_value(self.args.source_position_y, index),
                                     get_scarray_value(self.args.source_position_z, index)])
@@ -717,10 +2189,111 @@ def compute_detector_pixels(points, source_position, axis, volume_rotation, dete
     return x, y
 
 
+def compute_detector_pixels_batch(points, source_positions, axis, volume_rotation, detector,
+                                  tomo_angles):
+    """Vectorized :func:`compute_detector_pixels` for N projections at once. *points* are the same
+    for all projections (array of height 3), *source_positions* is an (N, 3) array, *axis*,
+    *volume_rotation* and *detector* are util.Vector instances with angles of length N and
+    positions of shape (N, 3), *tomo_angles* are the N rotation angles. Return x and y detector
+    coordinates as (N, number of points) arrays.
+    """
+    num_angles = len(tomo_angles)
+    detector_rotation = get_rotation_matrices(detector.x_angle, detector.y_angle,
+                                              detector.z_angle, num_angles)
+    detector_normals = np.matmul(detector_rotation, np.array((0, -1, 0), dtype=float))
+    detector_offsets = -np.sum(detector.position * detector_normals, axis=1)
+
+    voxels = np.tile(points, (num_angles, 1, 1))
+    parallel = np.isinf(source_positions[:, 1])
+    if not np.all(parallel):
+        # Apply magnification
+        cone = ~parallel
+        source_y = source_positions[cone, 1][:, np.newaxis, np.newaxis]
+        detector_y = detector.position[cone, 1][:, np.newaxis, np.newaxis]
+        voxels[cone] = -voxels[cone] * source_y / (detector_y - source_y)
+
+    # Rotate the volume, then around the axis and then the axis itself, all in one matrix
+    rotation = np.matmul(get_rotation_matrices(axis.x_angle, axis.y_angle, axis.z_angle,
+                                               num_angles),
+                         np.matmul(get_rotation_matrices_z(tomo_angles),
+                                   get_rotation_matrices(volume_rotation.x_angle,
+                                                         volume_rotation.y_angle,
+                                                         volume_rotation.z_angle,
+                                                         num_angles)))
+    voxels = np.matmul(rotation, voxels)
+
+    # Get the projected pixels
+    projected = project_batch(voxels, source_positions, detector_normals, detector_offsets)
+
+    tilted = np.any(detector_normals != np.array([0., -1, 0]), axis=1)
+    if np.any(tilted):
+        # Detector is not perpendicular, reverse the rotation by the transposed matrices
+        projected[tilted] -= detector.position[tilted][:, :, np.newaxis]
+        projected[tilted] = np.matmul(np.transpose(detector_rotation[tilted], (0, 2, 1)),
+                                      projected[tilted])
+
+    x = projected[:, 0, :] + axis.position[:, 0, np.newaxis] - 0.5
+    y = projected[:, 2, :] + axis.position[:, 2, np.newaxis] - 0.5
+
+    return x, y
+
+
+def project_batch(points, sources, detector_normals, detector_offsets):
+    """Vectorized :func:`project`, *points* is an (N, 3, number of points) array, *sources* and
+    *detector_normals* are (N, 3) arrays and *detector_offsets* has length N.
+    """
+    projected = points.copy()
+    parallel = np.isinf(sources[:, 1])
+    tilted = np.any(detector_normals != np.array([0., -1, 0]), axis=1)
+
+    # Parallel beam with a detector which is not perpendicular, compute translation along the beam
+    # direction, otherwise voxels are mapped directly to detector coordinates
+    indices = parallel & tilted
+    if np.any(indices):
+        normals = detector_normals[indices][:, :, np.newaxis]
+        offsets = detector_offsets[indices][:, np.newaxis]
+        current = points[indices]
+        projected[indices, 1, :] = - (offsets +
+                                      normals[:, 0] * current[:, 0, :] +
+                                      normals[:, 2] * current[:, 2, :]) / normals[:, 1]
+
+    # Cone beam
+    cone = ~parallel
+    if np.any(cone):
+        source = sources[cone][:, :, np.newaxis]
+        normals = detector_normals[cone][:, :, np.newaxis]
+        current = points[cone]
+        denom = np.sum((current - source) * normals, axis=1)
+        u = -(detector_offsets[cone][:, np.newaxis] +
+              np.sum(sources[cone] * detector_normals[cone], axis=1)[:, np.newaxis]) / denom
+        projected[cone] = source + (current - source) * u[:, np.newaxis, :]
+
+    return projected
+
+
+def get_harmonic_extrema(alpha, beta, angle_range):
+    """Get the minima and maxima of alpha * cos(t) + beta * sin(t) for t from 0 to *angle_range*,
+    *alpha* and *beta* are arrays. Negative *angle_range* is mirrored to a positive one.
+    """
+    if angle_range < 0:
+        # alpha * cos(-t) + beta * sin(-t) = alpha * cos(t) - beta * sin(t)
+        beta = -beta
+        angle_range = -angle_range
+    amplitude = np.hypot(alpha, beta)
+    phase = np.mod(np.arctan2(beta, alpha), 2 * np.pi)
+    start = alpha
+    stop = alpha * np.cos(angle_range) + beta * np.sin(angle_range)
+    maxima = np.where(phase <= angle_range, amplitude, np.maximum(start, stop))
+    minima = np.where(np.mod(phase + np.pi, 2 * np.pi) <= angle_range, -amplitude,
+                      np.minimum(start, stop))
+
+    return minima, maxima
+
+
 def compute_detector_region(x, y, shape, overhead=2):
     """*overhead* specifies how much margin is taken into account around the computed area."""
     def _compute_outlier(extremum_func, values):
-        if extremum_func == min:
+        if extremum_func == np.min:
             round_func = np.floor
             sgn = -1
         else:
@@ -729,10 +2302,10 @@ def compute_detector_region(x, y, shape, overhead=2):
 
         return int(round_func(extremum_func(values)) + sgn * overhead)
 
-    x_min = min(shape[1], max(0, _compute_outlier(min, x)))
-    y_min = min(shape[0], max(0, _compute_outlier(min, y)))
-    x_max = max(0, min(shape[1], _compute_outlier(max, x)))
-    y_max = max(0, min(shape[0], _compute_outlier(max, y)))
+    x_min = min(shape[1], max(0, _compute_outlier(np.min, x)))
+    y_min = min(shape[0], max(0, _compute_outlier(np.min, y)))
+    x_max = max(0, min(shape[1], _compute_outlier(np.max, x)))
+    y_max = max(0, min(shape[0], _compute_outlier(np.max, y)))
 
     return (x_min, x_max, y_min, y_max)
 
@@ -783,3 +2356,54 @@ def rotate_z(angle, point):
     matrix[1, 1] = cos
 
     return np.dot(matrix, point)
+
+
+def get_rotation_matrices(x_angles, y_angles, z_angles, num):
+    """Stack *num* rotation matrices which first rotate around the z, then y and then x axis by
+    *z_angles*, *y_angles* and *x_angles* into an (num, 3, 3) array. Angles may be scalars.
+    """
+    return np.matmul(get_rotation_matrices_x(np.broadcast_to(x_angles, num)),
+                     np.matmul(get_rotation_matrices_y(np.broadcast_to(y_angles, num)),
+                               get_rotation_matrices_z(np.broadcast_to(z_angles, num))))
+
+
+def get_rotation_matrices_x(angles):
+    """Stack rotation matrices around the x axis by *angles* into an (N, 3, 3) array."""
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+
+    matrices = np.tile(np.identity(3), (len(angles), 1, 1))
+    matrices[:, 1, 1] = cos
+    matrices[:, 1, 2] = -sin
+    matrices[:, 2, 1] = sin
+    matrices[:, 2, 2] = cos
+
+    return matrices
+
+
+def get_rotation_matrices_y(angles):
+    """Stack rotation matrices around the y axis by *angles* into an (N, 3, 3) array."""
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+
+    matrices = np.tile(np.identity(3), (len(angles), 1, 1))
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 2] = sin
+    matrices[:, 2, 0] = -sin
+    matrices[:, 2, 2] = cos
+
+    return matrices
+
+
+def get_rotation_matrices_z(angles):
+    """Stack rotation matrices around the z axis by *angles* into an (N, 3, 3) array."""
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+
+    matrices = np.tile(np.identity(3), (len(angles), 1, 1))
+    matrices[:, 0, 0] = cos
+    matrices[:, 0, 1] = -sin
+    matrices[:, 1, 0] = sin
+    matrices[:, 1, 1] = cos
+
+    return matrices
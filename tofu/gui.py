@@ -8,6 +8,7 @@ import pkg_resources
 from argparse import ArgumentParser
 from contextlib import contextmanager
 from tofu import reco, config, util, __version__
+from tofu.axis import estimate_axis
 
 try:
     import tofu.vis.qt
@@ -484,14 +485,16 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             first = (first - dark) / flat
             second = (second - dark) / flat
 
-        self.axis = reco.compute_rotation_axis(first, second)
+        estimate = estimate_axis(first, second)
+        self.axis = estimate.axis
         self.height, self.width = first.shape
 
         w2 = self.width / 2.0
         position = w2 + (w2 - self.axis) * 2.0
         self.overlap_viewer.set_images(first, second)
         self.overlap_viewer.set_position(position)
-        self.ui.img_size.setText('width = {} | height = {}'.format(self.width, self.height))
+        self.ui.img_size.setText('width = {} | height = {} | axis tilt = {:.3f} deg'.format(
+            self.width, self.height, estimate.tilt))
 
     def on_remove_extrema_clicked(self, val):
         self.ui.overlap_viewer.remove_extrema = val
@@ -0,0 +1,220 @@
+"""NumPy phase retrieval with cached Fourier filters.
+
+:func:`retrieve_phase` computes the same as the pad, fft, retrieve-phase, ifft, crop and calculate
+tasks set up by :func:`tofu.preprocess.create_phase_retrieval_pipeline`, so it can be used without
+a GPU and for validating the UFO results. The filters depend only on the :class:`PhaseParameters`
+and the padded shape, they are computed once and cached, which makes repeated retrievals and sweeps
+over e.g. the regularization rate cheap. The projections are transformed by real-to-complex FFTs
+in batches processed by a thread pool.
+"""
+import collections
+import functools
+import logging
+import os
+import numpy as np
+from tofu.cpu import PADDING_MODES
+from tofu.util import next_power_of_two
+
+
+LOG = logging.getLogger(__name__)
+# Same as in ufo-filters
+PLANCK_CONSTANT = 6.62606896e-34
+SPEED_OF_LIGHT = 299792458
+KEV = 1.60217733e-16
+METHODS = ('tie', 'ctf', 'qp', 'qp2')
+PhaseParameters = collections.namedtuple('PhaseParameters',
+                                         ['method', 'energy', 'distance', 'pixel_size',
+                                          'regularization_rate', 'thresholding_rate',
+                                          'frequency_cutoff', 'delta'])
+
+
+def get_phase_parameters(args, **kwargs):
+    """Get :class:`PhaseParameters` from the retrieve-phase options in *args*, *kwargs* override
+    them (e.g. regularization_rate=2.5).
+    """
+    values = {'method': args.retrieval_method, 'energy': args.energy,
+              'distance': args.propagation_distance, 'pixel_size': args.pixel_size,
+              'regularization_rate': args.regularization_rate,
+              'thresholding_rate': args.thresholding_rate,
+              'frequency_cutoff': args.frequency_cutoff, 'delta': args.delta}
+    values.update(kwargs)
+    if values['method'] not in METHODS:
+        raise ValueError("Unknown phase retrieval method `{}'".format(values['method']))
+    if values['energy'] is None or not values['distance']:
+        raise RuntimeError('Phase retrieval needs --energy and --propagation-distance')
+    distance = tuple(float(value) for value in np.atleast_1d(values['distance']))
+    values['distance'] = distance * 2 if len(distance) == 1 else distance[:2]
+
+    return PhaseParameters(**values)
+
+
+def get_wavelength(energy):
+    """Get the wavelength in m of X-rays with *energy* in keV."""
+    return PLANCK_CONSTANT * SPEED_OF_LIGHT / (energy * KEV)
+
+
+def get_padded_shape(shape, padded_shape=None):
+    """Get the padded shape (height, width) for phase retrieval of images with *shape*, dimensions
+    which are not given by *padded_shape* are the next power of two of the size + 64.
+    """
+    padded_height, padded_width = padded_shape or (0, 0)
+
+    return (padded_height or next_power_of_two(shape[0] + 64),
+            padded_width or next_power_of_two(shape[1] + 64))
+
+
+@functools.lru_cache(maxsize=32)
+def get_phase_filter(parameters, padded_shape):
+    """Get the Fourier space filter of :class:`PhaseParameters` *parameters* for the half spectra
+    (height, width // 2 + 1) of real images with *padded_shape* (height, width). The filters are
+    cached and read-only.
+    """
+    height, width = padded_shape
+    prefactor = np.pi * get_wavelength(parameters.energy) / parameters.pixel_size ** 2
+    # Frequencies in the UFO convention, i.e. in periods per pixel
+    frequencies_y = np.fft.fftfreq(height)[:, np.newaxis]
+    frequencies_x = np.fft.rfftfreq(width)[np.newaxis, :]
+    argument = (prefactor * parameters.distance[0] * frequencies_x ** 2 +
+                prefactor * parameters.distance[1] * frequencies_y ** 2)
+    regularization = 10 ** -parameters.regularization_rate
+    if parameters.method == 'tie':
+        result = 0.5 / (argument + regularization)
+    else:
+        sine = np.sin(argument)
+        result = 0.5 * np.sign(sine) / (np.abs(sine) + regularization)
+        if parameters.method != 'ctf':
+            binary = (argument > np.pi / 2) & (np.abs(sine) < parameters.thresholding_rate)
+            if parameters.method == 'qp':
+                result[binary] = 0
+            else:
+                result[binary] = (0.5 * np.sign(sine[binary]) /
+                                  (parameters.thresholding_rate + regularization))
+    result[argument >= parameters.frequency_cutoff] = 0
+    result = result.astype(np.float32)
+    result.flags.writeable = False
+
+    return result
+
+
+def get_thickness_conversion(parameters):
+    """Get the factor which converts phase to projected thickness if parameters.delta is given,
+    1 otherwise.
+    """
+    if parameters.delta is None:
+        return 1
+
+    return -get_wavelength(parameters.energy) / (2 * np.pi * parameters.delta)
+
+
+def get_fft_functions(num_workers=1):
+    """Get real-to-complex (forward, inverse) 2D FFT functions, scipy.fft with *num_workers*
+    threads if it is installed, numpy.fft otherwise.
+    """
+    try:
+        import scipy.fft
+        return (functools.partial(scipy.fft.rfft2, workers=num_workers),
+                functools.partial(scipy.fft.irfft2, workers=num_workers))
+    except ImportError:
+        return np.fft.rfft2, np.fft.irfft2
+
+
+def pad_images(images, padded_shape, padding_mode='clamp_to_edge'):
+    """Pad *images* (number, height, width) to the centered *padded_shape* like the UFO pad task
+    with *padding_mode*. Return the padded images and the (y, x) position of the original ones.
+    """
+    if padding_mode not in PADDING_MODES:
+        raise ValueError("Unknown padding mode `{}'".format(padding_mode))
+    height, width = images.shape[-2:]
+    y = (padded_shape[0] - height) // 2
+    x = (padded_shape[1] - width) // 2
+    pad_width = ((0, 0), (y, padded_shape[0] - height - y), (x, padded_shape[1] - width - x))
+
+    return np.pad(images, pad_width, mode=PADDING_MODES[padding_mode]), (y, x)
+
+
+def get_spectra(images, padded_shape, padding_mode='clamp_to_edge', fft=None):
+    """Get the half spectra of *images* padded to *padded_shape* by *padding_mode*."""
+    forward = fft or get_fft_functions()[0]
+    padded = pad_images(np.asarray(images, dtype=np.float32), padded_shape,
+                        padding_mode=padding_mode)[0]
+
+    return forward(padded)
+
+
+def filter_spectra(spectra, parameters, shape, padded_shape, ifft=None):
+    """Apply the phase retrieval filter given by *parameters* to half *spectra* of images with
+    *shape* padded to *padded_shape*. Return the cropped retrieved images like the calculate task
+    of the UFO pipeline.
+    """
+    inverse = ifft or get_fft_functions()[1]
+    retrieved = inverse(spectra * get_phase_filter(parameters, padded_shape), s=padded_shape)
+    y = (padded_shape[0] - shape[0]) // 2
+    x = (padded_shape[1] - shape[1]) // 2
+    retrieved = retrieved[:, y:y + shape[0], x:x + shape[1]].astype(np.float32)
+    conversion = get_thickness_conversion(parameters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if parameters.method == 'tie':
+            # The filter is 0.5 * 10^R at zero frequency, undo it to get the intensity and convert
+            # its logarithm to phase
+            rate = 10 ** parameters.regularization_rate
+            invalid = ~np.isfinite(retrieved) | (retrieved <= 0)
+            retrieved = np.log(2 / rate * retrieved) * np.float32(conversion * rate / 2)
+        else:
+            invalid = ~np.isfinite(retrieved)
+            retrieved *= np.float32(conversion)
+    retrieved[invalid] = 0
+
+    return retrieved
+
+
+def map_batches(func, images, batch_size=None, num_workers=None):
+    """Apply *func* to batches of *batch_size* *images* by *num_workers* threads (number of CPUs by
+    default) and return the concatenated results. Batches are split so that every thread gets
+    work if *batch_size* is not specified.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    batch_size = batch_size or max(1, -(-len(images) // num_workers))
+    batches = [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+    if num_workers == 1 or len(batches) == 1:
+        return np.concatenate([func(batch) for batch in batches])
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return np.concatenate(list(executor.map(func, batches)))
+
+
+def retrieve_phase(images, parameters, padded_shape=None, padding_mode='clamp_to_edge',
+                   batch_size=None, num_workers=None):
+    """Retrieve phase from flat corrected *images* (number, height, width) or one image with
+    :class:`PhaseParameters` *parameters*. The images are padded to *padded_shape* (see
+    :func:`get_padded_shape`) by *padding_mode* and processed in batches of *batch_size* by
+    *num_workers* threads.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    single = images.ndim == 2
+    if single:
+        images = images[np.newaxis]
+    shape = images.shape[-2:]
+    padded_shape = get_padded_shape(shape, padded_shape)
+    fft, ifft = get_fft_functions()
+    LOG.debug('Phase retrieval of %d images: %dx%d -> %dx%d', len(images), shape[1], shape[0],
+              padded_shape[1], padded_shape[0])
+
+    def process(batch):
+        spectra = get_spectra(batch, padded_shape, padding_mode=padding_mode, fft=fft)
+        return filter_spectra(spectra, parameters, shape, padded_shape, ifft=ifft)
+
+    result = map_batches(process, images, batch_size=batch_size, num_workers=num_workers)
+
+    return result[0] if single else result
+
+
+def retrieve_phase_from_args(images, args, **kwargs):
+    """Retrieve phase from *images* with the retrieve-phase options in *args*, *kwargs* are passed
+    to :func:`retrieve_phase`.
+    """
+    padded_shape = (args.retrieval_padded_height, args.retrieval_padded_width)
+
+    return retrieve_phase(images, get_phase_parameters(args), padded_shape=padded_shape,
+                          padding_mode=args.retrieval_padding_mode, **kwargs)
@@ -1,28 +1,111 @@
 """Flat field correction."""
+import hashlib
+import json
+import os
 import sys
 import logging
+from threading import Lock
 from gi.repository import Ufo
 from tofu.util import (get_filenames, set_node_props, make_subargs,
                        determine_shape, setup_read_task,
-                       setup_padding, next_power_of_two, run_scheduler)
-from tofu.tasks import get_task, get_writer
+                       setup_padding, next_power_of_two, run_scheduler, reduce_images)
+from tofu.sinos import can_transpose, generate_sinograms
+from tofu.tasks import get_scheduler, get_task, get_writer
+from tofu.volume import is_volume_output
 
 
 LOG = logging.getLogger(__name__)
+# Maximum number of bytes of the stacked rows reduced at once
+FLAT_CACHE_SLAB_SIZE = 2 ** 28
+# Graphs of different device threads are created concurrently, reduce every data set only once
+_FLAT_CACHE_LOCK = Lock()
 
 
-def create_flat_correct_pipeline(args, graph, processing_node=None):
+def get_flat_cache_dir(args):
+    """Get the directory with cached reduced darks and flats or None if caching is disabled, which
+    is the default unless a cache directory is specified.
+    """
+    return args.flat_cache_dir or None
+
+
+def get_reduced_image(path, mode, cache_dir, max_size=None):
+    """Get the file name of the image in *cache_dir* with full images from *path* reduced by
+    *mode*, the region of interest is selected when the file is read, so that all regions of
+    interest share one entry. The cache entry is keyed by the file names, their modification times
+    and sizes and the reduction mode and it is created if it does not exist. If *max_size* is
+    given, the least recently used entries are removed until the cache is not larger. Return None
+    if the images cannot be reduced outside of UFO.
+    """
+    filenames = get_filenames(path)
+    if not filenames or not all(os.path.splitext(filename)[1].lower() in ('.tif', '.tiff', '.edf')
+                                for filename in filenames):
+        return None
+
+    key = {'files': [(os.path.abspath(filename), os.path.getmtime(filename),
+                      os.path.getsize(filename)) for filename in filenames],
+           'mode': mode}
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    cached = os.path.join(cache_dir, '{}-{}.tif'.format(digest, mode))
+
+    with _FLAT_CACHE_LOCK:
+        if not os.path.exists(cached):
+            import tifffile
+            LOG.debug("Reducing %d images from `%s' to `%s'", len(filenames), path, cached)
+            reduced = reduce_images(filenames, mode, slab_size=FLAT_CACHE_SLAB_SIZE)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_name = cached + '.tmp.tif'
+            tifffile.imwrite(tmp_name, reduced)
+            os.replace(tmp_name, cached)
+        else:
+            LOG.debug("Using cached reduced images from `%s'", cached)
+            # Mark the entry as recently used
+            os.utime(cached)
+        if max_size is not None:
+            prune_flat_cache(cache_dir, max_size, keep=cached)
+
+    return cached
+
+
+def prune_flat_cache(cache_dir, max_size, keep=None):
+    """Remove the least recently used reduced images from *cache_dir* until they take at most
+    *max_size* bytes, *keep* is never removed. Return the removed file names.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        filename = os.path.join(cache_dir, name)
+        if name.endswith('.tif') and not name.endswith('.tmp.tif') and os.path.isfile(filename):
+            stat = os.stat(filename)
+            entries.append((stat.st_mtime, stat.st_size, filename))
+    total = sum(size for (mtime, size, filename) in entries)
+    removed = []
+    for mtime, size, filename in sorted(entries):
+        if total <= max_size:
+            break
+        if filename != keep:
+            LOG.debug("Removing `%s' from the flat cache", filename)
+            os.remove(filename)
+            removed.append(filename)
+            total -= size
+
+    return removed
+
+
+def create_flat_correct_pipeline(args, graph, processing_node=None, reader=None):
     """
     Create flat field correction pipeline. All the settings are provided in
-    *args*. *graph* is used for making the connections. Returns the flat field
+    *args*. *graph* is used for making the connections. If *reader* is given, it
+    provides the projections instead of a new read task. Returns the flat field
     correction task which can be used for further pipelining.
     """
-    pm = Ufo.PluginManager()
 
     if args.projections is None or args.flats is None or args.darks is None:
         raise RuntimeError("You must specify --projections, --flats and --darks.")
 
-    reader = get_task('read')
+    if reader is None:
+        reader = get_task('read')
+        set_node_props(reader, args)
+        setup_read_task(reader, args.projections, args)
     dark_reader = get_task('read')
     flat_before_reader = get_task('read')
 
@@ -33,15 +116,23 @@ def create_flat_correct_pipeline(args, graph, processing_node=None):
                    fix_nan_and_inf=args.fix_nan_and_inf)
     mode = args.reduction_mode.lower()
     roi_args = make_subargs(args, ['y', 'height', 'y_step'])
-    set_node_props(reader, args)
     set_node_props(dark_reader, roi_args)
     set_node_props(flat_before_reader, roi_args)
 
-    for r, path in ((reader, args.projections), (dark_reader, args.darks), (flat_before_reader, args.flats)):
+    for r, path in ((dark_reader, args.darks), (flat_before_reader, args.flats)):
         setup_read_task(r, path, args)
 
     LOG.debug("Doing flat field correction using reduction mode `{}'".format(mode))
 
+    cache_dir = get_flat_cache_dir(args)
+    if cache_dir and not args.resize and mode in ('median', 'average'):
+        paths = [args.darks, args.flats] + ([args.flats2] if args.flats2 else [])
+        cached = [get_reduced_image(path, mode, cache_dir, max_size=args.flat_cache_size)
+                  for path in paths]
+        if all(cached):
+            return _connect_flat_correct(args, graph, reader, ffc, *cached,
+                                         processing_node=processing_node)
+
     if args.flats2:
         flat_after_reader = get_task('read')
         setup_read_task(flat_after_reader, args.flats2, args)
@@ -113,9 +204,38 @@ def create_flat_correct_pipeline(args, graph, processing_node=None):
     return ffc
 
 
+def _connect_flat_correct(args, graph, reader, ffc, dark, flat, flat_after=None,
+                          processing_node=None):
+    """Connect projections from *reader* and cached reduced *dark*, *flat* and optionally
+    *flat_after* image files to the flat field correction task *ffc*.
+    """
+    readers = []
+    roi_args = make_subargs(args, ['y', 'height', 'y_step'])
+    for filename in (dark, flat, flat_after):
+        if filename:
+            readers.append(get_task('read', path=filename))
+            # Cached images are full frames
+            set_node_props(readers[-1], roi_args)
+
+    graph.connect_nodes_full(reader, ffc, 0)
+    graph.connect_nodes_full(readers[0], ffc, 1)
+    if flat_after:
+        num_files = len(get_filenames(args.projections))
+        can_read = len(list(range(args.start, num_files, args.step)))
+        number = args.number if args.number else num_files
+        flat_interpolate = get_task('interpolate', processing_node=processing_node,
+                                    number=min(can_read, number))
+        graph.connect_nodes_full(readers[1], flat_interpolate, 0)
+        graph.connect_nodes_full(readers[2], flat_interpolate, 1)
+        graph.connect_nodes_full(flat_interpolate, ffc, 2)
+    else:
+        graph.connect_nodes_full(readers[1], ffc, 2)
+
+    return ffc
+
+
 def create_phase_retrieval_pipeline(args, graph, processing_node=None):
     LOG.debug('Creating phase retrieval pipeline')
-    pm = Ufo.PluginManager()
     # Retrieve phase
     phase_retrieve = get_task('retrieve-phase', processing_node=processing_node)
     pad_phase_retrieve = get_task('pad', processing_node=processing_node)
@@ -192,8 +312,7 @@ def create_phase_retrieval_pipeline(args, graph, processing_node=None):
 
 def run_flat_correct(args):
     graph = Ufo.TaskGraph()
-    sched = Ufo.Scheduler()
-    pm = Ufo.PluginManager()
+    sched = get_scheduler()
 
     out_task = get_writer(args)
     flat_task = create_flat_correct_pipeline(args, graph)
@@ -203,8 +322,7 @@ def run_flat_correct(args):
 
 def create_sinogram_pipeline(args, graph):
     """Create sinogram generating pipeline based on arguments from *args*."""
-    pm = Ufo.PluginManager()
-    sinos = pm.get_task('transpose-projections')
+    sinos = get_task('transpose-projections')
 
     if args.number:
         region = (args.start, args.start + args.number, args.step)
@@ -227,7 +345,14 @@ def create_sinogram_pipeline(args, graph):
 
 
 def run_sinogram_generation(args):
-    """Make the sinograms with arguments provided by *args*."""
+    """Make the sinograms with arguments provided by *args*. TIFF and EDF projections are read only
+    once by :func:`tofu.sinos.generate_sinograms`, other formats by UFO once per pass.
+    """
+    if can_transpose(args):
+        return generate_sinograms(args)
+    if is_volume_output(args.output):
+        raise RuntimeError('Volume output of sinograms requires TIFF or EDF projections')
+
     if not args.height:
         args.height = determine_shape(args, args.projections)[1] - args.y
 
@@ -236,7 +361,7 @@ def run_sinogram_generation(args):
 
     def generate_partial(append=False):
         graph = Ufo.TaskGraph()
-        sched = Ufo.Scheduler()
+        sched = get_scheduler()
 
         args.output_append = append
         writer = get_writer(args)
@@ -255,7 +380,6 @@ def run_sinogram_generation(args):
 
 
 def create_projection_filtering_pipeline(args, graph, processing_node=None):
-    pm = Ufo.PluginManager()
     pad = get_task('pad', processing_node=processing_node)
     fft = get_task('fft', processing_node=processing_node)
     ifft = get_task('ifft', processing_node=processing_node)
@@ -286,9 +410,10 @@ def create_projection_filtering_pipeline(args, graph, processing_node=None):
 
 
 def create_preprocessing_pipeline(args, graph, source=None, processing_node=None,
-                                  cone_beam_weight=True, make_reader=True):
+                                  cone_beam_weight=True, make_reader=True, reader=None):
     """If *make_reader* is True, create a read task if *source* is None and no dark and flat fields
-    are given.
+    are given. If *reader* is specified, it provides the projections instead of a read task and
+    they are flat-field corrected if dark and flat fields are given.
     """
     import numpy as np
     if not (args.width and args.height):
@@ -306,9 +431,12 @@ def create_preprocessing_pipeline(args, graph, source=None, processing_node=None
     if source:
         current = source
     elif args.darks and args.flats:
-        current = create_flat_correct_pipeline(args, graph, processing_node=processing_node)
+        current = create_flat_correct_pipeline(args, graph, processing_node=processing_node,
+                                               reader=reader)
     else:
-        if make_reader:
+        if reader:
+            current = reader
+        elif make_reader:
             current = get_task('read')
             set_node_props(current, args)
             if not args.projections:
@@ -362,8 +490,7 @@ def create_preprocessing_pipeline(args, graph, source=None, processing_node=None
 
 def run_preprocessing(args):
     graph = Ufo.TaskGraph()
-    sched = Ufo.Scheduler()
-    pm = Ufo.PluginManager()
+    sched = get_scheduler()
 
     out_task = get_writer(args)
     current = create_preprocessing_pipeline(args, graph)
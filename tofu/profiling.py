@@ -0,0 +1,152 @@
+"""Timing and throughput instrumentation of reconstructions.
+
+A :class:`Profiler` collects timed spans (wall time per executor and region, geometry
+optimization, waiting for UFO output buffers, writing) and counters (e.g. read bytes) from all
+threads of a run and writes them into one file in the Chrome trace event format, which can be
+viewed in chrome://tracing or Perfetto. The file contains also a *summary* with aggregated values,
+so that it can be processed as plain JSON. UFO traces written by the schedulers when tracing is
+enabled are merged into the same file.
+"""
+import glob
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock, current_thread
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Profiler(object):
+    """Collect spans and counters of one run and write them to *filename*."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.events = []
+        self.counters = {}
+        self.start = time.perf_counter()
+        self._ufo_files = {}
+        self._lock = Lock()
+
+    def now(self):
+        """Microseconds since the start of the profiler."""
+        return (time.perf_counter() - self.start) * 1e6
+
+    def add(self, name, start, duration, category='tofu', thread=None, **args):
+        """Add span *name* starting at *start* lasting *duration*, both in seconds relative to the
+        start of the profiler, to *thread* (name of the current thread by default). *args* are
+        stored with the span.
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': 0,
+                 'tid': thread or current_thread().name,
+                 'ts': start * 1e6, 'dur': duration * 1e6, 'args': args}
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category='tofu', thread=None, **args):
+        """Time the enclosed block as span *name*, see :meth:`add`."""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self.add(name, start - self.start, end - start, category=category, thread=thread,
+                     **args)
+
+    def count(self, name, value):
+        """Add *value* to counter *name*."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge_ufo_traces(self, label, since, directory='.'):
+        """Merge traces written by UFO schedulers of this process into *directory* after *since*
+        (a time.time() value) as process *label*. Files which have already been merged and not
+        rewritten since are skipped.
+        """
+        for filename in glob.glob(os.path.join(directory, '*.{}.json'.format(os.getpid()))):
+            try:
+                mtime = os.path.getmtime(filename)
+            except OSError:
+                continue
+            with self._lock:
+                if mtime < since or self._ufo_files.get(filename) == mtime:
+                    continue
+                self._ufo_files[filename] = mtime
+            try:
+                with open(filename) as f:
+                    trace = json.load(f)
+            except (OSError, ValueError) as error:
+                LOG.warning("Cannot merge UFO trace `%s': %s", filename, error)
+                continue
+            events = trace.get('traceEvents', []) if isinstance(trace, dict) else trace
+            prefix = os.path.basename(filename).split('.')[0]
+            for event in events:
+                event = dict(event)
+                event['pid'] = '{} {}'.format(label, prefix)
+                with self._lock:
+                    self.events.append(event)
+
+    def get_summary(self):
+        """Aggregate the spans and counters. Wall time is summed up per span name and listed per
+        executor and region. Read throughput is the number of read bytes divided by the time in
+        which at least one projection was being read, GPU busy fraction is the portion of the run
+        in which at least one graph was running on a GPU.
+        """
+        wall = self.now() / 1e6
+        spans = {}
+        regions = []
+        reads = []
+        busy = {}
+        with self._lock:
+            events = [event for event in self.events if event.get('pid') == 0]
+            counters = dict(self.counters)
+        for event in events:
+            start = event['ts'] / 1e6
+            duration = event['dur'] / 1e6
+            spans[event['name']] = spans.get(event['name'], 0) + duration
+            if event['name'] == 'executor':
+                regions.append(dict(event['args'], thread=event['tid'], wall=duration))
+            elif event['name'] == 'read':
+                reads.append((start, start + duration))
+            elif event['name'] == 'graph' and 'gpu' in event['args']:
+                busy.setdefault(event['args']['gpu'], []).append((start, start + duration))
+        summary = {'wall': wall, 'spans': spans, 'counters': counters, 'regions': regions}
+        if reads and counters.get('read-bytes'):
+            summary['read_bytes_per_second'] = counters['read-bytes'] / get_union_length(reads)
+        if wall:
+            summary['gpu_busy_fraction'] = {str(gpu): get_union_length(intervals) / wall
+                                            for gpu, intervals in busy.items()}
+
+        return summary
+
+    def write(self):
+        summary = self.get_summary()
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with self._lock:
+            trace = {'traceEvents': self.events, 'displayTimeUnit': 'ms', 'summary': summary}
+            with open(self.filename, 'w') as f:
+                json.dump(trace, f, default=str)
+        LOG.info("Profile written to `%s'", self.filename)
+
+        return summary
+
+
+def get_union_length(intervals):
+    """Get the total length covered by *intervals*, a list of (start, end) tuples."""
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+
+    return total
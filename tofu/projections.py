@@ -0,0 +1,177 @@
+"""Projection sources which memory-map uncompressed TIFF pages.
+
+Pages of TIFF and BigTIFF files which are stored uncompressed in one contiguous block are not
+decoded, they are NumPy views of a read-only memory map of the file. Selecting rows of such a view
+touches only the bytes of these rows, so that e.g. extracting one row from every projection reads
+only a few pages of every file. Other pages (compressed, tiled, ...) and EDF files are decoded on
+every access. Every memory map keeps its file open, so only a limited number of the most recently
+used files stay mapped.
+"""
+import collections
+import logging
+import os
+import numpy as np
+from tofu.util import get_filenames, get_image_shape, read_image
+
+
+LOG = logging.getLogger(__name__)
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+# Maximum number of memory-mapped files of a projection source, i.e. of its open file descriptors
+MAX_MAPPED_FILES = 128
+
+
+def get_image_list(path, start=0, number=None, step=1):
+    """Get (file name, page index) tuples of the images in *path*, every page of a multi-page file
+    is one image (page index is None for single images). Take every *step*-th image from *start*,
+    at most *number* of them.
+    """
+    images = []
+    for filename in get_filenames(path):
+        shape = get_image_shape(filename)
+        if len(shape) == 3:
+            images.extend((filename, page) for page in range(shape[0]))
+        else:
+            images.append((filename, None))
+    images = images[start::step]
+
+    return images[:number] if number else images
+
+
+class MappedTiffFile(object):
+    """Pages of TIFF or BigTIFF *filename*. The layout of all pages is read once when the file is
+    opened, the file is memory-mapped on the first access of a page which can be mapped. Instances
+    can be pickled, the memory map is re-created in the unpickled copy when it is needed.
+    """
+    def __init__(self, filename):
+        import tifffile
+
+        self.filename = filename
+        self.pages = []
+        with tifffile.TiffFile(filename) as tif:
+            for page in tif.pages:
+                layout = None
+                if page.is_memmappable and page.samplesperpixel == 1 and len(page.shape) == 2:
+                    dtype = np.dtype(page.dtype).newbyteorder(tif.byteorder)
+                    layout = (page.dataoffsets[0], page.shape, dtype)
+                self.pages.append(layout)
+        self._map = None
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_map'] = None
+
+        return state
+
+    def is_mapped(self, index):
+        """Can page *index* be returned without decoding?"""
+        return self.pages[index] is not None
+
+    def get(self, index, rows=None):
+        """Get page *index*, only *rows* (a slice or indices) of it if specified. Mapped pages are
+        read-only views of the file.
+        """
+        layout = self.pages[index]
+        if layout is None:
+            import tifffile
+            with tifffile.TiffFile(self.filename) as tif:
+                image = tif.pages[index].asarray()
+        else:
+            if self._map is None:
+                self._map = np.memmap(self.filename, dtype=np.uint8, mode='r')
+            offset, shape, dtype = layout
+            image = np.ndarray(shape, dtype=dtype, buffer=self._map, offset=offset)
+
+        return image if rows is None else image[rows]
+
+    def close(self):
+        """Drop the memory map, views which were already returned remain valid."""
+        self._map = None
+
+
+class ProjectionSource(object):
+    """Projections given by *frames*, a list of (file name, page index) tuples (the page index is
+    None for single-image files) as returned by :func:`get_image_list`. TIFF files are opened as
+    :class:`MappedTiffFile` when they are accessed for the first time, other formats are read by
+    :func:`tofu.util.read_image`. At most *max_mapped_files* files are memory-mapped at once, the
+    maps of the least recently used ones are closed.
+    """
+    def __init__(self, frames, max_mapped_files=MAX_MAPPED_FILES):
+        self.frames = frames
+        self.max_mapped_files = max_mapped_files
+        self._files = {}
+        self._mapped = collections.OrderedDict()
+
+    @classmethod
+    def from_path(cls, path, start=0, number=None, step=1, **kwargs):
+        """Create a source of the images in *path* selected like in :func:`get_image_list`,
+        *kwargs* are passed to the constructor.
+        """
+        return cls(get_image_list(path, start=start, number=number, step=step), **kwargs)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, key):
+        """Get source[index] or source[index, rows]."""
+        if isinstance(key, tuple):
+            return self.get(*key)
+
+        return self.get(key)
+
+    @property
+    def shape(self):
+        """Shape (height, width) of the first projection."""
+        return tuple(get_image_shape(self.frames[0][0])[-2:])
+
+    def _open(self, filename):
+        if filename not in self._files:
+            if os.path.splitext(filename)[1].lower() in TIFF_EXTENSIONS:
+                self._files[filename] = MappedTiffFile(filename)
+            else:
+                self._files[filename] = None
+
+        return self._files[filename]
+
+    def is_mapped(self, index):
+        """Is projection *index* memory-mapped?"""
+        filename, page = self.frames[index]
+        mapped = self._open(filename)
+
+        return mapped is not None and mapped.is_mapped(page or 0)
+
+    def get(self, index, rows=None):
+        """Get projection *index*, only its *rows* (a slice or indices) if specified. Memory-mapped
+        projections are returned as read-only views without copying, so convert them if you need
+        a different dtype or want to modify them.
+        """
+        filename, page = self.frames[index]
+        mapped = self._open(filename)
+        if mapped is not None:
+            if mapped.is_mapped(page or 0):
+                self._use_map(filename)
+            return mapped.get(page or 0, rows=rows)
+        image = read_image(filename)
+        if page is not None:
+            image = image[page]
+
+        return image if rows is None else image[rows]
+
+    def _use_map(self, filename):
+        """Mark the memory map of *filename* as the most recently used one and close the least
+        recently used maps beyond the limit.
+        """
+        self._mapped[filename] = True
+        self._mapped.move_to_end(filename)
+        while len(self._mapped) > self.max_mapped_files:
+            evicted, _ = self._mapped.popitem(last=False)
+            self._files[evicted].close()
+
+    def close(self):
+        for mapped in self._files.values():
+            if mapped is not None:
+                mapped.close()
+        self._files = {}
+        self._mapped.clear()
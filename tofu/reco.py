@@ -1,18 +1,20 @@
 import os
 import logging
 import glob
-import tempfile
 import sys
 import numpy as np
+from threading import Event, Thread
 from gi.repository import Ufo
+from tofu.axis import estimate_axis
 from tofu.preprocess import create_flat_correct_pipeline
-from tofu.util import (set_node_props, setup_read_task, get_filenames,
+from tofu.util import (set_node_props, setup_read_task, get_filenames, get_image_shape,
                        read_image, determine_shape, setup_padding, run_scheduler)
-from tofu.tasks import get_task, get_writer
+from tofu.tasks import PLUGIN_MANAGER, get_scheduler, get_task, get_writer
+from tofu.volume import get_volume_writer, is_volume_output
 
 
 LOG = logging.getLogger(__name__)
-pm = Ufo.PluginManager()
+pm = PLUGIN_MANAGER
 
 
 def get_dummy_reader(params):
@@ -46,6 +48,18 @@ def get_sinogram_reader(params):
 
 
 def tomo(params):
+    if getattr(params, 'backend', 'ufo') == 'numpy':
+        from tofu.cpu import tomo as cpu_tomo
+        return cpu_tomo(params)
+
+    if params.method in ('sart', 'sirt') and (params.num_subsets or params.warm_start or
+                                              params.stopping_tolerance):
+        # The ir plugins know neither ordered subsets, nor warm start, nor early stopping
+        from tofu.cpu import tomo as cpu_tomo
+        LOG.info('Ordered subsets, warm start and early stopping are implemented only by the '
+                 'numpy backend, using it')
+        return cpu_tomo(params)
+
     # Create reader and writer
     if params.projections and params.sinograms:
         raise RuntimeError("Cannot specify both --projections and --sinograms.")
@@ -58,6 +72,13 @@ def tomo(params):
         else:
             reader, width, height = get_sinogram_reader(params)
 
+    num_slices = None
+    if is_volume_output(params.output) and not params.dry_run:
+        if params.output_bitdepth != 32:
+            raise RuntimeError('Volume output is stored as 32-bit floats, --output-bitdepth {} '
+                               'is not supported'.format(params.output_bitdepth))
+        num_slices = get_num_sinograms(params, height)
+
     axis = params.axis or width / 2.0
 
     if params.projections and params.resize:
@@ -67,7 +88,10 @@ def tomo(params):
 
     LOG.debug("Input dimensions: {}x{} pixels".format(width, height))
 
-    writer = get_writer(params)
+    if num_slices is None:
+        writer = get_writer(params)
+    else:
+        writer = Ufo.OutputTask()
 
     # Setup graph depending on the chosen method and input data
     g = Ufo.TaskGraph()
@@ -153,7 +177,7 @@ def tomo(params):
         projector.set_properties(model='joseph', is_forward=False)
 
         projector.set_properties(axis_position=axis)
-        projector.set_properties(step=params.angle if params.angle else np.pi / 180.0)
+        projector.set_properties(step=params.angle if params.angle else np.pi / height)
 
         method = pm.get_task_from_package('ir', params.method)
         method.set_properties(projector=projector, num_iterations=params.num_iterations)
@@ -201,20 +225,130 @@ def tomo(params):
         else:
             g.connect_nodes(swap_backward, writer)
 
-    scheduler = Ufo.Scheduler()
+    scheduler = get_scheduler()
 
     if hasattr(scheduler.props, 'enable_tracing'):
         LOG.debug("Use tracing: {}".format(params.enable_tracing))
         scheduler.props.enable_tracing = params.enable_tracing
 
-    if not run_scheduler(scheduler, g):
-        return
+    if num_slices is None:
+        if not run_scheduler(scheduler, g):
+            return
+    else:
+        attrs = {'method': params.method, 'axis': axis}
+        if params.angle:
+            attrs['angle'] = params.angle
+        if not run_with_volume_output(scheduler, g, writer, params, num_slices, attrs=attrs):
+            return
     duration = scheduler.props.time
     LOG.info("Execution time: {} s".format(duration))
 
     return duration
 
 
+def get_num_sinograms(params, height):
+    """Get the number of sinograms which are reconstructed by :func:`tomo` from *params*, *height*
+    is the input height.
+    """
+    if params.projections is None and params.sinograms is None:
+        return params.number or 1
+
+    if params.projections:
+        num_rows = params.height or height - params.y
+        num_sinograms = len(range(0, num_rows, params.y_step))
+        if params.resize:
+            num_sinograms //= params.resize
+
+        return num_sinograms
+
+    shape = get_image_shape(get_filenames(params.sinograms)[0])
+    num_pages = shape[0] if len(shape) == 3 else 1
+    num_images = len(get_filenames(params.sinograms)) * num_pages
+    num_sinograms = len(range(params.start, num_images, params.step))
+    if params.number:
+        num_sinograms = min(num_sinograms, params.number)
+
+    return num_sinograms
+
+
+def run_with_volume_output(scheduler, graph, output, params, num_slices, attrs=None, timeout=60):
+    """Run *graph* by *scheduler* and write the slices from Ufo.OutputTask *output* to a chunked
+    volume of *num_slices* slices given by params.output. Return False if the processing has been
+    interrupted. Exactly *num_slices* slices are read, extra ones are released and ignored. When
+    the scheduler is done, everything it produced is queued, so if the queued slices are not
+    written within *timeout* seconds, there are fewer than *num_slices* of them, the volume is
+    aborted and RuntimeError is raised.
+    """
+    import ufo.numpy
+
+    state = {'count': 0, 'error': None, 'volume': None, 'region': None}
+    written = Event()
+
+    def read():
+        try:
+            for i in range(num_slices):
+                buf = output.get_output_buffer()
+                data = ufo.numpy.asarray(buf)
+                if state['volume'] is None:
+                    # Slice shape is known only after the first reconstruction
+                    state['volume'] = get_volume_writer(params.output, (num_slices,) + data.shape,
+                                                        np.float32,
+                                                        chunk_slices=params.output_chunk_slices,
+                                                        compression=params.output_compression,
+                                                        attrs=attrs)
+                    state['region'] = state['volume'].region(0)
+                state['region'].save(data)
+                output.release_output_buffer(buf)
+                state['count'] += 1
+        except Exception as error:
+            state['error'] = error
+            scheduler.abort()
+            return
+        finally:
+            written.set()
+
+        # Keep releasing extra buffers, so that the graph can finish
+        num_extra = 0
+        while True:
+            buf = output.get_output_buffer()
+            if not num_extra:
+                LOG.warning('Reconstruction produced more than %d slices, ignoring the rest',
+                            num_slices)
+            num_extra += 1
+            output.release_output_buffer(buf)
+
+    reader = Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    thread = Thread(target=scheduler.run, args=(graph,))
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while thread.is_alive():
+            thread.join(1)
+        if not written.wait(timeout):
+            raise RuntimeError('Expected {} slices but the reconstruction produced {}'
+                               .format(num_slices, state['count']))
+        if state['error'] is not None:
+            raise state['error']
+        state['region'].close()
+        return True
+    except KeyboardInterrupt:
+        LOG.info('Processing interrupted')
+        scheduler.abort()
+        if state['volume']:
+            state['volume'].abort()
+        return False
+    except Exception:
+        if state['volume']:
+            state['volume'].abort()
+        raise
+    finally:
+        if state['volume']:
+            state['volume'].close()
+
+
 def estimate_center(params):
     if params.estimate_method == 'reconstruction':
         axis = estimate_center_by_reconstruction(params)
@@ -225,6 +359,10 @@ def estimate_center(params):
 
 
 def estimate_center_by_reconstruction(params):
+    """Estimate the center of rotation by reconstructing one sinogram for a batch of axis
+    candidates at once and choosing the one with the lowest integral absolute value. The candidates
+    are refined around the best one in params.num_iterations iterations.
+    """
     if params.projections is not None:
         raise RuntimeError("Cannot estimate axis from projections")
 
@@ -235,54 +373,99 @@ def estimate_center_by_reconstruction(params):
 
     # Use a sinogram that probably has some interesting data
     filename = sinos[len(sinos) // 2]
-    sinogram = read_image(filename)
+    sinogram = read_image(filename).astype(np.float32)
     initial_width = sinogram.shape[1]
     m0 = np.mean(np.sum(sinogram, axis=1))
 
     center = initial_width / 2.0
     width = initial_width / 2.0
-    new_center = center
-    tmp_dir = tempfile.mkdtemp()
-    tmp_output = os.path.join(tmp_dir, 'slice-0.tif')
-
-    params.sinograms = filename
-    params.output = os.path.join(tmp_dir, 'slice-%i.tif')
-
-    def heaviside(A):
-        return (A >= 0.0) * 1.0
-
-    def get_score(guess, m0):
-        # Run reconstruction with new guess
-        params.axis = guess
-        tomo(params)
-
-        # Analyse reconstructed slice
-        result = read_image(tmp_output)
-        Q_IA = float(np.sum(np.abs(result)) / m0)
-        Q_IN = float(-np.sum(result * heaviside(-result)) / m0)
-        LOG.info("Q_IA={}, Q_IN={}".format(Q_IA, Q_IN))
-        return Q_IA
-
-    def best_center(center, width):
-        trials = [center + (width / 4.0) * x for x in range(-2, 3)]
-        scores = [(guess, get_score(guess, m0)) for guess in trials]
-        LOG.info(scores)
-        best = sorted(scores, cmp=lambda x, y: cmp(x[1], y[1]))
-        return best[0][0]
 
     for i in range(params.num_iterations):
         LOG.info("Estimate iteration: {}".format(i))
-        new_center = best_center(new_center, width)
-        LOG.info("Currently best center: {}".format(new_center))
+        trials = center + (width / 4.0) * np.arange(-2, 3)
+        slices = reconstruct_axis_candidates(sinogram, trials, params)
+        scores = [get_reconstruction_score(result, m0) for result in slices]
+        LOG.info(list(zip(trials.tolist(), scores)))
+        center = float(trials[np.argmin(scores)])
+        LOG.info("Currently best center: {}".format(center))
         width /= 2.0
 
+    return center
+
+
+def get_reconstruction_score(result, m0):
+    """Get the integral absolute value of slice *result* normalized by the mean projection
+    integral *m0*.
+    """
+    q_ia = float(np.sum(np.abs(result)) / m0)
+    q_in = float(-np.sum(result * (result < 0)) / m0)
+    LOG.debug("Q_IA={}, Q_IN={}".format(q_ia, q_in))
+
+    return q_ia
+
+
+def reconstruct_axis_candidates(sinogram, centers, params):
+    """Reconstruct *sinogram* for all equally spaced rotation axis positions *centers* in one UFO
+    graph by general-backproject with the center position as the z parameter. Fall back to NumPy
+    if ufo-python-tools are not installed. Return an array (centers, width, width).
+    """
     try:
-        os.remove(tmp_output)
-        os.removedirs(tmp_dir)
-    except OSError:
-        LOG.info("Could not remove {} or {}".format(tmp_output, tmp_dir))
+        import ufo.numpy
+    except ImportError:
+        LOG.debug('ufo-python-tools not installed, reconstructing axis candidates by NumPy')
+        from tofu.cpu import reconstruct_centers
+        return reconstruct_centers(sinogram, centers, angle_step=params.angle)
+
+    num_projections, width = sinogram.shape
+    step = centers[1] - centers[0] if len(centers) > 1 else 1
+    angle_step = params.angle or np.pi / num_projections
+    graph = Ufo.TaskGraph()
+    scheduler = get_scheduler()
+    source = Ufo.InputTask()
+    output = Ufo.OutputTask()
+    fft = get_task('fft', dimensions=1)
+    fltr = get_task('filter', filter=params.projection_filter,
+                    cutoff=params.projection_filter_cutoff)
+    ifft = get_task('ifft', dimensions=1, crop_width=width)
+    backproject = get_task('general-backproject')
+    backproject.props.parameter = 'center-position-x'
+    backproject.props.region = [float(centers[0]), float(centers[-1] + step / 2), float(step)]
+    backproject.props.x_region = [-(width // 2), width - width // 2, 1]
+    backproject.props.y_region = [-(width // 2), width - width // 2, 1]
+    backproject.props.center_position_x = [float(centers[0])]
+    # Pixel center of the only row, no interpolation between rows
+    backproject.props.center_position_z = [0.5]
+    backproject.props.num_projections = num_projections
+    backproject.props.overall_angle = angle_step * num_projections
+    graph.connect_nodes(source, fft)
+    graph.connect_nodes(fft, fltr)
+    graph.connect_nodes(fltr, ifft)
+    graph.connect_nodes(ifft, backproject)
+    graph.connect_nodes(backproject, output)
+
+    thread = Thread(target=scheduler.run, args=(graph,))
+    thread.daemon = True
+    thread.start()
+
+    buf = None
+    for row in sinogram:
+        projection = np.ascontiguousarray(row[np.newaxis])
+        if buf is None:
+            buf = ufo.numpy.fromarray(projection)
+        else:
+            buf = source.get_input_buffer()
+            ufo.numpy.fromarray_inplace(buf, projection)
+        source.release_input_buffer(buf)
+    source.stop()
+
+    result = np.empty((len(centers), width, width), dtype=np.float32)
+    for i in range(len(centers)):
+        buf = output.get_output_buffer()
+        result[i] = ufo.numpy.asarray(buf)
+        output.release_output_buffer(buf)
+    thread.join()
 
-    return new_center
+    return result
 
 
 def estimate_center_by_correlation(params):
@@ -318,18 +501,10 @@ def compute_rotation_axis(first_projection, last_projection):
     """
     Compute the tomographic rotation axis based on cross-correlation technique.
     *first_projection* is the projection at 0 deg, *last_projection* is the projection
-    at 180 deg.
+    at 180 deg. The rows are correlated separately and the axis is found with sub-pixel
+    precision, see :func:`tofu.axis.estimate_axis`.
     """
-    from scipy.signal import fftconvolve
-    width = first_projection.shape[1]
-    first_projection = first_projection - first_projection.mean()
-    last_projection = last_projection - last_projection.mean()
-
-    # The rotation by 180 deg flips the image horizontally, in order
-    # to do cross-correlation by convolution we must also flip it
-    # vertically, so the image is transposed and we can apply convolution
-    # which will act as cross-correlation
-    convolved = fftconvolve(first_projection, last_projection[::-1, :], mode='same')
-    center = np.unravel_index(convolved.argmax(), convolved.shape)[1]
-
-    return (width / 2.0 + center) / 2
+    estimate = estimate_axis(first_projection, last_projection)
+    LOG.info('Rotation axis tilt: {:.3f} deg'.format(estimate.tilt))
+
+    return estimate.axis
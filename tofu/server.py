@@ -0,0 +1,216 @@
+"""Long-lived process which runs tofu commands submitted through a socket.
+
+Before a tofu command processes any data, it imports the GObject bindings, scans the UFO plugin
+directories, creates an OpenCL context and compiles the kernels of its graph, which takes longer
+than small jobs like axis estimation or sinogram filtering themselves. A :class:`Server` keeps all
+of this alive between commands: the plugin manager with the loaded plugins, the shared resources of
+:func:`tofu.tasks.get_resources` with the OpenCL context and the compiled kernels and the caches of
+the numpy backend, e.g. the phase retrieval filters. :class:`Client` instances submit a command
+with its arguments as a newline-delimited JSON message like in :mod:`tofu.distributed`. Commands
+share the devices, so they are run one after another in the working directory of the client. Task
+instances are not reused because they keep the state of the graph they were run in, creating them
+is cheap once their plugins are loaded.
+"""
+import argparse
+import importlib
+import logging
+import os
+import time
+from threading import Lock, Thread
+from tofu.distributed import close_server, connect, create_server, receive_message, send_message
+
+
+LOG = logging.getLogger(__name__)
+
+
+def run_tomo(args):
+    if args.backend == 'numpy':
+        from tofu.cpu import tomo
+    else:
+        from tofu.reco import tomo
+
+    return tomo(args)
+
+
+def run_estimate(args):
+    from tofu.reco import estimate_center
+    return estimate_center(args)
+
+
+def run_flat_correct(args):
+    from tofu.preprocess import run_flat_correct
+    return run_flat_correct(args)
+
+
+def run_preprocessing(args):
+    from tofu.preprocess import run_preprocessing
+    return run_preprocessing(args)
+
+
+def run_sinos(args):
+    from tofu.preprocess import run_sinogram_generation
+    return run_sinogram_generation(args)
+
+
+def run_sweep(args):
+    from tofu.sweep import sweep
+    return sweep(args)
+
+
+COMMANDS = {'tomo': run_tomo, 'estimate': run_estimate, 'flatcorrect': run_flat_correct,
+            'preprocess': run_preprocessing, 'sinos': run_sinos, 'sweep': run_sweep}
+
+
+def get_arguments(args):
+    """Get the values of argparse.Namespace *args* which can be sent to the server."""
+    return {name: value for name, value in vars(args).items() if not callable(value)}
+
+
+def warm_up(task_names=()):
+    """Import the modules which run the commands, create the shared UFO resources and load the
+    plugins of *task_names*. Return False if UFO is not available, only the numpy backend is warm
+    then.
+    """
+    for name in ('tofu.cpu', 'tofu.sweep'):
+        importlib.import_module(name)
+
+    try:
+        for name in ('tofu.preprocess', 'tofu.reco'):
+            importlib.import_module(name)
+        from tofu.tasks import get_resources, get_task
+    except (ImportError, ValueError) as error:
+        LOG.warning('UFO is not available (%s), only the numpy backend is warm', error)
+        return False
+
+    start = time.perf_counter()
+    get_resources()
+    for name in task_names:
+        try:
+            get_task(name)
+        except RuntimeError as error:
+            LOG.warning("Cannot load task `%s': %s", name, error)
+    LOG.debug('UFO warmed up in %g s', time.perf_counter() - start)
+
+    return True
+
+
+class Server(object):
+    """Run the commands submitted by clients connecting to *address* (HOST:PORT or Unix socket
+    path) one after another. The plugins of *task_names* are loaded when the server starts, UFO is
+    not touched before the first command if it is None.
+    """
+    def __init__(self, address, task_names=()):
+        self.address = address
+        self.task_names = task_names
+        self.num_commands = 0
+        self.server = create_server(address, self._handle)
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def server_address(self):
+        return self.server.server_address
+
+    def start(self):
+        if self.task_names is not None:
+            warm_up(self.task_names)
+        self._thread = Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info("Server listening on `%s'", self.address)
+
+    def stop(self):
+        close_server(self.server)
+
+    def run(self):
+        """Serve until interrupted."""
+        self.start()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            LOG.info('Server interrupted after %d commands', self.num_commands)
+        finally:
+            self.stop()
+
+    def execute(self, command, values, cwd=None):
+        """Run *command* with argument *values* in directory *cwd* and return its result."""
+        if command not in COMMANDS:
+            raise RuntimeError("Command `{}' cannot be run by the server".format(command))
+        args = argparse.Namespace(**values)
+
+        with self._lock:
+            LOG.info('Running %s', command)
+            directory = os.getcwd()
+            start = time.perf_counter()
+            try:
+                os.chdir(cwd or directory)
+                result = COMMANDS[command](args)
+            finally:
+                os.chdir(directory)
+            self.num_commands += 1
+            LOG.info('%s finished in %g s', command, time.perf_counter() - start)
+
+        return result.tolist() if hasattr(result, 'tolist') else result
+
+    def _handle(self, handler):
+        try:
+            while True:
+                message = receive_message(handler.rfile)
+                if message is None:
+                    break
+                send_message(handler.connection, self._process(message))
+        except (OSError, ValueError) as error:
+            LOG.warning('Lost connection to client: %s', error)
+
+    def _process(self, message):
+        if message.get('type') != 'run':
+            return {'type': 'error',
+                    'message': "Unknown message type `{}'".format(message.get('type'))}
+        start = time.perf_counter()
+        try:
+            result = self.execute(message['command'], message['args'], cwd=message.get('cwd'))
+        except Exception as error:
+            # A failing command must not stop the server
+            LOG.exception('%s failed', message['command'])
+            if not isinstance(error, RuntimeError):
+                error = '{}: {}'.format(type(error).__name__, error)
+            return {'type': 'error', 'message': str(error)}
+
+        return {'type': 'result', 'result': result, 'duration': time.perf_counter() - start}
+
+
+class Client(object):
+    """Submit commands to the :class:`Server` at *address*. Wait at most *timeout* seconds for a
+    result, forever if None.
+    """
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.timeout = timeout
+
+    def run(self, command, args):
+        """Run *command* with argparse.Namespace *args* in the current directory by the server and
+        return its result.
+        """
+        try:
+            sock = connect(self.address)
+        except OSError as error:
+            raise RuntimeError("Cannot connect to tofu server at `{}': {}".format(self.address,
+                                                                                  error))
+        sock.settimeout(self.timeout)
+        stream = sock.makefile('rb')
+        try:
+            send_message(sock, {'type': 'run', 'command': command, 'args': get_arguments(args),
+                                'cwd': os.getcwd()})
+            message = receive_message(stream)
+        finally:
+            stream.close()
+            sock.close()
+
+        if message is None:
+            raise RuntimeError('Server closed the connection')
+        if message['type'] == 'error':
+            raise RuntimeError(message['message'])
+        LOG.debug('Server ran %s in %g s', command, message['duration'])
+
+        return message['result']
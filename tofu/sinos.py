@@ -0,0 +1,158 @@
+"""Sinogram generation which reads every projection only once.
+
+The sinograms are split into passes of --pass-size sinograms. Instead of reading all projections
+once per pass, every projection is read once, flat corrected and its rows are scattered to the
+buffers of all passes. The buffers of the passes which fit into the memory limit are kept in
+memory, the others are memory-mapped temporary files next to the output, so that the data set is
+read only once no matter how many passes there are. Projections are read by a pool of threads and
+the passes are written concurrently if the output is an HDF5 or Zarr volume.
+"""
+import copy
+import logging
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tofu.cpu import SliceReader, get_slice_writer
+from tofu.util import get_filenames
+from tofu.volume import is_volume_output, split_volume_filename
+
+
+LOG = logging.getLogger(__name__)
+SUPPORTED_EXTENSIONS = ('.tif', '.tiff', '.edf')
+
+
+def get_memory_size():
+    """Get the size of the physical memory in bytes or None if it cannot be determined."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def can_transpose(args):
+    """Can the input given by *args* be read by :func:`generate_sinograms`?"""
+    paths = [args.projections]
+    if args.darks and args.flats:
+        paths += [path for path in (args.darks, args.flats, args.flats2) if path]
+    for path in paths:
+        filenames = get_filenames(path)
+        if not filenames or not all(os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+                                    for filename in filenames):
+            return False
+
+    return True
+
+
+def get_passes(num_sinograms, pass_size=0):
+    """Split *num_sinograms* into (start, stop) passes of *pass_size* (all at once if 0)."""
+    pass_size = pass_size or num_sinograms
+
+    return [(start, min(start + pass_size, num_sinograms))
+            for start in range(0, num_sinograms, pass_size)]
+
+
+class SinogramBuffers(object):
+    """Buffers of sinogram *passes* with *num_projections* and *width*. Passes are kept in memory
+    in order as long as all of them fit into *max_bytes*, the others are memory-mapped files in a
+    temporary directory created in *directory* (the system default if None). Every sinogram is
+    contiguous, so that it can be written without gathering.
+    """
+    def __init__(self, passes, num_projections, width, max_bytes, directory=None):
+        self.passes = passes
+        self.buffers = []
+        self.num_mapped = 0
+        self._directory = None
+        in_memory = 0
+        for start, stop in passes:
+            shape = (stop - start, num_projections, width)
+            size = 4 * int(np.prod(shape))
+            if in_memory + size <= max_bytes:
+                buffer = np.empty(shape, dtype=np.float32)
+                in_memory += size
+            else:
+                if self._directory is None:
+                    self._directory = tempfile.mkdtemp(prefix='tofu-sinos-', dir=directory)
+                filename = os.path.join(self._directory, 'sinos-{:06}.raw'.format(start))
+                buffer = np.memmap(filename, dtype=np.float32, mode='w+', shape=shape)
+                self.num_mapped += 1
+            self.buffers.append(buffer)
+
+    def scatter(self, index, projection):
+        """Put the rows of *projection* number *index* to the sinograms of all passes."""
+        for (start, stop), buffer in zip(self.passes, self.buffers):
+            buffer[:, index] = projection[start:stop]
+
+    def close(self):
+        """Release the buffers and remove the memory-mapped files."""
+        self.buffers = []
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+def get_buffer_directory(output):
+    """Get the directory of *output* for the memory-mapped buffers, it is created if necessary."""
+    directory = os.path.dirname(os.path.abspath(split_volume_filename(output)[0]))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    return directory
+
+
+def generate_sinograms(args):
+    """Generate sinograms from args.projections (flat corrected if there are args.darks and
+    args.flats) and write them to args.output. Every projection is read only once by
+    args.num_readers threads. Return the execution time in seconds.
+    """
+    start_time = time.perf_counter()
+    params = copy.copy(args)
+    params.sinograms = None
+    reader = SliceReader(params)
+    num_sinograms = reader.num_slices
+    passes = get_passes(num_sinograms, args.pass_size)
+    max_bytes = args.sinogram_memory
+    if max_bytes is None:
+        max_bytes = (get_memory_size() or 2 ** 32) // 2
+    buffers = SinogramBuffers(passes, reader.num_projections, reader.width, max_bytes,
+                              directory=get_buffer_directory(args.output))
+    num_readers = args.num_readers or min(8, os.cpu_count() or 1)
+    LOG.debug('Generating %d sinograms (%d projections, width %d) in %d passes (%d memory-mapped) '
+              'by %d readers', num_sinograms, reader.num_projections, reader.width, len(passes),
+              buffers.num_mapped, num_readers)
+
+    def scatter(index):
+        buffers.scatter(index, reader.read_projection(index))
+
+    writer = None
+    try:
+        with ThreadPoolExecutor(max_workers=num_readers) as executor:
+            for _ in executor.map(scatter, range(reader.num_projections)):
+                pass
+        writer = get_slice_writer(args, (num_sinograms, reader.num_projections, reader.width))
+        if is_volume_output(args.output):
+            # Chunks shared by two passes are locked by the volume writer
+            with ThreadPoolExecutor(max_workers=min(len(passes), num_readers)) as executor:
+                futures = [executor.submit(writer.write, start, buffer)
+                           for (start, stop), buffer in zip(passes, buffers.buffers)]
+                for future in futures:
+                    future.result()
+        else:
+            for (start, stop), buffer in zip(passes, buffers.buffers):
+                writer.write(start, buffer)
+    except KeyboardInterrupt:
+        LOG.info('Processing interrupted')
+        if writer:
+            writer.abort()
+        return
+    finally:
+        if writer:
+            writer.close()
+        buffers.close()
+
+    duration = time.perf_counter() - start_time
+    LOG.debug('Sinograms generated in %g s', duration)
+
+    return duration
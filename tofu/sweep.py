@@ -0,0 +1,118 @@
+"""Sweeps over phase retrieval parameters with shared preprocessing.
+
+Finding the regularization rate or the propagation distance by running the whole reconstruction
+for every value reads and flat corrects the projections again and again. :func:`sweep` reads and
+flat corrects every projection once, transforms it once and applies the phase retrieval filters
+of all values to its spectrum. Only the rows of the reconstructed slices are kept and the slices
+are reconstructed for every value by the numpy backend. The output is one stack ordered by value
+(all slices of the first value, then all of the second one, ...), like the --z-parameter region of
+tofu reco.
+"""
+import copy
+import logging
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tofu.cpu import (CHUNK_BYTES, SliceReader, get_reconstruction_options, get_slice_writer,
+                      reconstruct_slices)
+from tofu.phase import (filter_spectra, get_fft_functions, get_padded_shape, get_phase_parameters,
+                        get_spectra)
+
+
+LOG = logging.getLogger(__name__)
+SWEEP_PARAMETERS = {'regularization-rate': 'regularization_rate',
+                    'propagation-distance': 'distance'}
+
+
+def get_sweep_parameters(args, values):
+    """Get :class:`tofu.phase.PhaseParameters` given by *args* for all *values* of
+    args.sweep_parameter.
+    """
+    name = SWEEP_PARAMETERS[args.sweep_parameter]
+
+    return [get_phase_parameters(args, **{name: value}) for value in values]
+
+
+def retrieve_rows(reader, parameters, rows, padded_shape, padding_mode='clamp_to_edge',
+                  num_workers=None):
+    """Read all projections of :class:`tofu.cpu.SliceReader` *reader*, retrieve phase with every
+    :class:`tofu.phase.PhaseParameters` in *parameters* and keep only *rows*. The projections are
+    read, padded and transformed once in batches by *num_workers* threads. Return sinograms
+    (parameters, rows, projections, width).
+    """
+    shape = (reader.num_slices, reader.width)
+    fft, ifft = get_fft_functions()
+    # Padded images, their spectra and one retrieved stack per batch
+    batch_size = max(1, CHUNK_BYTES // (16 * padded_shape[0] * padded_shape[1]))
+    result = np.empty((len(parameters), len(rows), reader.num_projections, reader.width),
+                      dtype=np.float32)
+
+    def process(start):
+        stop = min(start + batch_size, reader.num_projections)
+        projections = np.array([reader.read_projection(i) for i in range(start, stop)])
+        spectra = get_spectra(projections, padded_shape, padding_mode=padding_mode, fft=fft)
+        for i, phase_parameters in enumerate(parameters):
+            retrieved = filter_spectra(spectra, phase_parameters, shape, padded_shape, ifft=ifft)
+            result[i, :, start:stop] = retrieved[:, rows].transpose(1, 0, 2)
+
+    num_workers = num_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for _ in executor.map(process, range(0, reader.num_projections, batch_size)):
+            pass
+
+    return result
+
+
+def sweep(args):
+    """Reconstruct args.sweep_rows of projections given by *args* for every value of
+    args.sweep_parameter in args.sweep_region, see the module documentation. Return the execution
+    time in seconds.
+    """
+    if not args.projections:
+        raise RuntimeError('--projections not set')
+    if not args.sweep_region:
+        raise RuntimeError('--sweep-region not set')
+    start_time = time.perf_counter()
+    values = np.arange(*args.sweep_region)
+    parameters = get_sweep_parameters(args, values)
+    params = copy.copy(args)
+    params.sinograms = None
+    reader = SliceReader(params)
+    rows = list(args.sweep_rows or [reader.num_slices // 2])
+    if min(rows) < -reader.num_slices or max(rows) >= reader.num_slices:
+        raise RuntimeError('Sweep rows must be within the {} read rows'.format(reader.num_slices))
+    axis = (args.axis or reader.full_width / 2.0) / reader.resize
+    options = get_reconstruction_options(args, reader.width, reader.num_projections, axis)[0]
+    padded_shape = get_padded_shape((reader.num_slices, reader.width),
+                                    (args.retrieval_padded_height, args.retrieval_padded_width))
+    LOG.debug('Sweeping %s over %s, rows %s, padded shape %s', args.sweep_parameter,
+              values.tolist(), rows, padded_shape)
+
+    sinograms = retrieve_rows(reader, parameters, rows, padded_shape,
+                              padding_mode=args.retrieval_padding_mode,
+                              num_workers=args.cpu_workers)
+    attrs = {'sweep_parameter': args.sweep_parameter, 'sweep_values': values.tolist(),
+             'sweep_rows': rows, 'method': args.method, 'axis': axis}
+    writer = get_slice_writer(args, (len(values) * len(rows), reader.width, reader.width),
+                              attrs=attrs)
+    try:
+        for i, value in enumerate(values):
+            LOG.info('%s %g: slices %d-%d', args.sweep_parameter, value, i * len(rows),
+                     (i + 1) * len(rows) - 1)
+            slices = reconstruct_slices(sinograms[i], **options)
+            if writer:
+                writer.write(i * len(rows), slices)
+    except KeyboardInterrupt:
+        LOG.info('Processing interrupted')
+        if writer:
+            writer.abort()
+        return
+    finally:
+        if writer:
+            writer.close()
+
+    duration = time.perf_counter() - start_time
+    LOG.info("Execution time: {} s".format(duration))
+
+    return duration
@@ -1,9 +1,12 @@
 import logging
+from threading import Lock
 from gi.repository import Ufo
 
 
 LOG = logging.getLogger(__name__)
 PLUGIN_MANAGER = Ufo.PluginManager()
+_RESOURCES = None
+_RESOURCES_LOCK = Lock()
 
 
 def get_task(name, processing_node=None, **kwargs):
@@ -16,6 +19,31 @@ def get_task(name, processing_node=None, **kwargs):
     return task
 
 
+def get_resources():
+    """Get the Ufo.Resources shared by the schedulers created by :func:`get_scheduler`. They hold
+    the OpenCL context and the compiled kernels, so that graphs which are run repeatedly in one
+    process (e.g. by :mod:`tofu.server`) do not set them up again.
+    """
+    global _RESOURCES
+
+    with _RESOURCES_LOCK:
+        if _RESOURCES is None:
+            LOG.debug('Creating shared UFO resources')
+            _RESOURCES = Ufo.Resources()
+
+    return _RESOURCES
+
+
+def get_scheduler(fixed=False):
+    """Get a new Ufo.Scheduler (Ufo.FixedScheduler if *fixed* is True) which uses the shared
+    resources, see :func:`get_resources`.
+    """
+    scheduler = Ufo.FixedScheduler() if fixed else Ufo.Scheduler()
+    scheduler.set_resources(get_resources())
+
+    return scheduler
+
+
 def get_writer(params):
     if 'dry_run' in params and params.dry_run:
         LOG.debug("Discarding data output")
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from tofu.axis import estimate_axis, get_fft_plan, select_rows
+
+
+def make_projections(axis, width=512, height=16, tilt_slope=0, seed=0):
+    """Make projections at 0 and 180 degrees of an object composed of Gaussians rotating around
+    *axis* which changes by *tilt_slope* per row.
+    """
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(0.35 * width, 0.65 * width, 50)
+    sigmas = rng.uniform(2, 8, 50)
+    amplitudes = rng.uniform(0.1, 1, 50)
+
+    def profile(x):
+        return (amplitudes * np.exp(-(x[:, np.newaxis] - positions) ** 2 /
+                                    (2 * sigmas ** 2))).sum(axis=1) + 0.3
+
+    x = np.arange(width) + 0.5
+    first = np.array([profile(x) for row in range(height)])
+    last = np.array([profile(2 * (axis + tilt_slope * row) - x) for row in range(height)])
+
+    return first, last
+
+
+def test_select_rows():
+    np.testing.assert_equal(select_rows(4), [0, 1, 2, 3])
+    np.testing.assert_equal(select_rows(10, rows=3), [0, 4, 9])
+    np.testing.assert_equal(select_rows(10, rows=[2, 5]), [2, 5])
+
+
+def test_plan_cache():
+    assert get_fft_plan(100) is get_fft_plan(100)
+    assert get_fft_plan(100).size >= 199
+
+
+@pytest.mark.parametrize('axis', [256, 230.37, 290.81])
+@pytest.mark.parametrize('method', ['correlation', 'phase'])
+def test_estimate_axis(axis, method):
+    first, last = make_projections(axis)
+    estimate = estimate_axis(first, last, method=method)
+    assert abs(estimate.axis - axis) < 0.05
+    assert abs(estimate.tilt) < 0.05
+
+
+@pytest.mark.parametrize('axis', [120.3, 140.7])
+def test_phase_smooth(axis):
+    # Broad features, the same edges of both rows must not pull the axis to the center
+    width = 256
+    x = np.arange(width) + 0.5
+
+    def profile(x):
+        return (np.exp(-(x - 0.55 * width) ** 2 / (2 * (0.15 * width) ** 2)) +
+                0.5 * np.exp(-(x - 0.4 * width) ** 2 / (2 * (0.08 * width) ** 2)))
+
+    first = np.tile(profile(x), (8, 1))
+    last = np.tile(profile(2 * axis - x), (8, 1))
+    assert abs(estimate_axis(first, last, method='phase').axis - axis) < 0.1
+
+
+@pytest.mark.parametrize('axis', [256.3, 230.37, 290.81])
+def test_phase_noisy(axis):
+    first, last = make_projections(axis)
+    rng = np.random.default_rng(1)
+    errors = []
+    for i in range(5):
+        estimate = estimate_axis(first + rng.normal(0, 0.05, first.shape),
+                                 last + rng.normal(0, 0.05, last.shape), method='phase')
+        errors.append(estimate.axis - axis)
+    assert np.max(np.abs(errors)) < 0.05
+
+
+def test_flipped():
+    first = np.random.default_rng(0).normal(size=(4, 64))
+    assert estimate_axis(first, first[:, ::-1]).axis == pytest.approx(32)
+
+
+def test_tilt():
+    first, last = make_projections(250.3, height=64, tilt_slope=0.01)
+    estimate = estimate_axis(first, last, rows=16)
+    assert len(estimate.rows) == 16
+    assert abs(estimate.tilt - np.rad2deg(np.arctan(0.01))) < 0.05
+    assert abs(estimate.axis - (250.3 + 0.01 * 31.5)) < 0.1
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        estimate_axis(np.zeros((2, 4)), np.zeros((2, 5)))
+    with pytest.raises(ValueError):
+        estimate_axis(np.zeros((2, 4)), np.zeros((2, 4)), method='foo')
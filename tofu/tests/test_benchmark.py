@@ -0,0 +1,67 @@
+import copy
+import json
+import pytest
+from tofu.benchmark import (BENCHMARKS, compare, compare_files, get_machine_info, read_results,
+                            run_suite, write_results)
+
+
+pytest.importorskip('tifffile')
+
+
+@pytest.fixture(scope='module')
+def results():
+    return run_suite(names=['tomo-fbp-numpy', 'ez-stitch-360'], size=(32, 4, 16), num_runs=2)
+
+
+def test_get_machine_info():
+    info = get_machine_info()
+    assert info['cpu_count'] >= 1
+    assert 'python' in info and 'tofu' in info
+
+
+def test_run_suite(results):
+    assert list(results['benchmarks']) == ['tomo-fbp-numpy', 'ez-stitch-360']
+    fbp = results['benchmarks']['tomo-fbp-numpy']
+    assert fbp['status'] == 'ok'
+    assert fbp['items'] == 4
+    assert len(fbp['times']) == 2
+    assert fbp['throughput'] == pytest.approx(4 / fbp['median'])
+    assert results['benchmarks']['ez-stitch-360']['items'] == 8
+    # Results must be serializable
+    json.dumps(results)
+
+
+def test_run_suite_unknown():
+    with pytest.raises(RuntimeError):
+        run_suite(names=['foo'])
+
+
+def test_all_benchmarks_registered():
+    for name in ('tomo-fbp', 'tomo-dfi', 'genreco-parallel', 'genreco-cone', 'lamino',
+                 'flat-correction', 'phase-retrieval', 'sinograms', 'ez-stitch-360'):
+        assert name in BENCHMARKS
+
+
+def test_compare(results):
+    current = copy.deepcopy(results)
+    current['benchmarks']['tomo-fbp-numpy']['throughput'] *= 0.8
+    current['benchmarks']['ez-stitch-360']['throughput'] *= 0.95
+    comparison = {name: regressed for name, old, new, change, regressed
+                  in compare(results, current, threshold=0.1)}
+    assert comparison == {'tomo-fbp-numpy': True, 'ez-stitch-360': False}
+
+    current['benchmarks']['ez-stitch-360'] = {'status': 'failed', 'error': ''}
+    assert dict((item[0], item[-1]) for item in compare(results, current))['ez-stitch-360']
+
+
+def test_compare_files(tmpdir, results):
+    baseline = str(tmpdir.join('baseline.json'))
+    current = str(tmpdir.join('current.json'))
+    write_results(results, baseline)
+    faster = read_results(baseline)
+    for result in faster['benchmarks'].values():
+        result['throughput'] *= 2
+    write_results(faster, current)
+
+    assert compare_files(baseline, current)
+    assert not compare_files(current, baseline, threshold=0.4)
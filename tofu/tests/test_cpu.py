@@ -0,0 +1,210 @@
+import numpy as np
+import pytest
+from tofu import config
+from tofu.cpu import (TiffSliceWriter, backproject_slices, bin_image, filter_sinograms,
+                      forward_project_slices, get_angles, get_filter, reconstruct_centers,
+                      reconstruct_iterative, reconstruct_slices, tomo)
+
+
+def make_disk_sinogram(width=64, num_projections=90, radius=10, center=None):
+    """Sinogram of a disk with value 1 centered on the rotation axis *center* in UFO conventions,
+    i.e. detector pixel i has its center at i + 0.5.
+    """
+    center = width / 2 if center is None else center
+    positions = np.arange(width) + 0.5 - center
+    row = 2 * np.sqrt(np.clip(radius ** 2 - positions ** 2, 0, None))
+
+    return np.tile(row, (num_projections, 1)).astype(np.float32)
+
+
+def test_get_angles():
+    np.testing.assert_allclose(get_angles(4), [0, np.pi / 4, np.pi / 2, 3 * np.pi / 4])
+    np.testing.assert_allclose(get_angles(2, angle_step=0.1, offset=1), [1, 1.1])
+
+
+@pytest.mark.parametrize('center', [35, 30.3])
+def test_reconstruct_centers(center):
+    sinogram = make_disk_sinogram(center=center)
+    result = reconstruct_centers(sinogram, [center])
+    assert result.shape == (1, 64, 64)
+    # Slices are centered on the axis
+    assert abs(result[0, 32, 32] - 1) < 0.05
+    assert abs(result[0, 32, 55]) < 0.05
+
+    sinograms = make_shifted_disk_sinograms(num_slices=1, axis=center)
+    centers = np.round(np.arange(center - 1, center + 1.05, 0.1), 1)
+    scores = [np.abs(result).sum() for result in reconstruct_centers(sinograms[0], centers)]
+    # Same convention as backproject_slices and tofu.axis
+    assert centers[np.argmin(scores)] == center
+
+
+def make_shifted_disk_sinograms(num_slices=2, width=64, num_projections=90, axis=33.5,
+                                position=(8, -5), radius=10):
+    """Sinograms of a disk with value 1 at *position* relative to *axis* in UFO conventions."""
+    detector = np.arange(width) + 0.5 - axis
+    angles = get_angles(num_projections)
+    centers = position[0] * np.cos(angles) + position[1] * np.sin(angles)
+    sinogram = 2 * np.sqrt(np.clip(radius ** 2 - (detector - centers[:, np.newaxis]) ** 2, 0, None))
+
+    return np.tile(sinogram, (num_slices, 1, 1)).astype(np.float32)
+
+
+def get_disk_values(slices, center, radius=10):
+    y, x = np.mgrid[:slices.shape[-2], :slices.shape[-1]]
+    distance = np.hypot(x - center[0], y - center[1])
+
+    return slices[..., distance < radius - 2], slices[..., distance > radius + 2]
+
+
+def test_get_filter():
+    np.testing.assert_allclose(get_filter('none', 8), 1)
+    ramp = get_filter('ramp', 256)
+    assert ramp.shape == (129,)
+    np.testing.assert_allclose(get_filter('ramp-fromreal', 256)[10:100], ramp[10:100], atol=1e-3)
+    assert get_filter('hamming', 256, cutoff=0.25)[-1] == 0
+    with pytest.raises(RuntimeError):
+        get_filter('bh3', 256)
+
+
+@pytest.mark.parametrize('crop', [True, False])
+def test_filter_sinograms(crop):
+    filtered = filter_sinograms(np.ones((3, 2, 20)), name='ramp', crop=crop)
+    assert filtered.shape == (3, 2, 20 if crop else 64)
+    np.testing.assert_allclose(filtered, 0, atol=1e-6)
+
+
+@pytest.mark.parametrize('options', [{'method': 'fbp'},
+                                     {'method': 'fbp', 'crop_after': 'filter'},
+                                     {'method': 'fbp', 'padding_mode': 'none'},
+                                     {'method': 'dfi', 'oversampling': 2},
+                                     {'method': 'sart', 'num_iterations': 5},
+                                     {'method': 'sart', 'num_subsets': 10, 'num_iterations': 5,
+                                      'relaxation_factor': 0.5},
+                                     {'method': 'sirt', 'num_iterations': 20,
+                                      'relaxation_factor': 1, 'warm_start': True}])
+def test_reconstruct_slices(options):
+    sinograms = make_shifted_disk_sinograms()
+    slices = reconstruct_slices(sinograms, 33.5, **options)
+    assert slices.shape == (2, 64, 64)
+    # Backprojection keeps the axis in place, DFI centers the slices on it
+    origin = 31.5 if options['method'] == 'dfi' else 33
+    inside, outside = get_disk_values(slices, (origin + 8, origin - 5))
+    assert abs(inside.mean() - 1) < 0.02
+    assert np.abs(outside).mean() < 0.02
+
+
+def test_forward_project_slices():
+    rng = np.random.default_rng(0)
+    slices = rng.random((2, 64, 64)).astype(np.float32)
+    sinograms = rng.random((2, 90, 70)).astype(np.float32)
+    angles = get_angles(90)
+    projected = forward_project_slices(slices, 33.5, angles, detector_width=70)
+    assert projected.shape == (2, 90, 70)
+    # Projection is the transpose of the backprojection
+    backprojected = backproject_slices(sinograms, 33.5, angles, width=64) * 90 / np.pi
+    assert np.vdot(projected, sinograms) == pytest.approx(np.vdot(slices, backprojected),
+                                                          rel=1e-5)
+
+
+def test_reconstruct_iterative_stopping():
+    sinograms = make_shifted_disk_sinograms()
+    options = {'num_subsets': 10, 'num_iterations': 50, 'relaxation_factor': 0.5,
+               'tolerance': 0.05}
+    cold, cold_residuals = reconstruct_iterative(sinograms, 33.5, **options)
+    warm, warm_residuals = reconstruct_iterative(sinograms, 33.5,
+                                                 initial=reconstruct_slices(sinograms, 33.5),
+                                                 **options)
+    assert 1 < len(warm_residuals) < len(cold_residuals) < 50
+    assert np.all(np.diff(cold_residuals) < 0)
+    assert warm_residuals[-1] < cold_residuals[-1]
+
+
+def test_reconstruct_batches():
+    sinograms = make_shifted_disk_sinograms(num_slices=3)
+    sinograms *= np.arange(1, 4, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    batch = reconstruct_slices(sinograms, 33.5)
+    for sinogram, expected in zip(sinograms, batch):
+        np.testing.assert_allclose(reconstruct_slices(sinogram[np.newaxis], 33.5)[0], expected,
+                                   atol=1e-5)
+
+
+def test_bin_image():
+    image = np.arange(20, dtype=np.float32).reshape(4, 5)
+    np.testing.assert_allclose(bin_image(image, 2), [[3, 5], [13, 15]])
+
+
+def test_tiff_slice_writer(tmpdir):
+    tifffile = pytest.importorskip('tifffile')
+    slices = np.arange(5 * 4 * 4, dtype=np.float32).reshape(5, 4, 4)
+    pattern = str(tmpdir.join('out', 'slice-%03i.tif'))
+    writer = TiffSliceWriter(pattern, bytes_per_file=2 * slices[0].nbytes)
+    writer.write(0, slices)
+    writer.close()
+    expected = [tmpdir.join('out', 'slice-{:03}.tif'.format(i)) for i in range(3)]
+    assert sorted(tmpdir.join('out').listdir()) == expected
+    np.testing.assert_allclose(tifffile.imread(pattern % 2), slices[4])
+
+    filename = str(tmpdir.join('slices.tif'))
+    writer = TiffSliceWriter(filename, bitdepth=8, minimum=0, maximum=slices.max())
+    writer.write(0, slices)
+    writer.close()
+    data = tifffile.imread(filename)
+    assert data.dtype == np.uint8 and data.shape == (5, 4, 4)
+    assert data[0, 0, 0] == 0 and data[-1, -1, -1] == 255
+
+
+def make_tomo_args(**kwargs):
+    args = config.Params(sections=config.TOMO_PARAMS).get_defaults()
+    args.backend = 'numpy'
+    args.cpu_workers = 2
+    args.axis = 33.5
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+
+    return args
+
+
+@pytest.mark.parametrize('method', ['fbp', 'dfi', 'sart'])
+def test_tomo_sinograms(tmpdir, method):
+    tifffile = pytest.importorskip('tifffile')
+    sinograms = make_shifted_disk_sinograms(num_slices=5)
+    directory = tmpdir.mkdir('sinos')
+    for i, sinogram in enumerate(sinograms):
+        tifffile.imwrite(str(directory.join('sino-{:02}.tif'.format(i))), sinogram)
+    output = str(tmpdir.join('slices', 'slice-%05i.tif'))
+    args = make_tomo_args(sinograms=str(directory), output=output, output_bytes_per_file=0,
+                          method=method, start=1, step=2, batch_size=1)
+
+    assert tomo(args) > 0
+    assert len(tmpdir.join('slices').listdir()) == 2
+    expected = reconstruct_slices(sinograms[:1], 33.5, method=method)[0]
+    np.testing.assert_allclose(tifffile.imread(output % 1), expected, atol=1e-5)
+
+
+def test_tomo_projections(tmpdir):
+    tifffile = pytest.importorskip('tifffile')
+    h5py = pytest.importorskip('h5py')
+    # Projections with 8 rows of which every second one starting at the second is used
+    sinograms = make_shifted_disk_sinograms(num_slices=8) / 20
+    dark = np.full((8, 64), 10, dtype=np.float32)
+    flat = np.full((8, 64), 1000, dtype=np.float32)
+    projections = dark + (flat - dark) * np.exp(-sinograms.transpose(1, 0, 2))
+    for name, images in (('darks', [dark] * 2), ('flats', [flat] * 3),
+                         ('projections', projections)):
+        directory = tmpdir.mkdir(name)
+        for i, image in enumerate(images):
+            tifffile.imwrite(str(directory.join('{:04}.tif'.format(i))), image)
+    output = str(tmpdir.join('volume.h5'))
+    args = make_tomo_args(projections=str(tmpdir.join('projections')),
+                          darks=str(tmpdir.join('darks')), flats=str(tmpdir.join('flats')),
+                          absorptivity=True, y=1, y_step=2, output=output)
+
+    tomo(args)
+    expected = reconstruct_slices(sinograms[:4] * 20, 33.5) / 20
+    with h5py.File(output, 'r') as f:
+        np.testing.assert_allclose(f['volume'][:], expected, atol=1e-4)
+
+
+def test_tomo_unsupported():
+    with pytest.raises(RuntimeError):
+        tomo(make_tomo_args(method='sbtv', width=64, height=90))
@@ -0,0 +1,120 @@
+import os
+import socket
+import struct
+import threading
+import pytest
+from tofu.distributed import (Coordinator, WorkQueue, Worker, close_server, create_server,
+                              parse_address, receive_message, send_message)
+
+
+def test_parse_address():
+    assert parse_address('node1:5000')[1] == ('node1', 5000)
+    assert parse_address(':5000')[1] == ('0.0.0.0', 5000)
+    assert parse_address('/tmp/tofu.sock')[1] == '/tmp/tofu.sock'
+
+
+def test_work_queue():
+    queue = WorkQueue(['a', 'b', 'c'])
+    assert queue.get('w1') == (0, 'a')
+    assert queue.get('w2') == (1, 'b')
+    assert queue.get('w1') == (2, 'c')
+    # Everything is assigned
+    assert queue.get('w2') is None
+    queue.finish(1, 'w2')
+    # w1 died, its items are handed out again
+    assert queue.requeue('w1') == [0, 2]
+    assert queue.get('w2') == (0, 'a')
+    queue.finish(0, 'w2')
+    assert queue.get('w2') == (2, 'c')
+    queue.finish(2, 'w2')
+    assert queue.finished
+    with pytest.raises(StopIteration):
+        queue.get('w2')
+
+
+def run_workers(address, key, num_workers, process):
+    errors = []
+
+    def run():
+        try:
+            Worker(address, key, heartbeat=0.1).run(process)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run) for i in range(num_workers)]
+    for thread in threads:
+        thread.start()
+
+    return threads, errors
+
+
+@pytest.mark.parametrize('kind', ['tcp', 'unix'])
+def test_distribute(tmpdir, kind):
+    items = [{'offset': i} for i in range(10)]
+    address = 'localhost:0' if kind == 'tcp' else str(tmpdir.join('tofu.sock'))
+    coordinator = Coordinator(address, items, 'key', timeout=5)
+    if kind == 'tcp':
+        address = 'localhost:{}'.format(coordinator.server_address[1])
+    coordinator.start()
+    processed = []
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def process(item):
+        if item['offset'] == 3 and not failed.is_set():
+            # Worker dies in the middle of an item
+            failed.set()
+            raise RuntimeError('worker died')
+        with lock:
+            processed.append(item['offset'])
+
+    threads, errors = run_workers(address, 'key', 3, process)
+    assert coordinator.wait(timeout=30)
+    for thread in threads:
+        thread.join()
+    coordinator.stop()
+
+    assert len(errors) == 1
+    assert sorted(processed) == list(range(10))
+    if kind == 'unix':
+        assert not os.path.exists(address)
+
+
+def test_wrong_key(tmpdir):
+    address = str(tmpdir.join('tofu.sock'))
+    coordinator = Coordinator(address, [{'offset': 0}], 'key', timeout=5)
+    coordinator.start()
+    threads, errors = run_workers(address, 'other-key', 1, lambda item: None)
+    threads[0].join()
+    coordinator.stop()
+
+    assert len(errors) == 1
+    assert not coordinator.queue.finished
+
+
+@pytest.mark.parametrize('num_waits', [0, 1])
+def test_connection_reset(num_waits):
+    def handle(handler):
+        for i in range(num_waits):
+            receive_message(handler.rfile)
+            send_message(handler.connection, {'type': 'wait', 'seconds': 0.01})
+        receive_message(handler.rfile)
+        # Reset the connection like a coordinator which has just shut down
+        handler.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                      struct.pack('ii', 1, 0))
+        handler.connection.close()
+
+    server = create_server('localhost:0', handle)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    worker = Worker('localhost:{}'.format(server.server_address[1]), 'key')
+    try:
+        if num_waits:
+            # After a wait the coordinator may be gone because everything is finished
+            worker.run(lambda item: None)
+        else:
+            with pytest.raises(OSError):
+                worker.run(lambda item: None)
+    finally:
+        close_server(server)
+        thread.join()
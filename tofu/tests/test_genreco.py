@@ -0,0 +1,636 @@
+import os
+import threading
+import numpy as np
+import pytest
+from tofu import config
+from tofu.genreco import (AsyncWriter, CTGeometry, Executor, RegionCache, RegionQueue,
+                          ResumeManifest, SharedProjectionReader, SidecarWriter, TuningDatabase,
+                          apply_tuning, get_resume_key, get_sidecar_filename,
+                          is_output_single_file, is_region_output_complete, make_slots,
+                          merge_sidecars, remove_stale_region_output,
+                          compute_detector_pixels, compute_detector_pixels_batch,
+                          estimate_projection_memory, estimate_region_projection_memory,
+                          get_extrema, get_harmonic_extrema, get_projection_frames,
+                          get_region_projection_height, get_slices_per_device,
+                          get_tuning_candidates,
+                          _convert_angles_to_rad, _fill_missing_args)
+from tofu.profiling import Profiler
+from tofu.util import Vector
+
+
+def make_args(**kwargs):
+    args = config.Params(sections=config.GEN_RECO_PARAMS).get_defaults()
+    args.width = 256
+    args.height = 128
+    args.number = 300
+    args.overall_angle = 360
+    args.x_region = [-64, 64, 1]
+    args.y_region = [-64, 64, 1]
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    _fill_missing_args(args)
+    _convert_angles_to_rad(args)
+
+    return args
+
+
+def compute_height_scalar(geometry):
+    """Reference projection region computed one angle after another."""
+    region = geometry.args.region
+    extrema = []
+    for i in range(geometry.args.number):
+        extrema.append(geometry._compute_one_parameter(region[0], i))
+        extrema.append(geometry._compute_one_parameter(region[1], i))
+    minima = np.min(extrema, axis=0)
+    maxima = np.max(extrema, axis=0)
+    if maxima[-1] == minima[2]:
+        maxima[-1] += 1
+
+    return tuple(minima[::2]) + tuple(maxima[1::2])
+
+
+GEOMETRIES = [
+    {},
+    {'source_position_y': [-1000.], 'detector_position_y': [200.]},
+    {'axis_angle_x': [30.]},
+    {'axis_angle_x': [30.], 'detector_angle_x': [3.], 'detector_angle_y': [2.]},
+    {'source_position_y': [-800.], 'detector_position_y': [100.], 'axis_angle_x': [20.],
+     'region': [-10., 10., 1.]},
+    {'source_position_y': [-800.], 'detector_angle_x': [3.], 'detector_angle_z': [5.]},
+    {'volume_angle_z': [10.], 'axis_angle_y': [1.], 'region': [-30., 40., 1.]},
+    {'source_position_y': [-900.], 'axis_angle_z': np.linspace(0, 1, 300).tolist()},
+    {'projection_margin': 4, 'axis_angle_x': [45.]},
+    {'z_parameter': 'center-position-x', 'region': [120., 130., 0.5]},
+    {'z_parameter': 'axis-angle-x', 'region': [10., 20., 1.], 'source_position_y': [-500.]},
+    {'z_parameter': 'detector-angle-y', 'region': [-2., 2., 0.1], 'axis_angle_x': [5.]},
+    {'z_parameter': 'source-position-y', 'region': [-900., -800., 10.]},
+]
+
+
+@pytest.mark.parametrize('kwargs', GEOMETRIES)
+def test_compute_height(kwargs):
+    geometry = CTGeometry(make_args(**kwargs))
+    assert geometry.compute_height() == compute_height_scalar(geometry)
+
+
+PARALLEL_GEOMETRIES = [
+    {'axis_angle_x': [30.], 'x_region': [-20, 60, 1], 'y_region': [10, 50, 1]},
+    {'axis_angle_x': [60.], 'axis_angle_y': [2.], 'overall_angle': 180, 'number': 1000},
+    {'detector_angle_x': [4.], 'detector_angle_z': [10.], 'overall_angle': 90},
+    {'volume_angle_x': [5.], 'volume_angle_z': [30.], 'center_position_x': [100.]},
+    {'axis_angle_x': [45.], 'z_parameter': 'axis-angle-x', 'region': [40., 50., 1.]},
+    {'axis_angle_x': [30.], 'overall_angle': -180, 'x_region': [-20, 60, 1]},
+    {'axis_angle_x': [20.], 'volume_angle_z': [30.], 'overall_angle': -90},
+]
+
+
+@pytest.mark.parametrize('kwargs', PARALLEL_GEOMETRIES)
+def test_compute_height_parallel(kwargs):
+    geometry = CTGeometry(make_args(**kwargs))
+    analytic = geometry.compute_height()
+    sampled = compute_height_scalar(geometry)
+    # Continuous bounds may be larger than the sampled ones by at most one pixel
+    assert all(0 <= s - a <= 1 for a, s in zip(analytic[:2], sampled[:2]))
+    assert all(0 <= a - s <= 1 for a, s in zip(analytic[2:], sampled[2:]))
+
+
+@pytest.mark.parametrize('angle_range', [0.5, np.pi, 4, 2 * np.pi, 7, -0.5, -np.pi, -4])
+def test_get_harmonic_extrema(angle_range):
+    alpha = np.array([1., -2., 0.5, 0.])
+    beta = np.array([0., 1., -3., 2.])
+    minima, maxima = get_harmonic_extrema(alpha, beta, angle_range)
+    angles = np.linspace(0, angle_range, 100000)[:, np.newaxis]
+    values = alpha * np.cos(angles) + beta * np.sin(angles)
+    np.testing.assert_allclose(minima, values.min(axis=0), atol=1e-6)
+    np.testing.assert_allclose(maxima, values.max(axis=0), atol=1e-6)
+
+
+@pytest.mark.parametrize('source_y', [-700., -np.inf])
+def test_compute_detector_pixels(source_y):
+    points = get_extrema([-10, 10, 1], [-20, 20, 1], 5)
+    angles = np.linspace(0, 2 * np.pi, 7)
+    num = len(angles)
+    source_positions = np.tile([0., source_y, 0], (num, 1))
+    axis = Vector(x_angle=np.full(num, 0.3), y_angle=np.zeros(num), z_angle=np.full(num, 0.1),
+                  position=np.tile([50., 0, 60], (num, 1)))
+    volume = Vector(x_angle=np.zeros(num), y_angle=np.full(num, 0.2), z_angle=np.zeros(num))
+    detector = Vector(x_angle=np.full(num, 0.05), y_angle=np.full(num, -0.02),
+                      z_angle=np.zeros(num), position=np.tile([1., 100, -2], (num, 1)))
+    x, y = compute_detector_pixels_batch(points, source_positions, axis, volume, detector, angles)
+
+    for i, angle in enumerate(angles):
+        x_single, y_single = compute_detector_pixels(
+            points.copy(),
+            source_positions[i],
+            Vector(x_angle=0.3, z_angle=0.1, position=[50., 0, 60]),
+            Vector(y_angle=0.2),
+            Vector(x_angle=0.05, y_angle=-0.02, position=[1., 100, -2]),
+            angle
+        )
+        np.testing.assert_allclose(x[i], x_single)
+        np.testing.assert_allclose(y[i], y_single)
+
+
+class TestRegionCache:
+    def test_lru(self):
+        cache = RegionCache(maxsize=2)
+        cache.put('a', (0, 1, 2, 3))
+        cache.put('b', (1, 2, 3, 4))
+        assert cache.get('a') == (0, 1, 2, 3)
+        # 'b' is the least recently used one now
+        cache.put('c', (2, 3, 4, 5))
+        assert len(cache) == 2
+        assert cache.get('b') is None
+        assert cache.get('c') == (2, 3, 4, 5)
+        assert cache.hits == 2
+        assert cache.misses == 1
+
+    def test_save_load(self, tmpdir):
+        filename = str(tmpdir.join('regions.json'))
+        cache = RegionCache(filename=filename)
+        cache.put('a', (np.int64(0), 1, 2, 3))
+        cache.save()
+
+        assert RegionCache(filename=filename).get('a') == (0, 1, 2, 3)
+
+    def test_optimize_args(self):
+        cache = RegionCache()
+        args = make_args(source_position_y=[-1000.], region=[-10., 10., 1.])
+        uncached = CTGeometry(args)
+        uncached.optimize_args()
+        cached = CTGeometry(args)
+        cached.optimize_args(cache=cache)
+        assert cache.misses == 1
+        assert (cached.args.y, cached.args.height) == (uncached.args.y, uncached.args.height)
+
+        again = CTGeometry(args)
+        again.optimize_args(cache=cache)
+        assert cache.hits == 1
+        assert again.args.center_position_z == uncached.args.center_position_z
+
+        # Different region must not hit
+        CTGeometry(args).optimize_args(region=[-20., 0., 1.], cache=cache)
+        assert cache.misses == 2
+
+
+def test_make_slots():
+    assert make_slots([0, 1], [10, 5]) == [(0, 10), (1, 5)]
+    assert make_slots([0, 1], [10, 0]) == [(0, 10)]
+    assert make_slots([0, 2], [10, 5], num_gpu_threads=2) == [(0, 5), (0, 5), (2, 2), (2, 3)]
+
+    with pytest.raises(RuntimeError):
+        make_slots([0], [0])
+
+
+class TestRegionQueue:
+    def test_one(self):
+        queue = RegionQueue((0, 25, 1), [10, 4])
+        assert queue.get(0) == (0, [0, 10, 1])
+        assert queue.get(1) == (1, [10, 14, 1])
+        assert queue.get(1) == (2, [14, 18, 1])
+        # The rest does not saturate the slot
+        assert queue.get(0) == (3, [18, 25, 1])
+        assert queue.get(0) is None
+        assert queue.get(1) is None
+
+    def test_many(self):
+        queue = RegionQueue((0, 25, 1), [10, 10], data_splitting_policy='many')
+        assert queue.get(0) == (0, [0, 10, 1])
+        # 15 remaining slices are split between both slots
+        assert queue.get(1) == (1, [10, 18, 1])
+        assert queue.get(0) == (2, [18, 25, 1])
+        assert queue.get(1) is None
+
+    def test_step(self):
+        queue = RegionQueue((-2., 2., 0.5), [3])
+        regions = []
+        item = queue.get(0)
+        while item:
+            regions.append(item[1])
+            item = queue.get(0)
+        assert regions == [[-2., -0.5, 0.5], [-0.5, 1., 0.5], [1., 2., 0.5]]
+
+    def test_abort(self):
+        queue = RegionQueue((0, 25, 1), [10])
+        queue.abort()
+        assert queue.get(0) is None
+
+    def test_done(self):
+        done = np.zeros(25, dtype=bool)
+        done[5:12] = True
+        done[20:] = True
+        queue = RegionQueue((0, 25, 1), [10], done=done)
+        assert len(queue) == 13
+        assert queue.get(0) == (0, [0, 5, 1])
+        assert queue.get(0) == (1, [12, 20, 1])
+        assert queue.get(0) is None
+
+
+class ListWriter:
+    def __init__(self):
+        self.data = []
+        self.closed = False
+
+    def write(self, data, contiguous=False):
+        self.data.append(data.copy())
+
+    def close(self):
+        self.closed = True
+
+
+class TestAsyncWriter:
+    def test_in_order(self):
+        writer = AsyncWriter(ListWriter(), num_buffers=2)
+        for sequence in range(3):
+            for i in range(4):
+                writer.put(sequence, np.full((2, 3), sequence * 4 + i, dtype=np.float32))
+            writer.finish(sequence)
+        writer.close()
+
+        assert writer.writer.closed
+        assert [data[0, 0] for data in writer.writer.data] == list(range(12))
+
+    def test_out_of_order(self, tmpdir):
+        writer = AsyncWriter(ListWriter(), num_buffers=2, scratch_dir=str(tmpdir))
+
+        def produce(sequence, event, next_event):
+            # Region 2 is complete, region 1 is half-way done when region 0 starts
+            if sequence == 1:
+                writer.put(sequence, np.full((2, 3), 3, dtype=np.float32))
+                next_event.set()
+                event.wait()
+                writer.put(sequence, np.full((2, 3), 4, dtype=np.float32))
+            else:
+                event.wait()
+                for i in range(3):
+                    writer.put(sequence, np.full((2, 3), sequence * 3 + i, dtype=np.float32))
+                next_event.set()
+            writer.finish(sequence)
+
+        events = [threading.Event() for i in range(4)]
+        events[0].set()
+        threads = [threading.Thread(target=produce, args=(2, events[0], events[1])),
+                   threading.Thread(target=produce, args=(1, events[1], events[2])),
+                   threading.Thread(target=produce, args=(0, events[2], events[3]))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        assert [data[0, 0] for data in writer.writer.data] == [0, 1, 2, 3, 4, 6, 7, 8]
+
+    def test_tiff_writer(self, tmpdir):
+        tifffile = pytest.importorskip('tifffile')
+        filename = str(tmpdir.join('slices.tif'))
+        writer = AsyncWriter(tifffile.TiffWriter(filename), num_buffers=2)
+        for sequence in range(2):
+            for i in range(3):
+                writer.put(sequence, np.full((4, 5), sequence * 3 + i, dtype=np.float32))
+            writer.finish(sequence)
+        writer.close()
+
+        data = tifffile.imread(filename)
+        assert data.shape == (6, 4, 5)
+        np.testing.assert_equal(data[:, 0, 0], np.arange(6))
+
+    def test_error(self):
+        class FailingWriter(ListWriter):
+            def write(self, data, contiguous=False):
+                raise OSError('disk full')
+
+        writer = AsyncWriter(FailingWriter(), num_buffers=1)
+        for i in range(3):
+            writer.put(0, np.zeros(2))
+        writer.finish(0)
+
+        with pytest.raises(RuntimeError):
+            writer.close()
+
+
+class FakeGpu:
+    def __init__(self, memory):
+        self.memory = memory
+
+    def get_info(self, info):
+        return self.memory
+
+
+class TestMemoryModel:
+    def test_projection_memory(self):
+        def get_memory(**kwargs):
+            stages = estimate_projection_memory(make_args(**kwargs))
+            return sum(nbytes for (name, nbytes) in stages)
+
+        plain = get_memory()
+        assert get_memory(energy=20., propagation_distance=[0.1]) > plain
+        assert get_memory(burst=64) > plain
+        # Filtering in the Fourier space needs padded complex buffers
+        assert get_memory(projection_filter='none') < plain
+
+    def test_median_flats(self, tmpdir):
+        for name in ['darks', 'flats']:
+            directory = tmpdir.mkdir(name)
+            for i in range(10):
+                directory.join('{:02}.tif'.format(i)).write('')
+
+        def get_stages(mode, flat_cache_dir=None):
+            args = make_args(darks=str(tmpdir.join('darks')), flats=str(tmpdir.join('flats')),
+                             reduction_mode=mode, flat_cache_dir=flat_cache_dir)
+            return dict(estimate_projection_memory(args))
+
+        median = get_stages('median')
+        assert median['stack'] == 20 * 256 * 128 * 4
+        assert 'stack' not in get_stages('average')
+        # Cached reduced images are read directly
+        assert 'stack' not in get_stages('median', flat_cache_dir=str(tmpdir.join('cache')))
+
+    def test_region_projection_memory(self):
+        def get_memory(stages):
+            return sum(nbytes for (name, nbytes) in stages)
+
+        slice_size = 128 * 128 * 4
+        gpus = [FakeGpu(200 * slice_size)]
+        regions = ([-64, 64, 1], [-64, 64, 1], [-64., 64., 1.], 4)
+        args = make_args(dry_run=True, region=[-64., 64., 1.])
+        full = get_memory(estimate_projection_memory(args))
+        memory = get_memory(estimate_region_projection_memory(args, gpus, *regions))
+        assert memory < full
+        # The regions with the slices which fit are not taller than the estimated projections
+        slices = get_slices_per_device(gpus, *regions[:2], 4, projection_memory=memory,
+                                       slice_memory_coeff=args.slice_memory_coeff)
+        height = get_region_projection_height(args, regions[2], slices[0])
+        assert get_memory(estimate_projection_memory(args, width=256, height=height)) <= memory
+        # Projections are not cropped
+        args.disable_projection_crop = True
+        assert get_memory(estimate_region_projection_memory(args, gpus, *regions)) == full
+
+    def test_slices_per_device(self):
+        slice_size = 128 * 128 * 4
+        gpus = [FakeGpu(1000 * slice_size), FakeGpu(500 * slice_size)]
+        assert get_slices_per_device(gpus, [-64, 64, 1], [-64, 64, 1], 4,
+                                     slice_memory_coeff=0.5) == [500, 250]
+        assert get_slices_per_device(gpus, [-64, 64, 1], [-64, 64, 1], 4, slice_memory_coeff=0.5,
+                                     projection_memory=100 * slice_size,
+                                     num_gpu_threads=2) == [300, 50]
+        assert get_slices_per_device(gpus, [-64, 64, 1], [-64, 64, 1], 4, slice_memory_coeff=0.5,
+                                     projection_memory=200 * slice_size,
+                                     num_gpu_threads=2) == [100, 0]
+
+
+class TestTuning:
+    def test_candidates(self):
+        candidates = get_tuning_candidates({1: [8, 0], 2: [6, 0]}, 1)
+        assert ([8, 0], 1, 'one') in candidates
+        assert ([2, 0], 1, 'one') in candidates
+        assert ([3, 0], 2, 'one') in candidates
+        # Less slices than threads
+        assert ([1, 0], 2, 'one') not in candidates
+        assert all(policy == 'one' for (slices, threads, policy) in candidates)
+        assert ([8, 4], 1, 'many') in get_tuning_candidates({1: [8, 4]}, 2)
+
+    def test_database(self, tmpdir):
+        filename = str(tmpdir.join('tuning', 'db.json'))
+        database = TuningDatabase(filename=filename)
+        entry = {'slices_fraction': [0.5], 'num_gpu_threads': 2, 'data_splitting_policy': 'one',
+                 'gups': 10.}
+        database.put('GPU:256x128x300', entry)
+        database.save()
+
+        assert TuningDatabase(filename=filename).get('GPU:256x128x300') == entry
+        assert TuningDatabase(filename=filename).get('GPU:256x128x301') is None
+
+    def test_apply_tuning(self):
+        slice_size = 128 * 128 * 4
+        args = make_args()
+        entry = {'slices_fraction': [0.5, 0.25], 'num_gpu_threads': 2,
+                 'data_splitting_policy': 'many', 'gups': 10.}
+        gpus = [FakeGpu(1000 * slice_size), FakeGpu(1000 * slice_size)]
+        apply_tuning(args, gpus, [-64, 64, 1], [-64, 64, 1], 4, 0, entry)
+        assert args.slices_per_device == [400, 200]
+        assert args.num_gpu_threads == 2
+        assert args.data_splitting_policy == 'many'
+
+    def test_apply_tuning_explicit(self):
+        slice_size = 128 * 128 * 4
+        entry = {'slices_fraction': [0.5], 'num_gpu_threads': 2,
+                 'data_splitting_policy': 'many', 'gups': 10.}
+        gpus = [FakeGpu(1000 * slice_size)]
+        # Explicit data splitting policy is kept
+        args = make_args(data_splitting_policy='many')
+        entry['data_splitting_policy'] = 'one'
+        apply_tuning(args, gpus, [-64, 64, 1], [-64, 64, 1], 4, 0, entry)
+        assert args.data_splitting_policy == 'many'
+        assert args.num_gpu_threads == 2
+        assert args.slices_per_device == [400]
+        # Tuned slices do not fit the explicit number of GPU threads
+        args = make_args(num_gpu_threads=3)
+        apply_tuning(args, gpus, [-64, 64, 1], [-64, 64, 1], 4, 0, entry)
+        assert args.num_gpu_threads == 3
+        assert args.slices_per_device is None
+        assert args.data_splitting_policy == 'one'
+
+
+class TestSharedProjectionReader:
+    def make_projections(self, tmpdir, compression=None):
+        tifffile = pytest.importorskip('tifffile')
+        for i in range(4):
+            tifffile.imwrite(str(tmpdir.join('proj-{}.tif'.format(i))),
+                             np.full((4, 5), i, dtype=np.uint16), compression=compression)
+        tifffile.imwrite(str(tmpdir.join('proj-4.tif')),
+                         np.arange(4, 7, dtype=np.uint16)[:, np.newaxis, np.newaxis] *
+                         np.ones((3, 4, 5), dtype=np.uint16), photometric='minisblack',
+                         compression=compression)
+
+        return str(tmpdir.join('proj-*.tif'))
+
+    def test_frames(self, tmpdir):
+        args = make_args(projections=self.make_projections(tmpdir), start=1, step=2, number=3)
+        frames = get_projection_frames(args)
+        expected = [('proj-1.tif', None), ('proj-3.tif', None), ('proj-4.tif', 1)]
+        assert [(name[-10:], page) for name, page in frames] == expected
+
+    def test_read(self, tmpdir):
+        args = make_args(projections=self.make_projections(tmpdir, compression='zlib'), number=7)
+        reader = SharedProjectionReader(get_projection_frames(args), read_ahead=2, max_frames=4)
+        # Two concurrent consumers
+        for i in range(len(reader)):
+            for consumer in range(2):
+                frame = reader.get(i)
+                assert frame.dtype == np.float32
+                assert frame.shape == (4, 5)
+                assert np.all(frame == i)
+        reader.close()
+
+        assert reader.reads == 7
+        assert reader.hits == 13
+        assert reader.rereads == 0
+
+    def test_reread(self, tmpdir):
+        args = make_args(projections=self.make_projections(tmpdir, compression='zlib'), number=7)
+        reader = SharedProjectionReader(get_projection_frames(args), read_ahead=0, max_frames=2)
+        # The second consumer starts when the first one is done, the first frames are gone
+        for consumer in range(2):
+            for i in range(len(reader)):
+                reader.get(i)
+        reader.close()
+
+        assert reader.reads == 14
+        assert reader.rereads == 7
+
+    def test_feed_error(self, monkeypatch):
+        import sys
+        import types
+        ufo = types.ModuleType('ufo')
+        ufo.numpy = types.ModuleType('ufo.numpy')
+        monkeypatch.setitem(sys.modules, 'ufo', ufo)
+        monkeypatch.setitem(sys.modules, 'ufo.numpy', ufo.numpy)
+
+        class Reader(object):
+            def __len__(self):
+                return 3
+
+            def get(self, index, rows=None):
+                raise OSError('Broken file')
+
+        class Input(object):
+            stopped = False
+
+            def stop(self):
+                self.stopped = True
+
+        executor = Executor.__new__(Executor)
+        executor.projection_reader = Reader()
+        executor.input = Input()
+        executor.abort_requested = False
+        executor.feed_error = None
+        executor.timings = {'projection_wait': 0}
+        executor.region = [0, 1, 1]
+        executor.feed(0, 1, 1)
+        # The graph gets the end of the stream and the error is kept for process()
+        assert executor.input.stopped
+        assert isinstance(executor.feed_error, OSError)
+
+    def test_read_mapped(self, tmpdir):
+        args = make_args(projections=self.make_projections(tmpdir), number=7)
+        reader = SharedProjectionReader(get_projection_frames(args), read_ahead=2, max_frames=4)
+        for i in range(len(reader)):
+            frame = reader.get(i, rows=slice(1, 4, 2))
+            assert frame.dtype == np.float32
+            assert frame.shape == (2, 5)
+            assert np.all(frame == i)
+        reader.close()
+
+        # Uncompressed projections are not decoded and cached
+        assert reader.reads == 0
+
+    def test_profile(self, tmpdir):
+        args = make_args(projections=self.make_projections(tmpdir), number=7)
+        profiler = Profiler(str(tmpdir.join('profile.json')))
+        reader = SharedProjectionReader(get_projection_frames(args), read_ahead=0,
+                                        profiler=profiler)
+        for i in range(len(reader)):
+            reader.get(i)
+        reader.close()
+        assert profiler.counters['read-bytes'] == 7 * 4 * 5 * 4
+        assert profiler.get_summary()['read_bytes_per_second'] > 0
+
+
+class TestResume:
+    def test_manifest(self, tmpdir):
+        filename = str(tmpdir.join('out.manifest.json'))
+        manifest = ResumeManifest(filename, 'key')
+        manifest.add(0, [0., 10., 1.], 0, 10, 30)
+        manifest.add(1, [20., 25., 1.], 20, 5, 30)
+
+        resumed = ResumeManifest(filename, 'key')
+        assert len(resumed) == 2
+        done = resumed.get_done_slices(30)
+        assert np.count_nonzero(done) == 15
+        assert done[20:25].all() and not done[10:20].any()
+        resumed.validate(lambda entry: entry['gpu'] == 1)
+        assert [entry['offset'] for entry in resumed.entries] == [20]
+
+        # Different settings must not be resumed
+        assert len(ResumeManifest(filename, 'other-key')) == 0
+
+    @pytest.mark.parametrize('resume', [False, True])
+    def test_reconstruct_manifest(self, tmpdir, monkeypatch, resume):
+        from tofu import genreco
+        args = make_args(output=str(tmpdir.join('volume.h5')), resume=resume)
+        x_region = y_region = [-64, 64, 1]
+        z_region = [0, 30, 1]
+        filename = args.output + '.manifest.json'
+        ResumeManifest(filename, get_resume_key(args, x_region, y_region, z_region)).add(
+            0, [0., 10., 1.], 0, 10, 30)
+        calls = []
+
+        def run(resources, args, x_region, y_region, z_region, region_queue, slots, vol_nbytes,
+                manifest=None, **kwargs):
+            calls.append((manifest, np.count_nonzero(region_queue._todo)))
+            return 0
+
+        monkeypatch.setattr(genreco, '_run', run)
+        genreco._reconstruct(args, [0], [30], x_region, y_region, z_region, 0)
+        manifest, num_todo = calls[0]
+        # Finished regions are recorded also without --resume, but skipped only with it
+        assert manifest is not None
+        assert len(manifest) == (1 if resume else 0)
+        assert num_todo == (20 if resume else 30)
+        assert os.path.exists(filename) == resume
+
+    def test_single_file(self, tmpdir):
+        tifffile = pytest.importorskip('tifffile')
+        args = make_args(output=str(tmpdir.join('slices.tif')))
+        writer = SidecarWriter(lambda offset: get_sidecar_filename(args, offset, 30))
+        offsets = [10, 0, 20]
+        for offset in offsets:
+            region = writer.region(offset)
+            for i in range(offset, offset + 10):
+                region.save(np.full((128, 128), i, dtype=np.float32))
+            region.close()
+
+        entry = {'offset': 10, 'num_slices': 10, 'num_total': 30}
+        assert is_region_output_complete(args, entry, [-64, 64, 1], [-64, 64, 1])
+        assert not is_region_output_complete(args, dict(entry, num_slices=11),
+                                             [-64, 64, 1], [-64, 64, 1])
+        assert not is_region_output_complete(args, dict(entry, offset=5),
+                                             [-64, 64, 1], [-64, 64, 1])
+
+        merge_sidecars(args, offsets, 30)
+        data = tifffile.imread(args.output)
+        np.testing.assert_equal(data[:, 0, 0], np.arange(30))
+        assert not tmpdir.join('slices.tif.parts').exists()
+
+    @pytest.mark.parametrize('output', ['slices.tif', 'slices/slice'])
+    def test_remove_stale_output(self, tmpdir, output):
+        args = make_args(output=str(tmpdir.join(output)))
+        single = is_output_single_file(args)
+        filenames = {}
+        for offset in [0, 10, 20]:
+            if single:
+                filenames[offset] = [get_sidecar_filename(args, offset, 30)]
+            else:
+                filenames[offset] = ['{}-{:03}-{:04}.tif'.format(args.output, offset, i)
+                                     for i in range(2)]
+        # Left over by an interrupted region
+        filenames[None] = [filenames[20][0] + '.tmp.tif'] if single else []
+        for names in filenames.values():
+            for filename in names:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                open(filename, 'w').close()
+
+        removed = remove_stale_region_output(args, [10, 0], 30)
+        assert sorted(removed) == sorted(filenames[20] + filenames[None])
+        for offset in [0, 10]:
+            assert all(os.path.exists(filename) for filename in filenames[offset])
+
+    def test_resume_key(self):
+        x_region = y_region = [-64, 64, 1]
+        args = make_args()
+        key = get_resume_key(args, x_region, y_region, [0, 10, 1])
+        assert get_resume_key(make_args(num_gpu_threads=2), x_region, y_region,
+                              [0, 10, 1]) == key
+        assert get_resume_key(args, x_region, y_region, [0, 11, 1]) != key
+        assert get_resume_key(make_args(axis_angle_x=[1.]), x_region, y_region,
+                              [0, 10, 1]) != key
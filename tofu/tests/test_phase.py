@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from tofu import config
+from tofu.phase import (get_padded_shape, get_phase_filter, get_phase_parameters, get_wavelength,
+                        pad_images, retrieve_phase, retrieve_phase_from_args)
+
+
+def make_args(**kwargs):
+    args = config.Params(sections=('retrieve-phase',)).get_defaults()
+    args.energy = 20
+    args.propagation_distance = (0.1,)
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+
+    return args
+
+
+def get_ufo_filter(parameters, padded_shape):
+    """Full complex filter computed like the retrieve-phase kernels of ufo-filters."""
+    height, width = padded_shape
+    idy, idx = np.mgrid[:height, :width].astype(float)
+    idx = np.where(idx >= width // 2, idx - width, idx) / width
+    idy = np.where(idy >= height // 2, idy - height, idy) / height
+    prefactor = np.pi * get_wavelength(parameters.energy) / parameters.pixel_size ** 2
+    argument = (prefactor * parameters.distance[0] * idx ** 2 +
+                prefactor * parameters.distance[1] * idy ** 2)
+    regularization = 10 ** -parameters.regularization_rate
+    sine = np.sin(argument)
+    if parameters.method == 'tie':
+        result = 0.5 / (argument + regularization)
+    else:
+        result = 0.5 * np.sign(sine) / (np.abs(sine) + regularization)
+    binary = (argument > np.pi / 2) & (np.abs(sine) < parameters.thresholding_rate)
+    if parameters.method == 'qp':
+        result[binary] = 0
+    elif parameters.method == 'qp2':
+        denominator = parameters.thresholding_rate + regularization
+        result[binary] = 0.5 * np.sign(sine[binary]) / denominator
+    result[argument >= parameters.frequency_cutoff] = 0
+
+    return result
+
+
+def test_get_phase_parameters():
+    parameters = get_phase_parameters(make_args(), regularization_rate=3)
+    assert parameters.distance == (0.1, 0.1)
+    assert parameters.regularization_rate == 3
+    assert get_phase_parameters(make_args(propagation_distance=(0.1, 0.2))).distance == (0.1, 0.2)
+    with pytest.raises(RuntimeError):
+        get_phase_parameters(make_args(energy=None))
+
+
+def test_get_padded_shape():
+    assert get_padded_shape((100, 200)) == (256, 512)
+    assert get_padded_shape((100, 200), (0, 300)) == (256, 300)
+
+
+def test_get_phase_filter():
+    parameters = get_phase_parameters(make_args())
+    phase_filter = get_phase_filter(parameters, (32, 64))
+    assert phase_filter.shape == (32, 33)
+    assert not phase_filter.flags.writeable
+    # Cached per parameters and shape
+    assert get_phase_filter(parameters, (32, 64)) is phase_filter
+    other = parameters._replace(regularization_rate=3)
+    assert get_phase_filter(other, (32, 64)) is not phase_filter
+
+
+def test_pad_images():
+    images = np.arange(6, dtype=np.float32).reshape(1, 2, 3)
+    padded, position = pad_images(images, (4, 7), padding_mode='none')
+    assert position == (1, 2)
+    assert padded.shape == (1, 4, 7)
+    np.testing.assert_array_equal(padded[0, 1:3, 2:5], images[0])
+    assert padded.sum() == images.sum()
+
+
+@pytest.mark.parametrize('method', ['tie', 'ctf', 'qp', 'qp2'])
+def test_retrieve_phase(method):
+    rng = np.random.default_rng(0)
+    images = rng.uniform(0.5, 1, size=(3, 20, 30)).astype(np.float32)
+    args = make_args(retrieval_method=method, pixel_size=1e-7, propagation_distance=(0.5,),
+                     retrieval_padded_width=64, retrieval_padded_height=32,
+                     retrieval_padding_mode='mirrored_repeat')
+    parameters = get_phase_parameters(args)
+    result = retrieve_phase_from_args(images, args, batch_size=2, num_workers=2)
+    assert result.shape == images.shape
+    assert result.dtype == np.float32
+
+    # Full complex transform like the UFO pipeline
+    padded = pad_images(images, (32, 64), padding_mode='mirrored_repeat')[0]
+    expected = np.fft.ifft2(np.fft.fft2(padded) * get_ufo_filter(parameters, (32, 64))).real
+    expected = expected[:, 6:26, 17:47]
+    if method == 'tie':
+        rate = 10 ** parameters.regularization_rate
+        expected = np.log(2 / rate * expected) * rate / 2
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+    np.testing.assert_allclose(retrieve_phase(images[0], parameters, padded_shape=(32, 64),
+                                              padding_mode='mirrored_repeat'), result[0],
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_retrieve_phase_thickness():
+    # Constant intensity keeps its value in the TIE filter, delta converts phase to thickness
+    parameters = get_phase_parameters(make_args(delta=1e-7))
+    result = retrieve_phase(np.full((8, 8), 0.5, dtype=np.float32), parameters)
+    rate = 10 ** parameters.regularization_rate
+    expected = np.log(0.5) * rate / 2 * -get_wavelength(20) / (2 * np.pi * 1e-7)
+    np.testing.assert_allclose(result, expected, rtol=1e-4)
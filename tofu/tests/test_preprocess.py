@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from tofu import config
+from tofu.preprocess import (get_flat_cache_dir, get_reduced_image, prune_flat_cache,
+                             reduce_images)
+
+
+tifffile = pytest.importorskip('tifffile')
+
+
+def make_args(**kwargs):
+    args = config.Params(sections=config.PREPROC_PARAMS).get_defaults()
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+
+    return args
+
+
+@pytest.fixture
+def flats(tmpdir):
+    directory = tmpdir.mkdir('flats')
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 1000, size=(5, 10, 8)).astype(np.uint16)
+    for i, image in enumerate(images):
+        tifffile.imwrite(str(directory.join('flat-{}.tif'.format(i))), image)
+
+    return str(directory), images
+
+
+@pytest.mark.parametrize('mode', ['median', 'average'])
+def test_reduce_images(flats, mode):
+    path, images = flats
+    filenames = sorted(os.path.join(path, name) for name in os.listdir(path))
+    reduce_func = np.median if mode == 'median' else np.mean
+    expected = reduce_func(images.astype(np.float32)[:, 2:8:2], axis=0)
+    # Tiny slabs to exercise the slab-wise reduction
+    reduced = reduce_images(filenames, mode, y=2, height=3, y_step=2, slab_size=5 * 8 * 4)
+
+    assert reduced.dtype == np.float32
+    np.testing.assert_allclose(reduced, expected)
+    np.testing.assert_allclose(reduce_images(filenames, mode),
+                               reduce_func(images.astype(np.float32), axis=0))
+
+
+def test_reduced_image_cache(flats, tmpdir):
+    path, images = flats
+    cache_dir = str(tmpdir.join('cache'))
+    cached = get_reduced_image(path, 'median', cache_dir)
+    # Full frames are cached, regions of interest are selected when the entry is read
+    np.testing.assert_allclose(tifffile.imread(cached), np.median(images, axis=0))
+
+    assert get_reduced_image(path, 'median', cache_dir) == cached
+    assert get_reduced_image(path, 'average', cache_dir) != cached
+
+    # Modified input invalidates the entry
+    filename = os.path.join(path, 'flat-0.tif')
+    tifffile.imwrite(filename, np.zeros((10, 8), dtype=np.uint16))
+    os.utime(filename, (0, 0))
+    assert get_reduced_image(path, 'median', cache_dir) != cached
+
+
+def test_flat_cache_dir(tmpdir):
+    # Caching is opt-in
+    assert get_flat_cache_dir(make_args()) is None
+    assert get_flat_cache_dir(make_args(flat_cache_dir=str(tmpdir))) == str(tmpdir)
+
+
+def test_reduced_image_cache_size(flats, tmpdir):
+    path, images = flats
+    cache_dir = str(tmpdir.join('cache'))
+    median = get_reduced_image(path, 'median', cache_dir)
+    average = get_reduced_image(path, 'average', cache_dir)
+    os.utime(median, (0, 0))
+    os.utime(average, (1, 1))
+    # A hit marks the entry as recently used, so the older average entry is removed
+    size = os.path.getsize(median)
+    assert get_reduced_image(path, 'median', cache_dir, max_size=size) == median
+    assert os.path.exists(median)
+    assert not os.path.exists(average)
+    assert prune_flat_cache(cache_dir, 0) == [median]
@@ -0,0 +1,59 @@
+import json
+import os
+import time
+from tofu.profiling import Profiler, get_union_length
+
+
+def test_union_length():
+    assert get_union_length([]) == 0
+    assert get_union_length([(0, 1), (2, 3)]) == 2
+    assert get_union_length([(2, 4), (0, 3), (5, 6)]) == 5
+
+
+def test_summary(tmpdir):
+    profiler = Profiler(str(tmpdir.join('profile.json')))
+    # Two overlapping graphs on GPU 0 and nothing on GPU 1 in the first half
+    profiler.add('graph', 0, 0.5, gpu=0)
+    profiler.add('graph', 0.25, 0.5, gpu=0)
+    profiler.add('graph', 0, 0.25, gpu=1)
+    profiler.add('executor', 0, 0.75, gpu=0, region=[0, 16, 1])
+    with profiler.span('write'):
+        pass
+    profiler.count('read-bytes', 100)
+    profiler.add('read', 0, 0.5)
+    profiler.add('read', 0.25, 0.5)
+    profiler.start = time.perf_counter() - 1
+    summary = profiler.get_summary()
+
+    assert abs(summary['gpu_busy_fraction']['0'] - 0.75) < 0.01
+    assert abs(summary['gpu_busy_fraction']['1'] - 0.25) < 0.01
+    assert summary['read_bytes_per_second'] == 100 / 0.75
+    assert summary['spans']['graph'] == 1.25
+    assert summary['regions'][0]['region'] == [0, 16, 1]
+
+
+def test_write(tmpdir):
+    filename = str(tmpdir.join('profiles', 'profile.json'))
+    profiler = Profiler(filename)
+    with profiler.span('graph', gpu=0):
+        pass
+    profiler.write()
+    with open(filename) as f:
+        trace = json.load(f)
+    assert trace['traceEvents'][0]['name'] == 'graph'
+    assert trace['traceEvents'][0]['ph'] == 'X'
+    assert '0' in trace['summary']['gpu_busy_fraction']
+
+
+def test_merge_ufo_traces(tmpdir):
+    profiler = Profiler(str(tmpdir.join('profile.json')))
+    since = time.time() - 1
+    filename = str(tmpdir.join('trace.{}.json'.format(os.getpid())))
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': [{'name': 'backproject', 'ph': 'B', 'ts': 0, 'pid': 1,
+                                    'tid': 1}]}, f)
+    profiler.merge_ufo_traces('GPU 0 region 0', since, directory=str(tmpdir))
+    # Unchanged files are merged only once
+    profiler.merge_ufo_traces('GPU 0 region 1', since, directory=str(tmpdir))
+    assert len(profiler.events) == 1
+    assert profiler.events[0]['pid'] == 'GPU 0 region 0 trace'
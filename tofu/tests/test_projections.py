@@ -0,0 +1,87 @@
+import os
+import pickle
+import numpy as np
+import pytest
+from tofu.projections import MappedTiffFile, ProjectionSource, get_image_list
+
+
+tifffile = pytest.importorskip('tifffile')
+
+
+def write_pages(filename, images, **kwargs):
+    with tifffile.TiffWriter(filename, **kwargs.pop('writer', {})) as tif:
+        for image in images:
+            tif.write(image, contiguous=False, metadata=None, **kwargs)
+
+
+def make_images(number=3, dtype=np.uint16):
+    return np.arange(number * 4 * 5, dtype=dtype).reshape(number, 4, 5)
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+def test_mapped_tiff_file(tmpdir, bigtiff):
+    filename = str(tmpdir.join('multi.tif'))
+    images = make_images()
+    write_pages(filename, images, writer={'bigtiff': bigtiff})
+    mapped = MappedTiffFile(filename)
+    assert len(mapped) == 3
+    assert all(mapped.is_mapped(i) for i in range(3))
+    for i, image in enumerate(images):
+        np.testing.assert_array_equal(mapped.get(i), image)
+        np.testing.assert_array_equal(mapped.get(i, slice(1, 4, 2)), image[1:4:2])
+    # Views of the file, not copies
+    view = mapped.get(1, slice(2, 3))
+    assert isinstance(view.base, np.memmap) or isinstance(view.base.base, np.memmap)
+    assert not view.flags.writeable
+    mapped.close()
+    np.testing.assert_array_equal(view, images[1, 2:3])
+    copy = pickle.loads(pickle.dumps(mapped))
+    np.testing.assert_array_equal(copy.get(2), images[2])
+
+
+def test_mapped_tiff_file_compressed(tmpdir):
+    filename = str(tmpdir.join('compressed.tif'))
+    images = make_images(dtype=np.float32)
+    write_pages(filename, images, compression='zlib')
+    mapped = MappedTiffFile(filename)
+    assert not mapped.is_mapped(0)
+    np.testing.assert_array_equal(mapped.get(2, slice(0, 2)), images[2, :2])
+
+
+def test_projection_source(tmpdir):
+    images = make_images(number=5)
+    write_pages(str(tmpdir.join('a.tif')), images[:3])
+    tifffile.imwrite(str(tmpdir.join('b.tif')), images[3])
+    tifffile.imwrite(str(tmpdir.join('c.tif')), images[4], compression='zlib')
+    assert get_image_list(str(tmpdir), start=1, step=2) == [(str(tmpdir.join('a.tif')), 1),
+                                                            (str(tmpdir.join('b.tif')), None)]
+    source = ProjectionSource.from_path(str(tmpdir))
+    assert len(source) == 5
+    assert source.shape == (4, 5)
+    assert [source.is_mapped(i) for i in range(5)] == [True] * 4 + [False]
+    for i, image in enumerate(images):
+        np.testing.assert_array_equal(source[i], image)
+        np.testing.assert_array_equal(source[i, 2], image[2])
+    source.close()
+
+
+def test_projection_source_open_files(tmpdir):
+    resource = pytest.importorskip('resource')
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('Open file descriptors cannot be counted')
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = len(os.listdir('/proc/self/fd')) + 32
+    images = make_images(number=limit + 16)
+    for i, image in enumerate(images):
+        tifffile.imwrite(str(tmpdir.join('image-{:04}.tif'.format(i))), image)
+    source = ProjectionSource.from_path(str(tmpdir), max_mapped_files=16)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    try:
+        # More files than we may open at once
+        for i, image in enumerate(images):
+            np.testing.assert_array_equal(source[i, 1], image[1])
+        assert source.is_mapped(0)
+        np.testing.assert_array_equal(source[0], images[0])
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    source.close()
@@ -0,0 +1,71 @@
+import argparse
+import sys
+import types
+import numpy as np
+import pytest
+
+
+pytest.importorskip('gi')
+
+
+class FakeGraph(object):
+    """Ufo task, graph and scheduler stand-in which outputs one slice of the backprojection region
+    per center.
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.num_projections = 0
+
+    def get_task(self, name, **kwargs):
+        task = types.SimpleNamespace(props=types.SimpleNamespace(**kwargs))
+        self.tasks[name] = task
+        return task
+
+    def connect_nodes(self, source, dest):
+        pass
+
+    def run(self, graph):
+        pass
+
+    def get_input_buffer(self):
+        return None
+
+    def release_input_buffer(self, buf):
+        self.num_projections += 1
+
+    def stop(self):
+        pass
+
+    def get_output_buffer(self):
+        props = self.tasks['general-backproject'].props
+        return np.zeros((len(range(*props.y_region)), len(range(*props.x_region))))
+
+    def release_output_buffer(self, buf):
+        pass
+
+
+@pytest.mark.parametrize('width', [6, 7])
+def test_reconstruct_axis_candidates(monkeypatch, width):
+    from tofu import reco
+    fake = FakeGraph()
+    ufo = types.ModuleType('ufo')
+    ufo.numpy = types.ModuleType('ufo.numpy')
+    ufo.numpy.asarray = np.asarray
+    ufo.numpy.fromarray = np.array
+    ufo.numpy.fromarray_inplace = lambda buf, array: None
+    monkeypatch.setitem(sys.modules, 'ufo', ufo)
+    monkeypatch.setitem(sys.modules, 'ufo.numpy', ufo.numpy)
+    monkeypatch.setattr(reco, 'Ufo', types.SimpleNamespace(TaskGraph=lambda: fake,
+                                                           InputTask=lambda: fake,
+                                                           OutputTask=lambda: fake))
+    monkeypatch.setattr(reco, 'get_scheduler', lambda: fake)
+    monkeypatch.setattr(reco, 'get_task', fake.get_task)
+    params = argparse.Namespace(angle=None, projection_filter='ramp-fromreal',
+                                projection_filter_cutoff=0.5)
+
+    result = reco.reconstruct_axis_candidates(np.ones((4, width)), [2., 2.5, 3.], params)
+    assert result.shape == (3, width, width)
+    assert fake.num_projections == 4
+    props = fake.tasks['general-backproject'].props
+    # Centered region of exactly *width* pixels also for odd widths
+    assert props.x_region == props.y_region == [-(width // 2), width - width // 2, 1]
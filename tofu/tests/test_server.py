@@ -0,0 +1,54 @@
+import argparse
+import os
+import pytest
+from tofu import server
+from tofu.server import Client, Server
+
+
+@pytest.fixture
+def tofu_server(tmpdir, monkeypatch):
+    calls = []
+
+    def record(args):
+        calls.append((os.getcwd(), args))
+        if args.fail:
+            raise RuntimeError('Failed')
+        return args.value * 2
+
+    monkeypatch.setitem(server.COMMANDS, 'record', record)
+    address = str(tmpdir.join('tofu.sock'))
+    instance = Server(address, task_names=None)
+    instance.start()
+    yield instance, calls
+    instance.stop()
+
+
+def test_run(tofu_server, tmpdir):
+    instance, calls = tofu_server
+    client = Client(instance.address, timeout=10)
+    directory = tmpdir.mkdir('data')
+    with directory.as_cwd():
+        for i in range(3):
+            args = argparse.Namespace(value=i, fail=False, _func=test_run)
+            assert client.run('record', args) == 2 * i
+    assert instance.num_commands == 3
+    # Commands run in the client's directory, callables are not sent
+    assert calls[0][0] == str(directory)
+    assert not hasattr(calls[0][1], '_func')
+    assert os.getcwd() != str(directory)
+
+
+def test_errors(tofu_server):
+    instance, calls = tofu_server
+    client = Client(instance.address, timeout=10)
+    with pytest.raises(RuntimeError, match='Failed'):
+        client.run('record', argparse.Namespace(value=1, fail=True))
+    with pytest.raises(RuntimeError, match='cannot be run'):
+        client.run('lamino', argparse.Namespace())
+    # The server keeps running after failed commands
+    assert client.run('record', argparse.Namespace(value=1, fail=False)) == 2
+
+
+def test_no_server(tmpdir):
+    with pytest.raises(RuntimeError, match='Cannot connect'):
+        Client(str(tmpdir.join('missing.sock'))).run('tomo', argparse.Namespace())
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from tofu import config
+from tofu.sinos import SinogramBuffers, generate_sinograms, get_passes
+
+
+tifffile = pytest.importorskip('tifffile')
+
+
+def make_args(tmpdir, **kwargs):
+    """Write 6 projections 10 x 4 with darks and flats and get sinogram generation arguments."""
+    rng = np.random.default_rng(0)
+    dark = np.full((10, 4), 10, dtype=np.float32)
+    flat = np.full((10, 4), 1010, dtype=np.float32)
+    projections = dark + 1000 * rng.uniform(0.1, 1, size=(6, 10, 4)).astype(np.float32)
+    for name, images in (('darks', [dark]), ('flats', [flat] * 2), ('projections', projections)):
+        directory = tmpdir.mkdir(name)
+        for i, image in enumerate(images):
+            tifffile.imwrite(str(directory.join('{:04}.tif'.format(i))), image)
+    args = config.Params(sections=('flat-correction', 'sinos', 'volume-output')).get_defaults()
+    args.projections = str(tmpdir.join('projections'))
+    args.darks = str(tmpdir.join('darks'))
+    args.flats = str(tmpdir.join('flats'))
+    args.absorptivity = True
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+    expected = -np.log((projections - dark) / (flat - dark)).transpose(1, 0, 2)
+
+    return args, expected
+
+
+def test_get_passes():
+    assert get_passes(10) == [(0, 10)]
+    assert get_passes(10, 4) == [(0, 4), (4, 8), (8, 10)]
+
+
+def test_sinogram_buffers(tmpdir):
+    # Only the first pass fits into memory
+    buffers = SinogramBuffers(get_passes(5, 2), 3, 4, 2 * 3 * 4 * 4, directory=str(tmpdir))
+    assert buffers.num_mapped == 2
+    for i in range(3):
+        buffers.scatter(i, np.full((5, 4), i))
+    np.testing.assert_array_equal(np.concatenate(buffers.buffers)[:, :, 0], [[0, 1, 2]] * 5)
+    buffers.close()
+    assert tmpdir.listdir() == []
+
+
+def test_generate_sinograms(tmpdir, monkeypatch):
+    from tofu.projections import ProjectionSource
+
+    reads = []
+    get = ProjectionSource.get
+
+    def record(self, index, rows=None):
+        reads.append(index)
+        return get(self, index, rows=rows)
+
+    monkeypatch.setattr(ProjectionSource, 'get', record)
+    output = str(tmpdir.join('sinos', 'sino-%05i.tif'))
+    args, expected = make_args(tmpdir, output=output, pass_size=2, y=1, y_step=2,
+                               sinogram_memory=0, num_readers=2,
+                               output_bytes_per_file=0)
+
+    assert generate_sinograms(args) > 0
+    # Every projection is read once no matter how many passes there are
+    assert sorted(reads) == list(range(6))
+    assert len(tmpdir.join('sinos').listdir()) == 5
+    for i, sinogram in enumerate(expected[1::2]):
+        np.testing.assert_allclose(tifffile.imread(output % i), sinogram, rtol=1e-5)
+
+
+def test_generate_sinograms_volume(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    output = str(tmpdir.join('sinos.h5'))
+    args, expected = make_args(tmpdir, output=output, pass_size=3, output_chunk_slices=2)
+
+    generate_sinograms(args)
+    with h5py.File(output, 'r') as f:
+        np.testing.assert_allclose(f['volume'][:], expected, rtol=1e-5)
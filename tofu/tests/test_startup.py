@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import pytest
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+TOFU = os.path.join(ROOT, 'bin', 'tofu')
+# Cumulative import time of `tofu tomo --help` [s], it is about 0.07 s without the heavy modules
+IMPORT_TIME_BUDGET = 0.3
+HEAVY_MODULES = ('gi', 'numpy', 'scipy', 'tifffile', 'h5py', 'zarr', 'PyQt5', 'pyqtgraph')
+
+
+def get_import_times(*args):
+    """Run bin/tofu with *args* by a new interpreter with -X importtime and return a dictionary
+    {module: (cumulative import time in s, imported by another module)} of all imported modules.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    process = subprocess.run([sys.executable, '-X', 'importtime', TOFU] + list(args),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+                             cwd=ROOT, universal_newlines=True)
+    assert process.returncode == 0
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        cumulative, name = line.split('|')[1:]
+        # Nested imports are indented
+        times[name.strip()] = (int(cumulative) * 1e-6, name.startswith('  '))
+
+    return times
+
+
+@pytest.mark.skipif(not os.path.exists(TOFU), reason='bin/tofu not available')
+def test_tomo_help_startup():
+    times = get_import_times('tomo', '--help')
+    heavy = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+    assert heavy == []
+    total = sum(cumulative for (cumulative, nested) in times.values() if not nested)
+    assert total < IMPORT_TIME_BUDGET, 'Import time {:.3f} s exceeds budget'.format(total)
+
+
+@pytest.mark.skipif(not os.path.exists(TOFU), reason='bin/tofu not available')
+def test_command_after_option_value():
+    # Value of a top-level option equal to another command name must not select its parser
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    process = subprocess.run([sys.executable, TOFU, '--config', 'perf', 'tomo', '--help'],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, cwd=ROOT,
+                             universal_newlines=True)
+    assert process.returncode == 0
+    assert '--projections' in process.stdout
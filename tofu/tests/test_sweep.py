@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from tofu import config
+from tofu.cpu import reconstruct_slices
+from tofu.phase import get_phase_parameters, retrieve_phase
+from tofu.sweep import get_sweep_parameters, sweep
+from tofu.tests.test_cpu import make_shifted_disk_sinograms
+
+
+tifffile = pytest.importorskip('tifffile')
+h5py = pytest.importorskip('h5py')
+
+
+def make_args(**kwargs):
+    args = config.Params(sections=config.SWEEP_PARAMS).get_defaults()
+    args.energy = 20
+    args.propagation_distance = (0.1,)
+    args.pixel_size = 1e-7
+    args.axis = 33.5
+    for name, value in kwargs.items():
+        setattr(args, name, value)
+
+    return args
+
+
+def test_get_sweep_parameters():
+    args = make_args(sweep_parameter='propagation-distance')
+    parameters = get_sweep_parameters(args, [0.1, 0.2])
+    assert [item.distance for item in parameters] == [(0.1, 0.1), (0.2, 0.2)]
+    assert parameters[0].regularization_rate == args.regularization_rate
+
+
+def test_sweep(tmpdir):
+    # 8 rows of 30 projections of a weakly absorbing disk
+    intensities = np.exp(-make_shifted_disk_sinograms(num_slices=8, num_projections=30) / 100)
+    projections = 1000 * intensities.transpose(1, 0, 2)
+    for name, images in (('darks', [np.zeros((8, 64))]), ('flats', [np.full((8, 64), 1000)]),
+                         ('projections', projections)):
+        directory = tmpdir.mkdir(name)
+        for i, image in enumerate(images):
+            tifffile.imwrite(str(directory.join('{:04}.tif'.format(i))), image.astype(np.float32))
+    output = str(tmpdir.join('sweep.h5'))
+    args = make_args(projections=str(tmpdir.join('projections')),
+                     darks=str(tmpdir.join('darks')), flats=str(tmpdir.join('flats')),
+                     output=output, sweep_region=(1.5, 3, 1), sweep_rows=(2, 5), cpu_workers=2)
+
+    assert sweep(args) > 0
+    with h5py.File(output, 'r') as f:
+        slices = f['volume'][:]
+        assert list(f['volume'].attrs['sweep_values']) == [1.5, 2.5]
+    assert slices.shape == (4, 64, 64)
+    for i, rate in enumerate([1.5, 2.5]):
+        retrieved = retrieve_phase(intensities.transpose(1, 0, 2),
+                                   get_phase_parameters(args, regularization_rate=rate))
+        expected = reconstruct_slices(retrieved[:, [2, 5]].transpose(1, 0, 2), 33.5)
+        np.testing.assert_allclose(slices[2 * i:2 * i + 2], expected, rtol=1e-4,
+                                   atol=1e-4 * np.abs(expected).max())
+    assert not np.allclose(slices[:2], slices[2:])
+
+
+def test_sweep_rows_outside(tmpdir):
+    directory = tmpdir.mkdir('projections')
+    tifffile.imwrite(str(directory.join('0.tif')), np.ones((8, 16), dtype=np.float32))
+    with pytest.raises(RuntimeError):
+        sweep(make_args(projections=str(directory), sweep_region=(1, 2, 1), sweep_rows=(8,),
+                        output=str(tmpdir.join('out.h5'))))
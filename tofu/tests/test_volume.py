@@ -0,0 +1,130 @@
+import threading
+import numpy as np
+import pytest
+from tofu.volume import get_volume_writer, is_volume_output, split_volume_filename
+
+
+def test_is_volume_output():
+    assert is_volume_output('out/volume.h5')
+    assert is_volume_output('out/volume.hdf5:/data/slices')
+    assert is_volume_output('out/volume.zarr/')
+    assert not is_volume_output('out/slice-%04i.tif')
+    assert not is_volume_output('out/volume.tif')
+
+
+def test_split_volume_filename():
+    assert split_volume_filename('volume.h5') == ('volume.h5', 'volume')
+    assert split_volume_filename('volume.h5:/data/slices') == ('volume.h5', 'data/slices')
+
+
+def write_regions(writer, regions):
+    """Write *regions* given as (start, stop) concurrently, slice i has value i."""
+    def write(start, stop):
+        with writer.region(start) as region:
+            for i in range(start, stop):
+                region.save(np.full(writer.shape[1:], i, dtype=np.float32))
+
+    threads = [threading.Thread(target=write, args=region) for region in regions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_hdf5(tmpdir, compression):
+    h5py = pytest.importorskip('h5py')
+    filename = str(tmpdir.join('volume.h5'))
+    writer = get_volume_writer(filename + ':/reco', (10, 4, 5), np.float32, chunk_slices=3,
+                               compression=compression, attrs={'region': [0., 10., 1.]})
+    write_regions(writer, [(7, 10), (0, 4), (4, 7)])
+
+    with h5py.File(filename, 'r') as f:
+        data = f['reco']
+        assert data.chunks == (3, 4, 5)
+        assert data.attrs['region'].tolist() == [0., 10., 1.]
+        np.testing.assert_equal(data[:, 0, 0], np.arange(10))
+
+
+def test_zarr(tmpdir):
+    zarr = pytest.importorskip('zarr')
+    filename = str(tmpdir.join('volume.zarr'))
+    writer = get_volume_writer(filename, (10, 4, 5), np.float32, chunk_slices=4,
+                               attrs={'z_parameter': 'z'})
+    write_regions(writer, [(0, 3), (3, 5), (5, 9), (9, 10)])
+
+    data = zarr.open_group(filename, mode='r')['volume']
+    assert data.chunks == (4, 4, 5)
+    assert data.attrs['z_parameter'] == 'z'
+    np.testing.assert_equal(data[:, 0, 0], np.arange(10))
+
+
+def test_resume(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    filename = str(tmpdir.join('volume.h5'))
+    write_regions(get_volume_writer(filename, (10, 4, 5), np.float32), [(0, 5)])
+    # Same shape keeps the written slices
+    write_regions(get_volume_writer(filename, (10, 4, 5), np.float32, resume=True), [(5, 10)])
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_equal(f['volume'][:, 0, 0], np.arange(10))
+
+    # Different shape starts from scratch
+    write_regions(get_volume_writer(filename, (8, 4, 5), np.float32, resume=True), [(5, 8)])
+    with h5py.File(filename, 'r') as f:
+        np.testing.assert_equal(f['volume'][:5, 0, 0], np.zeros(5))
+
+
+class FakeOutput(object):
+    """Ufo.OutputTask and scheduler stand-in which produces *num_slices* slices. Like the UFO output
+    task, it has a pool of two buffers, so the graph cannot finish unless they are released.
+    """
+    def __init__(self, num_slices):
+        import queue
+        self.num_slices = num_slices
+        self.queue = queue.Queue()
+        self.free = threading.Semaphore(2)
+        self.aborted = False
+
+    def run(self, graph):
+        for i in range(self.num_slices):
+            self.free.acquire()
+            self.queue.put(np.full((4, 5), i, dtype=np.float32))
+
+    def abort(self):
+        self.aborted = True
+
+    def get_output_buffer(self):
+        return self.queue.get()
+
+    def release_output_buffer(self, buf):
+        self.free.release()
+
+
+@pytest.mark.parametrize('num_produced', [3, 2, 6])
+def test_run_with_volume_output(tmpdir, monkeypatch, num_produced):
+    import sys
+    import types
+    h5py = pytest.importorskip('h5py')
+    pytest.importorskip('gi')
+    from tofu import config
+    from tofu.reco import run_with_volume_output
+    ufo = types.ModuleType('ufo')
+    ufo.numpy = types.ModuleType('ufo.numpy')
+    ufo.numpy.asarray = np.asarray
+    monkeypatch.setitem(sys.modules, 'ufo', ufo)
+    monkeypatch.setitem(sys.modules, 'ufo.numpy', ufo.numpy)
+    params = config.Params(sections=('volume-output',)).get_defaults()
+    params.output = str(tmpdir.join('volume.h5'))
+    fake = FakeOutput(num_produced)
+
+    if num_produced >= 3:
+        # Extra slices are ignored
+        assert run_with_volume_output(fake, None, fake, params, 3)
+        with h5py.File(params.output, 'r') as f:
+            np.testing.assert_array_equal(f['volume'][:, 0, 0], [0, 1, 2])
+    else:
+        # Does not hang if there are too few slices
+        with pytest.raises(RuntimeError, match='Expected 3 slices but the reconstruction '
+                                               'produced 2'):
+            run_with_volume_output(fake, None, fake, params, 3, timeout=0.1)
@@ -155,6 +155,31 @@ def read_image(filename):
         raise ValueError('Unsupported image format')
 
 
+def reduce_images(filenames, mode, y=0, height=None, y_step=1, slab_size=2 ** 28):
+    """Reduce images from *filenames* by *mode* ('median' or 'average') to one float32 image with
+    rows *y* to *y* + *height* (all to the bottom if None) with *y_step*. The images are reduced in
+    slabs of rows, so that at most *slab_size* bytes of the stack are in memory at once.
+    """
+    import numpy as np
+
+    images = []
+    for filename in filenames:
+        image = read_image(filename)
+        images.extend(image.reshape((-1,) + image.shape[-2:]))
+    stop = y + height * y_step if height else images[0].shape[0]
+    rows = np.arange(y, min(stop, images[0].shape[0]), y_step)
+    result = np.empty((len(rows), images[0].shape[1]), dtype=np.float32)
+    slab_height = max(1, slab_size // (len(images) * result.shape[1] * 4))
+    reduce_func = np.median if mode == 'median' else np.mean
+
+    for start in range(0, len(rows), slab_height):
+        slab_rows = rows[start:start + slab_height]
+        stack = np.array([image[slab_rows] for image in images], dtype=np.float32)
+        result[start:start + len(slab_rows)] = reduce_func(stack, axis=0)
+
+    return result
+
+
 def get_image_shape(filename):
     """Determine image shape (numpy order) from file *filename*."""
     if filename.lower().endswith('.tif') or filename.lower().endswith('.tiff'):
@@ -304,6 +329,18 @@ def get_scarray_value(scarray, index):
     return scarray[index]
 
 
+def get_scarray_values(scarray, indices):
+    """Vectorized :func:`get_scarray_value`, return values of *scarray* for all *indices* as a
+    float array.
+    """
+    import numpy as np
+    indices = np.asarray(indices)
+    if len(scarray) == 1:
+        return np.full(indices.shape, scarray[0], dtype=float)
+
+    return np.asarray(scarray, dtype=float)[indices]
+
+
 def run_scheduler(scheduler, graph):
     from threading import Thread
 
@@ -0,0 +1,232 @@
+"""Chunked volume output in HDF5 or Zarr format."""
+import logging
+import os
+import numpy as np
+from threading import Lock
+
+
+LOG = logging.getLogger(__name__)
+HDF5_EXTENSIONS = ('.h5', '.hdf5', '.hdf')
+ZARR_EXTENSIONS = ('.zarr',)
+DEFAULT_DATASET = 'volume'
+
+
+def split_volume_filename(filename):
+    """Split *filename* in the form path.h5:/dataset into (path, dataset), the dataset defaults to
+    DEFAULT_DATASET.
+    """
+    path, sep, dataset = filename.partition(':')
+    dataset = dataset.strip('/') or DEFAULT_DATASET
+
+    return path, dataset
+
+
+def is_volume_output(filename):
+    """Is *filename* an HDF5 or Zarr volume (optionally with :/dataset suffix)?"""
+    path = split_volume_filename(filename)[0].lower().rstrip('/')
+
+    return path.endswith(HDF5_EXTENSIONS + ZARR_EXTENSIONS)
+
+
+def get_volume_writer(filename, shape, dtype, chunk_slices=1, compression='none', attrs=None,
+                      resume=False):
+    """Create a volume writer for *filename* (HDF5 or Zarr based on the extension) with volume
+    *shape* (slices, height, width) and *dtype*. The volume is chunked by *chunk_slices* slices and
+    compressed by *compression* ('none', 'gzip' or 'lzf'). *attrs* is a dictionary of metadata
+    stored with the volume. If *resume* is True, an existing data set with the same shape and dtype
+    is kept, so that the already written slices remain.
+    """
+    path = split_volume_filename(filename)[0].lower().rstrip('/')
+    if path.endswith(HDF5_EXTENSIONS):
+        cls = HDF5VolumeWriter
+    elif path.endswith(ZARR_EXTENSIONS):
+        cls = ZarrVolumeWriter
+    else:
+        raise ValueError("Unknown volume format of `{}'".format(filename))
+
+    return cls(filename, shape, dtype, chunk_slices=chunk_slices, compression=compression,
+               attrs=attrs, resume=resume)
+
+
+class VolumeWriter(object):
+    """Base class of chunked volume writers, subclasses implement :meth:`_write` and
+    :meth:`close`. Slices of different regions can be written from different threads in any order,
+    each of them through its own :meth:`region`.
+    """
+    def __init__(self, filename, shape, dtype, chunk_slices=1, compression='none', attrs=None,
+                 resume=False):
+        self.filename = filename
+        self.resume = resume
+        self.path, self.dataset = split_volume_filename(filename)
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_slices = max(1, min(chunk_slices, self.shape[0]))
+        self.chunks = (self.chunk_slices,) + self.shape[1:]
+        self.compression = compression
+        self.attrs = attrs or {}
+        self.aborted = False
+        self._locks = {}
+        self._locks_lock = Lock()
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        LOG.debug("Writing %s volume %s with chunks %s to `%s'", self.dtype, self.shape,
+                  self.chunks, self.filename)
+
+    def region(self, start):
+        """Get a :class:`RegionWriter` for slices starting at index *start*."""
+        return RegionWriter(self, start)
+
+    def write(self, start, data):
+        """Write slices *data* (slices, height, width) starting at slice index *start*. Chunks
+        which are shared with other regions are updated under a lock.
+        """
+        if self.aborted:
+            return
+        stop = start + len(data)
+        partial = set()
+        if start % self.chunk_slices:
+            partial.add(start // self.chunk_slices)
+        if stop % self.chunk_slices and stop != self.shape[0]:
+            partial.add((stop - 1) // self.chunk_slices)
+        locks = [self._get_lock(index) for index in sorted(partial)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            self._write(start, data)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def abort(self):
+        """Don't write anything anymore."""
+        self.aborted = True
+
+    def flush(self):
+        """Make sure the written slices are stored."""
+        pass
+
+    def close(self):
+        raise NotImplementedError
+
+    def _can_resume(self, data):
+        """Can the existing *data* set be kept?"""
+        return self.resume and tuple(data.shape) == self.shape and data.dtype == self.dtype
+
+    def _get_lock(self, chunk_index):
+        with self._locks_lock:
+            if chunk_index not in self._locks:
+                self._locks[chunk_index] = Lock()
+
+            return self._locks[chunk_index]
+
+    def _write(self, start, data):
+        raise NotImplementedError
+
+
+class RegionWriter(object):
+    """Collect slices of one region and write them to *volume* starting at slice index *start*
+    whenever a chunk boundary is reached, so that chunks are written as a whole if possible.
+    """
+    def __init__(self, volume, start):
+        self.volume = volume
+        self.start = start
+        self._slices = []
+
+    def save(self, data):
+        self._slices.append(np.array(data, dtype=self.volume.dtype))
+        if (self.start + len(self._slices)) % self.volume.chunk_slices == 0:
+            self.flush()
+
+    def flush(self):
+        if self._slices:
+            self.volume.write(self.start, np.stack(self._slices))
+            self.start += len(self._slices)
+            self._slices = []
+
+    def close(self):
+        self.flush()
+        self.volume.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HDF5VolumeWriter(VolumeWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import h5py
+        except ImportError:
+            raise RuntimeError('You must install h5py to be able to write HDF5 output')
+        if self.compression not in ('none', 'gzip', 'lzf'):
+            raise ValueError("Unsupported HDF5 compression `{}'".format(self.compression))
+        self._lock = Lock()
+        self._file = h5py.File(self.path, 'a')
+        if self.dataset in self._file and self._can_resume(self._file[self.dataset]):
+            LOG.debug("Resuming writing of `%s'", self.filename)
+            self._data = self._file[self.dataset]
+        else:
+            if self.dataset in self._file:
+                del self._file[self.dataset]
+            compression = None if self.compression == 'none' else self.compression
+            self._data = self._file.create_dataset(self.dataset, shape=self.shape,
+                                                   dtype=self.dtype, chunks=self.chunks,
+                                                   compression=compression)
+        for key, value in self.attrs.items():
+            self._data.attrs[key] = value
+
+    def _write(self, start, data):
+        # HDF5 library is not thread-safe
+        with self._lock:
+            self._data[start:start + len(data)] = data
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ZarrVolumeWriter(VolumeWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import zarr
+        except ImportError:
+            raise RuntimeError('You must install zarr to be able to write Zarr output')
+        kwargs = {}
+        zarr_v3 = int(zarr.__version__.split('.')[0]) >= 3
+        if self.compression == 'none':
+            kwargs['compressors' if zarr_v3 else 'compressor'] = None
+        elif self.compression == 'gzip':
+            if zarr_v3:
+                kwargs['compressors'] = zarr.codecs.GzipCodec()
+            else:
+                import numcodecs
+                kwargs['compressor'] = numcodecs.GZip()
+        else:
+            raise ValueError("Unsupported Zarr compression `{}'".format(self.compression))
+        root = zarr.open_group(self.path, mode='a')
+        if self.dataset in root and self._can_resume(root[self.dataset]):
+            LOG.debug("Resuming writing of `%s'", self.filename)
+            self._data = root[self.dataset]
+        else:
+            if self.dataset in root:
+                del root[self.dataset]
+            create = root.create_array if zarr_v3 else root.create_dataset
+            self._data = create(self.dataset, shape=self.shape, dtype=self.dtype,
+                                chunks=self.chunks, **kwargs)
+        self._data.attrs.update(self.attrs)
+
+    def _write(self, start, data):
+        # Different chunks can be written concurrently
+        self._data[start:start + len(data)] = data
+
+    def close(self):
+        pass